@@ -0,0 +1,172 @@
+"""
+Server-side ad selection (``GET /ads/``).
+
+Every category and subcategory has an in-memory pool of the creatives that
+may be served: images with a non-zero ``priority`` whose owner has an active
+subscription, weighted by ``priority``. A pool is an alias table (Vose's
+method), so drawing a creative is O(1) whatever the size of the pool.
+
+Pools are built lazily, per process, and carry the version token of their
+category or subcategory in the shared cache. Writes that change a pool bump
+only that token (see signals.py), and the next selection rebuilds just that
+pool. A pool is also rebuilt once the first of its owners' subscriptions
+runs out, so lapsed subscribers stop being served without any write, and
+in any case once it is ADS_POOL_MAX_AGE seconds old, which bounds how long
+changes made without signals (bulk updates, raw SQL) go unnoticed.
+"""
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ImageUpload, subscription_q
+
+# token bumped by invalidate_all(), part of every pool's version
+ALL_KEY = 'ads:version:all'
+
+
+class AliasTable:
+    """Weighted sampling in O(1) per draw after an O(n) build."""
+    __slots__ = ('items', 'weights', 'probability', 'alias')
+
+    def __init__(self, items, weights):
+        self.items, self.weights = items, weights
+        count, total = len(weights), sum(weights)
+        scaled = [weight * count / total for weight in weights] if total else []
+        self.probability, self.alias = [1.0] * count, list(range(count))
+        small = [index for index, value in enumerate(scaled) if value < 1]
+        large = [index for index, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less], self.alias[less] = scaled[less], more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        # whatever is left is 1 up to rounding
+
+    def __len__(self):
+        return len(self.items)
+
+    def draw(self, rng=random):
+        column = int(rng.random() * len(self.items))
+        return self.items[column] if rng.random() < self.probability[column] else self.items[self.alias[column]]
+
+    def sample(self, count, rng=random):
+        """``min(count, len(self))`` distinct items, each draw weighted."""
+        if count >= len(self.items):
+            # weighted shuffle of the whole (small) pool
+            return weighted_shuffle(self.items, self.weights, rng)
+        chosen = {}
+        # duplicates are redrawn
+        for _ in range(count * 20):
+            chosen[self.draw(rng)] = None
+            if len(chosen) == count:
+                return list(chosen)
+        # heavily skewed weights keep hitting the same few items, draw the
+        # rest without replacement from what is left
+        rest = [(item, weight) for item, weight in zip(self.items, self.weights) if item not in chosen]
+        return list(chosen) + weighted_shuffle(*zip(*rest), rng)[:count - len(chosen)]
+
+
+def weighted_shuffle(items, weights, rng=random):
+    """``items`` in a random order where heavier items tend to come first (Efraimidis-Spirakis)."""
+    keys = {item: rng.random() ** (1 / weight) for item, weight in zip(items, weights)}
+    return sorted(items, key=keys.__getitem__, reverse=True)
+
+
+class Pool:
+    __slots__ = ('table', 'version', 'valid_until', 'expires_at')
+
+    def __init__(self, table, version, valid_until, expires_at):
+        self.table, self.version, self.valid_until = table, version, valid_until
+        self.expires_at = expires_at
+
+    def is_current(self, version, today, now):
+        return (self.version == version and self.expires_at > now
+                and (self.valid_until is None or self.valid_until >= today))
+
+
+_pools = {}
+_build_lock = threading.Lock()
+
+
+def get_ads_cache():
+    return caches[getattr(settings, 'ADS_CACHE_ALIAS', 'default')]
+
+
+def version_key(scope, pk):
+    return f'ads:version:{scope}:{pk}'
+
+
+def get_version(cache, scope, pk):
+    keys = [version_key(scope, pk), ALL_KEY]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            versions[key] = cache.get(key)
+    return tuple(versions[key] for key in keys)
+
+
+def build_pool(scope, pk, version):
+    rows = (ImageUpload.objects
+            .filter(**{f'{scope}_id': pk}, priority__gt=0)
+            .filter(subscription_q('active', prefix='user__subscriptions__'))
+            .values_list('id', 'priority', 'user__subscriptions__end_date'))
+    ids, weights, valid_until = [], [], None
+    for image_id, priority, end_date in rows:
+        ids.append(image_id)
+        weights.append(priority)
+        valid_until = end_date if valid_until is None else min(valid_until, end_date)
+    expires_at = time.monotonic() + getattr(settings, 'ADS_POOL_MAX_AGE', 300)
+    return Pool(AliasTable(ids, weights), version, valid_until, expires_at)
+
+
+def get_pool(scope, pk):
+    # the version is read before the rows, a write racing the build bumps it again
+    version = get_version(get_ads_cache(), scope, pk)
+    today, now = timezone.now().date(), time.monotonic()
+    pool = _pools.get((scope, pk))
+    if pool is None or not pool.is_current(version, today, now):
+        with _build_lock:
+            pool = _pools.get((scope, pk))
+            if pool is None or not pool.is_current(version, today, now):
+                pool = _pools[scope, pk] = build_pool(scope, pk, version)
+    return pool
+
+
+def select(scope, pk, count):
+    """Ids of up to ``count`` distinct creatives of the category or subcategory ``pk``."""
+    return get_pool(scope, pk).table.sample(count)
+
+
+def invalidate_pools(categories=(), subcategories=()):
+    """Bump the pools of these categories and subcategories once the current transaction commits."""
+    keys = [version_key('category', pk) for pk in set(categories) if pk is not None]
+    keys += [version_key('subcategory', pk) for pk in set(subcategories) if pk is not None]
+    if not keys:
+        return
+
+    def bump():
+        get_ads_cache().set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+    transaction.on_commit(bump)
+
+
+def invalidate_all():
+    transaction.on_commit(lambda: get_ads_cache().set(ALL_KEY, uuid.uuid4().hex, timeout=None))
+
+
+def invalidate_owners(user_ids):
+    """Bump every pool holding images of these users, e.g. when their subscriptions change."""
+    if not user_ids:
+        return
+    pairs = set(ImageUpload.objects.filter(user_id__in=set(user_ids)).values_list('category_id', 'subcategory_id'))
+    invalidate_pools([category for category, _ in pairs], [subcategory for _, subcategory in pairs])
+
+
+def invalidate_owner(user_id):
+    invalidate_owners([user_id])
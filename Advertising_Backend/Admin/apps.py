@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class AdminConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "Admin"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import db, metrics, signals, slow_queries
+
+        signals.connect()
+        connection_created.connect(db.configure_sqlite, dispatch_uid="configure_sqlite")
+        connection_created.connect(metrics.install_query_wrapper, dispatch_uid="metrics_query_wrapper")
+        connection_created.connect(slow_queries.install, dispatch_uid="slow_query_log")
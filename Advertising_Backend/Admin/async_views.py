@@ -0,0 +1,74 @@
+"""
+Native async versions of the hot read-only endpoints, for ASGI deployments
+(see Backend/asgi.py). They return the same payloads as their DRF
+counterparts in views.py but fetch rows with the async ORM, so a worker is
+not tied up per slow client.
+"""
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import NotFound
+
+from .cache import aget_taxonomy, etag_matches
+from .models import Carousel, Category, ImageUpload, YoutubeVideo
+from .pagination import KeysetPagination
+from .projections import ImageUploadProjection
+from .renderers import FastJSONRenderer
+from .serializers import CarouselSerializer, CategorySerializer, YoutubeVideoSerializer
+
+# same as ImageUploadView.filterset_fields
+IMAGE_FILTER_FIELDS = ('category', 'subcategory', 'id', 'user')
+
+
+def render_json(data, status=200, headers=None):
+    return HttpResponse(FastJSONRenderer().render(data), status=status, content_type='application/json',
+                        headers=headers)
+
+
+@require_GET
+async def image_feed(request):
+    filters, errors = {}, {}
+    for field in IMAGE_FILTER_FIELDS:
+        value = request.GET.get(field)
+        if value in (None, ''):
+            continue
+        try:
+            filters[field] = int(value)
+        except ValueError:
+            errors[field] = ["Enter a number."]
+    if errors:
+        return render_json(errors, status=400)
+
+    projection = ImageUploadProjection(context={'request': request})
+    queryset = projection.values(ImageUpload.objects.filter(**filters))
+    paginator = KeysetPagination()
+    try:
+        page = paginator.get_page_queryset(queryset, request)
+    except NotFound as exc:
+        return render_json({'detail': exc.detail}, status=404)
+    rows = paginator.finish_page([row async for row in page])
+    return render_json(paginator.get_paginated_data(projection.represent(rows)))
+
+
+@require_GET
+async def video_list(request):
+    videos = [video async for video in YoutubeVideo.objects.all()]
+    return render_json(YoutubeVideoSerializer(videos, many=True, context={'request': request}).data)
+
+
+@require_GET
+async def carousel_list(request):
+    carousels = [carousel async for carousel in Carousel.objects.all()]
+    return render_json(CarouselSerializer(carousels, many=True, context={'request': request}).data)
+
+
+@require_GET
+async def category_list(request):
+    async def build():
+        categories = [category async for category in Category.objects.all()]
+        return CategorySerializer(categories, many=True).data
+
+    # shares the cache entry and ETag with CategoryListCreateView
+    etag, data = await aget_taxonomy('categories', build)
+    if etag_matches(request, etag):
+        return HttpResponse(status=304, headers={'ETag': etag})
+    return render_json(data, headers={'ETag': etag})
@@ -0,0 +1,192 @@
+import copy
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+User = get_user_model()
+
+CLAIM_IS_STAFF = 'is_staff'
+
+
+def tokens_for_user(user):
+    """A refresh token (and its access token) carrying the claims read by ClaimsJWTAuthentication."""
+    refresh = RefreshToken.for_user(user)
+    refresh[CLAIM_IS_STAFF] = user.is_staff
+    return refresh
+
+
+# ------------------ account state -------------------
+# Whether a user is active and staff is read from the DB, not from the token,
+# and kept in the shared cache so most requests need no lookup, together with
+# a version token that changes on every write to the user or their
+# subscription (see signals.py). A cache miss, after a restart or an
+# eviction, means "unknown" and costs one query.
+
+def _state_cache():
+    return caches[getattr(settings, 'AUTH_STATE_CACHE_ALIAS', 'default')]
+
+
+def _state_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _state_timeout():
+    return getattr(settings, 'AUTH_STATE_CACHE_TIMEOUT', 300)
+
+
+def set_user_state(user_id, is_active, is_staff):
+    """Record the committed state of a user; ``is_active=False`` for deleted users."""
+    state = (is_active, is_staff, uuid.uuid4().hex)
+    _state_cache().set(_state_key(user_id), state, timeout=_state_timeout())
+    user_cache.discard(user_id)
+
+
+def forget_user_states(user_ids):
+    """Drop the state of these users, e.g. after their subscriptions changed; it is re-read on next use."""
+    _state_cache().delete_many([_state_key(user_id) for user_id in user_ids])
+    for user_id in user_ids:
+        user_cache.discard(user_id)
+
+
+def get_user_state(user_id):
+    """
+    ``(is_active, is_staff, version)`` of the user, ``(False, False, None)``
+    if they do not exist.
+    """
+    cache = _state_cache()
+    state = cache.get(_state_key(user_id))
+    if state is None:
+        row = User.objects.filter(pk=user_id).values_list('is_active', 'is_staff').first()
+        if row is None:
+            return False, False, None
+        state = (*row, uuid.uuid4().hex)
+        # add, not set: a save that committed meanwhile has already stored the newer state
+        if not cache.add(_state_key(user_id), state, timeout=_state_timeout()):
+            state = cache.get(_state_key(user_id)) or state
+    return state
+
+
+# ------------------ user row cache -------------------
+
+class UserCache:
+    """
+    Short-TTL, per-process cache of full user rows (with their subscription),
+    keyed by user id. An entry is only used while the user's state version
+    is the one it was loaded under, so writes seen by any process retire it.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version):
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic() or entry[1] != version:
+            return None
+        # hand out deep copies: views are free to mutate the user and the
+        # related objects cached on it, none of that may reach the next request
+        return copy.deepcopy(entry[2])
+
+    def set(self, user_id, version, user):
+        ttl = getattr(settings, 'AUTH_USER_CACHE_TTL', 30)
+        if ttl <= 0:
+            return
+        user = copy.deepcopy(user)
+        with self._lock:
+            if len(self._entries) >= getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000):
+                self._entries.clear()
+            self._entries[user_id] = (time.monotonic() + ttl, version, user)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+def load_user(user_id, version=None):
+    user = user_cache.get(user_id, version) if version is not None else None
+    if user is None:
+        try:
+            user = User.objects.select_related('subscriptions').get(**{api_settings.USER_ID_FIELD: user_id})
+        except User.DoesNotExist:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if version is not None:
+            user_cache.set(user_id, version, user)
+    if not user.is_active:
+        raise AuthenticationFailed("User is inactive", code="user_inactive")
+    return user
+
+
+class TokenClaimsUser(SimpleLazyObject):
+    """
+    Stands in for the authenticated user. Attributes present in the token
+    claims (id, is_staff, ...) are answered from the token; anything else, or
+    using it as a model instance, loads the full row once.
+    """
+
+    def __init__(self, claims, loader):
+        self.__dict__['_claims'] = claims
+        super().__init__(loader)
+
+    def __getattr__(self, name):
+        if self._wrapped is empty:
+            claims = self.__dict__['_claims']
+            if name in claims:
+                return claims[name]
+        return super().__getattr__(name)
+
+    def __bool__(self):
+        return True
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the signed claims instead of loading the
+    user on every request. Deactivated and deleted users are rejected, and
+    ``is_staff`` answered, from the cached account state; the row is only
+    fetched when a view really uses the user object.
+
+    Tokens issued before the claims existed fall back to the regular lookup.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = User._meta.get_field(api_settings.USER_ID_FIELD).to_python(
+                validated_token[api_settings.USER_ID_CLAIM]
+            )
+        except (KeyError, ValidationError):
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        is_active, is_staff, version = get_user_state(user_id)
+        if not is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+
+        if CLAIM_IS_STAFF not in validated_token:
+            return load_user(user_id, version)
+
+        claims = {
+            'id': user_id,
+            'pk': user_id,
+            # the current flag, not the one the token was issued with
+            'is_staff': is_staff,
+            'is_active': True,
+            'is_authenticated': True,
+            'is_anonymous': False,
+        }
+        return TokenClaimsUser(claims, lambda: load_user(user_id, version))
@@ -3,14 +3,34 @@ from django.contrib.auth import get_user_model
 
 UserModel = get_user_model()
 
+
+def authenticate_identifier(identifier, password):
+    """
+    Return the user matching ``identifier`` (email, phone or username) whose
+    password is ``password``, else None. Does one password hash either way,
+    so response time does not reveal whether the account exists.
+    """
+    user = UserModel.objects.get_by_login_identifier(identifier)
+    if user is None:
+        # same cost as a real check, see ModelBackend.authenticate
+        UserModel().set_password(password)
+        return None
+    # check_password() also re-hashes with the current hasher settings when
+    # the stored hash is outdated (see hashers.py)
+    if not user.check_password(password):
+        return None
+    return user
+
+
 class EmailOrPhoneBackend(ModelBackend):
     def authenticate(self, request, username=None, password=None, **kwargs):
-        # username here could be email or phone
-        try:
-            user = UserModel.objects.get(email=username) if '@' in username else UserModel.objects.get(phone=username)
-        except UserModel.DoesNotExist:
+        # username here could be email, phone or username
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
             return None
 
-        if user.check_password(password) and self.user_can_authenticate(user):
+        user = authenticate_identifier(username, password)
+        if user is not None and self.user_can_authenticate(user):
             return user
         return None
@@ -0,0 +1,29 @@
+"""
+Shared pieces of the capacity benchmark: ``manage.py generate_benchmark_data``
+fills a database with synthetic users, subscriptions, taxonomy and images,
+``manage.py run_benchmark`` drives the API against it and reports per
+endpoint figures as JSON.
+"""
+from io import BytesIO
+
+from PIL import Image
+
+# prefix of every username, category name... the benchmark writes
+MARKER = "bench-"
+# password of every generated user
+PASSWORD = "bench-password"
+
+
+def placeholder_image(seed, size=(64, 64), fmt="JPEG"):
+    """A small solid-colour image, different for every ``seed``."""
+    color = ((seed * 97) % 256, (seed * 57) % 256, (seed * 13) % 256)
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
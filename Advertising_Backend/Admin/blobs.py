@@ -0,0 +1,62 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .images import delete_images, schedule_deletion
+from .models import MediaBlob
+from .storage import is_cas_name
+from .tasks import run_in_background
+
+
+def retain_media(names):
+    """
+    Add references to the blobs in ``names`` (a ``{name: count}`` mapping),
+    in two queries for the common case of one reference per name.
+    """
+    names = {name: count for name, count in names.items() if is_cas_name(name)}
+    if not names:
+        return
+    # make sure every row exists, then bump them together
+    MediaBlob.objects.bulk_create([MediaBlob(name=name) for name in names], ignore_conflicts=True)
+    by_count = {}
+    for name, count in names.items():
+        by_count.setdefault(count, []).append(name)
+    for count, group in by_count.items():
+        MediaBlob.objects.filter(name__in=group).update(refs=F('refs') + count)
+
+
+def release_blob(name, storage, count=1):
+    """Drop ``count`` references; the file goes once nothing points at it."""
+    MediaBlob.objects.filter(name=name).update(refs=F('refs') - count)
+    run_in_background(delete_blob, name, storage)
+
+
+def delete_blob(name, storage):
+    grace = getattr(settings, 'MEDIA_BLOB_DELETE_GRACE', 300)
+    with transaction.atomic():
+        if not MediaBlob.objects.filter(name=name, refs__lte=0).delete()[0]:
+            return
+    # an identical upload that is still being saved re-uses the file and
+    # touches it; leave such blobs to collect_orphan_media
+    try:
+        if time.time() - storage.get_modified_time(name).timestamp() < grace:
+            return
+    except FileNotFoundError:
+        return
+    delete_images([name], storage)
+
+
+def release_media(names, storage):
+    """
+    Give up references to ``names`` (a ``{name: count}`` mapping). Blobs
+    are refcounted, anything stored before deduplication is deleted outright.
+    """
+    legacy = []
+    for name, count in names.items():
+        if is_cas_name(name):
+            release_blob(name, storage, count)
+        else:
+            legacy.append(name)
+    schedule_deletion(legacy, storage)
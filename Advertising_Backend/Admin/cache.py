@@ -0,0 +1,84 @@
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import parse_etags
+from rest_framework.utils.encoders import JSONEncoder
+
+# Every cached taxonomy payload is keyed by the current version token. Writes
+# just swap the token, so all workers stop seeing the old entries at once and
+# the stale ones age out of the backend on their own.
+TAXONOMY_VERSION_KEY = 'taxonomy:version'
+
+
+def get_taxonomy_cache():
+    return caches[getattr(settings, 'TAXONOMY_CACHE_ALIAS', 'default')]
+
+
+def get_taxonomy_version(cache=None):
+    cache = cache or get_taxonomy_cache()
+    version = cache.get(TAXONOMY_VERSION_KEY)
+    if version is None:
+        cache.add(TAXONOMY_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(TAXONOMY_VERSION_KEY)
+    return version
+
+
+def invalidate_taxonomy():
+    get_taxonomy_cache().set(TAXONOMY_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def make_etag(data):
+    body = json.dumps(data, cls=JSONEncoder, separators=(',', ':'), ensure_ascii=False)
+    return '"%s"' % hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def etag_matches(request, etag):
+    """
+    If-None-Match check with weak comparison, so the ``W/`` form that
+    CompressionMiddleware sends for compressed bodies still gets a 304.
+    """
+    def opaque(tag):
+        return tag[2:] if tag.startswith('W/') else tag
+
+    tags = parse_etags(request.headers.get('If-None-Match', ''))
+    return '*' in tags or opaque(etag) in {opaque(tag) for tag in tags}
+
+
+def get_taxonomy(name, build):
+    """
+    Return ``(etag, data)`` for the taxonomy payload ``name``.
+
+    ``build`` is only called on a miss; its result must be JSON serializable.
+    """
+    cache = get_taxonomy_cache()
+    key = f'taxonomy:{name}:{get_taxonomy_version(cache)}'
+    entry = cache.get(key)
+    if entry is None:
+        data = build()
+        entry = (make_etag(data), data)
+        cache.set(key, entry, getattr(settings, 'TAXONOMY_CACHE_TIMEOUT', None))
+    return entry
+
+
+async def aget_taxonomy_version(cache=None):
+    cache = cache or get_taxonomy_cache()
+    version = await cache.aget(TAXONOMY_VERSION_KEY)
+    if version is None:
+        await cache.aadd(TAXONOMY_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = await cache.aget(TAXONOMY_VERSION_KEY)
+    return version
+
+
+async def aget_taxonomy(name, build):
+    """Async form of get_taxonomy(); ``build`` is a coroutine function."""
+    cache = get_taxonomy_cache()
+    key = f'taxonomy:{name}:{await aget_taxonomy_version(cache)}'
+    entry = await cache.aget(key)
+    if entry is None:
+        data = await build()
+        entry = (make_etag(data), data)
+        await cache.aset(key, entry, getattr(settings, 'TAXONOMY_CACHE_TIMEOUT', None))
+    return entry
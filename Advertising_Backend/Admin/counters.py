@@ -0,0 +1,153 @@
+"""
+Write-behind impression and click counters.
+
+Events are added up in memory per (kind, creative, time bucket) and a
+background thread flushes them to CreativeStat every COUNTER_FLUSH_INTERVAL
+seconds, or as soon as COUNTER_FLUSH_SIZE distinct keys are waiting, with
+one ``INSERT ... ON CONFLICT DO UPDATE`` per batch that adds to the stored
+counts. At interpreter exit the flusher is stopped, any flush it is in the
+middle of completes, and whatever is still pending is flushed (retried a few
+times), so a worker that shuts down cleanly loses nothing. Counts are per
+process until flushed: reports lag by up to one flush interval.
+"""
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+from .models import CreativeStat
+
+logger = logging.getLogger(__name__)
+
+EVENTS = ('impression', 'click')
+# rows per INSERT, well under SQLite's bound parameter limit
+UPSERT_BATCH = 500
+# attempts of the final flush at exit, and how long to wait for the flusher to finish
+CLOSE_ATTEMPTS = 3
+CLOSE_TIMEOUT = 30
+
+
+def bucket_start(when, seconds):
+    timestamp = int(when.timestamp())
+    return datetime.fromtimestamp(timestamp - timestamp % seconds, tz=timezone.utc)
+
+
+def upsert(counts):
+    """Add ``{(kind, creative_id, bucket): [impressions, clicks]}`` to CreativeStat."""
+    meta = CreativeStat._meta
+    quote = connection.ops.quote_name
+    table = quote(meta.db_table)
+    columns = ', '.join(quote(meta.get_field(name).column)
+                        for name in ('kind', 'creative_id', 'bucket', 'impressions', 'clicks'))
+    impressions, clicks = quote('impressions'), quote('clicks')
+    bucket_field = meta.get_field('bucket')
+
+    rows = list(counts.items())
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH):
+            batch = rows[start:start + UPSERT_BATCH]
+            params = []
+            for (kind, creative_id, bucket), (impression_count, click_count) in batch:
+                params += [kind, creative_id, bucket_field.get_db_prep_save(bucket, connection),
+                           impression_count, click_count]
+            # same statement on SQLite (3.24+) and PostgreSQL
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))} "
+                f"ON CONFLICT ({quote('kind')}, {quote('creative_id')}, {quote('bucket')}) DO UPDATE SET "
+                f"{impressions} = {table}.{impressions} + excluded.{impressions}, "
+                f"{clicks} = {table}.{clicks} + excluded.{clicks}",
+                params,
+            )
+
+
+class CounterBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # held for a whole flush, so flushes never overlap
+        self.flush_lock = threading.Lock()
+        self.pending = {}
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def add(self, kind, creative_id, event, count=1, when=None):
+        bucket = bucket_start(when or datetime.now(timezone.utc), settings.COUNTER_BUCKET_SECONDS)
+        column = EVENTS.index(event)
+        with self.lock:
+            counts = self.pending.get((kind, creative_id, bucket))
+            if counts is None:
+                counts = self.pending[kind, creative_id, bucket] = [0, 0]
+            counts[column] += count
+            size = len(self.pending)
+            if self.thread is None and not self.stopping.is_set():
+                self.start()
+        if size >= settings.COUNTER_FLUSH_SIZE:
+            self.wakeup.set()
+
+    def start(self):
+        # started on first use, so a server that forks its workers starts one per worker
+        self.thread = threading.Thread(target=self.run, name='admin-counters', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.wakeup.wait(settings.COUNTER_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            if self.stopping.is_set():
+                break
+            try:
+                self.flush()
+            finally:
+                connections.close_all()
+
+    def flush(self):
+        """
+        Write out everything pending. Counts that fail to write are kept for
+        the next flush. Returns whether nothing is left pending.
+        """
+        with self.flush_lock:
+            with self.lock:
+                counts, self.pending = self.pending, {}
+            if not counts:
+                return True
+            try:
+                upsert(counts)
+            except Exception:
+                logger.exception("Could not flush %d creative counters, retrying on the next flush", len(counts))
+                with self.lock:
+                    for key, (impression_count, click_count) in counts.items():
+                        pending = self.pending.setdefault(key, [0, 0])
+                        pending[0] += impression_count
+                        pending[1] += click_count
+                return False
+            return True
+
+    def close(self):
+        """Stop the flusher, let a flush it is running finish, then flush what is left."""
+        self.stopping.set()
+        self.wakeup.set()
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(CLOSE_TIMEOUT)
+            if thread.is_alive():
+                logger.error("The creative counter flusher did not stop, %d counters not flushed", len(self.pending))
+                return
+        for _ in range(CLOSE_ATTEMPTS):
+            if self.flush():
+                return
+        logger.error("Lost %d creative counters: the final flush failed %d times", len(self.pending), CLOSE_ATTEMPTS)
+
+
+buffer = CounterBuffer()
+atexit.register(buffer.close)
+
+
+def record(kind, creative_id, event, count=1):
+    buffer.add(kind, creative_id, event, count)
+
+
+def flush():
+    buffer.flush()
@@ -0,0 +1,10 @@
+from django.conf import settings
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS to every new SQLite connection (busy timeout, WAL if enabled, ...)."""
+    if connection.vendor != "sqlite":
+        return
+    # straight on the DB-API connection, these should not show up as app queries
+    for name, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+        connection.connection.execute(f"PRAGMA {name}={value}")
@@ -0,0 +1,49 @@
+import django_filters
+from django.contrib.auth import get_user_model
+
+from .models import Subscription, subscription_q
+
+User = get_user_model()
+
+SUBSCRIPTION_STATUS_CHOICES = [
+    ('active', 'Active'),
+    ('expired', 'Expired'),
+    ('revoked', 'Revoked'),
+]
+# upper bound of expiring_within, anything past it would overflow the date arithmetic
+EXPIRING_WITHIN_MAX_DAYS = 3650
+
+
+class SubscriptionFilter(django_filters.FilterSet):
+    status = django_filters.ChoiceFilter(choices=SUBSCRIPTION_STATUS_CHOICES, method='filter_status')
+    expiring_within = django_filters.NumberFilter(min_value=0, max_value=EXPIRING_WITHIN_MAX_DAYS,
+                                                  method='filter_expiring_within',
+                                                  label='Active and ending within this many days')
+
+    prefix = ''
+
+    class Meta:
+        model = Subscription
+        fields = ['plan', 'revoke', 'user']
+
+    def filter_status(self, queryset, name, value):
+        return queryset.filter(subscription_q(value, prefix=self.prefix))
+
+    def filter_expiring_within(self, queryset, name, value):
+        return queryset.filter(subscription_q('expiring', prefix=self.prefix, days=int(value)))
+
+
+class UserFilter(django_filters.FilterSet):
+    subscription_status = django_filters.ChoiceFilter(choices=SUBSCRIPTION_STATUS_CHOICES,
+                                                      method='filter_status')
+    subscription_expiring_within = django_filters.NumberFilter(min_value=0, max_value=EXPIRING_WITHIN_MAX_DAYS,
+                                                               method='filter_expiring_within',
+                                                               label='Active and ending within this many days')
+
+    prefix = 'subscriptions__'
+    filter_status = SubscriptionFilter.filter_status
+    filter_expiring_within = SubscriptionFilter.filter_expiring_within
+
+    class Meta:
+        model = User
+        fields = ['username', 'email', 'phone', 'id']
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher
+
+# The cost parameters come from settings, so they can be tuned per deployment
+# (see the benchmark_password_hashers command). When they change, stored hashes
+# report must_update() and are upgraded on the user's next successful login
+# by AbstractBaseUser.check_password().
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return getattr(settings, "PASSWORD_PBKDF2_ITERATIONS", None) or PBKDF2PasswordHasher.iterations
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return getattr(settings, "PASSWORD_ARGON2_TIME_COST", None) or Argon2PasswordHasher.time_cost
+
+    @property
+    def memory_cost(self):
+        return getattr(settings, "PASSWORD_ARGON2_MEMORY_COST", None) or Argon2PasswordHasher.memory_cost
+
+    @property
+    def parallelism(self):
+        return getattr(settings, "PASSWORD_ARGON2_PARALLELISM", None) or Argon2PasswordHasher.parallelism
@@ -0,0 +1,147 @@
+"""
+The launch payload for the mobile app (``GET /home/``): carousels,
+categories, subcategories, videos and the first page of the image feed in
+one response.
+
+Every section is cached as rendered JSON under its own version token, and
+the assembled, gzipped response is cached under the combination of those
+tokens. A write only bumps the tokens of the sections it affects (see
+SECTION_MODELS and signals.py), so the next request re-renders just those
+sections and splices them together with the cached rest.
+
+The cached payload is shared by every client, so its URLs must not depend
+on the Host header (ALLOWED_HOSTS accepts anything): they are built from
+SITE_URL, or left as paths when it is unset.
+"""
+import gzip
+import hashlib
+import uuid
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.urls import reverse
+from rest_framework.utils.urls import replace_query_param
+
+from .models import Carousel, Category, ImageUpload, SubCategory, YoutubeVideo
+from .pagination import KeysetPagination
+from .projections import ImageUploadProjection
+from .renderers import FastJSONRenderer
+from .serializers import (
+    CarouselSerializer, CategorySerializer, SubCategorySerializer, YoutubeVideoSerializer,
+)
+
+SECTIONS = ('carousels', 'categories', 'subcategories', 'videos', 'images')
+
+# sections whose payload includes data from each model
+SECTION_MODELS = {
+    Carousel: ('carousels',),
+    Category: ('categories', 'subcategories', 'images'),
+    SubCategory: ('subcategories', 'images'),
+    YoutubeVideo: ('videos',),
+    ImageUpload: ('images',),
+}
+
+
+def get_home_cache():
+    return caches[getattr(settings, 'HOME_CACHE_ALIAS', 'default')]
+
+
+def version_key(section):
+    return f'home:version:{section}'
+
+
+def get_versions(cache):
+    keys = [version_key(section) for section in SECTIONS]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def invalidate_sections(sections):
+    """Bump the version of ``sections`` once the current transaction commits."""
+    def bump():
+        get_home_cache().set_many({version_key(section): uuid.uuid4().hex for section in sections}, timeout=None)
+    transaction.on_commit(bump)
+
+
+class SiteRequest:
+    """The request as the section builders see it, with SITE_URL as the base of absolute URLs."""
+
+    def __init__(self, request, site_url):
+        self._request = request
+        self.site_url = site_url
+
+    def build_absolute_uri(self, location=None):
+        if location is None:
+            location = self._request.get_full_path()
+        return urljoin(self.site_url, location) if self.site_url else location
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+def build_images(request):
+    paginator = KeysetPagination()
+    paginator.page_size_value = paginator.page_size
+    projection = ImageUploadProjection(context={'request': request})
+    rows = paginator.finish_page(
+        projection.values(ImageUpload.objects.order_by('-uploaded_at', '-id'))[:paginator.page_size + 1]
+    )
+    next_link = None
+    if paginator.next_cursor is not None:
+        url = request.build_absolute_uri(reverse('image-upload'))
+        next_link = replace_query_param(url, paginator.cursor_query_param, paginator.next_cursor)
+    return {'next': next_link, 'results': projection.represent(rows)}
+
+
+BUILDERS = {
+    'carousels': lambda request: CarouselSerializer(
+        Carousel.objects.all(), many=True, context={'request': request}).data,
+    'categories': lambda request: CategorySerializer(Category.objects.all(), many=True).data,
+    'subcategories': lambda request: SubCategorySerializer(SubCategory.objects.all(), many=True).data,
+    'videos': lambda request: YoutubeVideoSerializer(
+        YoutubeVideo.objects.all(), many=True, context={'request': request}).data,
+    'images': build_images,
+}
+
+
+def get_home_payload(request):
+    """
+    Return ``(etag, gzipped_json)`` for the home payload.
+
+    Entries are kept per SITE_URL, so changing it never serves stale links.
+    """
+    cache = get_home_cache()
+    timeout = getattr(settings, 'HOME_CACHE_TIMEOUT', None)
+    base = getattr(settings, 'SITE_URL', '')
+    request = SiteRequest(request, base)
+    versions = get_versions(cache)
+    digest = hashlib.sha1('|'.join([base, *versions]).encode()).hexdigest()
+    blob_key = f'home:blob:{digest}'
+
+    blob = cache.get(blob_key)
+    if blob is None:
+        section_keys = {
+            section: f'home:section:{section}:{version}:{hashlib.sha1(base.encode()).hexdigest()}'
+            for section, version in zip(SECTIONS, versions)
+        }
+        rendered = cache.get_many(section_keys.values())
+        missing = {}
+        renderer = FastJSONRenderer()
+        for section, key in section_keys.items():
+            if key not in rendered:
+                rendered[key] = missing[key] = renderer.render(BUILDERS[section](request))
+        if missing:
+            cache.set_many(missing, timeout)
+
+        body = b'{' + b','.join(
+            b'"%s":%s' % (section.encode(), rendered[key]) for section, key in section_keys.items()
+        ) + b'}'
+        blob = gzip.compress(body, compresslevel=getattr(settings, 'HOME_GZIP_LEVEL', 6))
+        cache.set(blob_key, blob, timeout)
+    return f'"{digest}"', blob
@@ -0,0 +1,150 @@
+import re
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .tasks import run_in_background
+
+# Derivatives live next to the original: uploads/photo.jpg -> uploads/photo.jpg.w320.webp
+# Keeping the full original name in the variant name lets variant_source()
+# map any variant back to the file it was made from.
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+VARIANT_NAME_RE = re.compile(r'\.w\d+\.(webp|jpg)$')
+# originals whose variants are known to be on disk, see variants_ready()
+READY_CACHE_SIZE = 100_000
+_ready = set()
+
+
+def get_variant_widths():
+    return tuple(getattr(settings, 'IMAGE_VARIANT_WIDTHS', (320, 640, 1080)))
+
+
+def is_variant_name(name):
+    return bool(VARIANT_NAME_RE.search(name))
+
+
+def variant_name(name, width, fmt):
+    return f"{name}.w{width}.{VARIANT_FORMATS[fmt][1]}"
+
+
+def variant_source(name):
+    """The original a variant was made from; originals map to themselves."""
+    return VARIANT_NAME_RE.sub('', name)
+
+
+def variant_names(name):
+    """All derivative names of ``name``, as ``{width: {format: name}}``."""
+    return {
+        width: {fmt: variant_name(name, width, fmt) for fmt in VARIANT_FORMATS}
+        for width in get_variant_widths()
+    }
+
+
+def last_variant_name(name):
+    """The variant generate_variants() writes last; once it exists, all of them do."""
+    return variant_name(name, get_variant_widths()[-1], list(VARIANT_FORMATS)[-1])
+
+
+def variants_ready(name, storage=None):
+    """
+    Whether the variants of ``name`` have been written. Until then (or after
+    a failed generation) their URLs would 404, so they are not advertised.
+    Positive answers are remembered, the check costs one stat per image.
+    """
+    if not name:
+        return False
+    if name in _ready:
+        return True
+    storage = storage or default_storage
+    if not storage.exists(last_variant_name(name)):
+        return False
+    if len(_ready) >= READY_CACHE_SIZE:
+        _ready.clear()
+    _ready.add(name)
+    return True
+
+
+def generate_variants(name, storage=None, force=False):
+    """
+    Write every missing fixed-width variant of the image ``name``.
+
+    Images narrower than a variant width are not upscaled; the variant is
+    saved at the original width so every advertised URL exists.
+    Returns the number of files written.
+    """
+    storage = storage or default_storage
+    widths = get_variant_widths()
+    wanted = [
+        (width, fmt, variant_name(name, width, fmt))
+        for width in widths for fmt in VARIANT_FORMATS
+    ]
+    if not force:
+        wanted = [item for item in wanted if not storage.exists(item[2])]
+    if not wanted:
+        return 0
+
+    quality = getattr(settings, 'IMAGE_VARIANT_QUALITY', 80)
+    written = 0
+    with storage.open(name, 'rb') as fh:
+        image = Image.open(fh)
+        # let the JPEG decoder downscale while decoding, much cheaper than a full decode
+        largest = max(width for width, _, _ in wanted)
+        if image.width > largest:
+            image.draft('RGB', (largest, image.height * largest // image.width))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        for width, fmt, target in wanted:
+            resized = image
+            if image.width > width:
+                resized = image.resize((width, max(1, image.height * width // image.width)), Image.LANCZOS)
+            if fmt == 'jpeg' and resized.mode != 'RGB':
+                resized = resized.convert('RGB')
+
+            buffer = BytesIO()
+            resized.save(buffer, format=VARIANT_FORMATS[fmt][0], quality=quality)
+            if storage.exists(target):
+                storage.delete(target)
+            storage.save(target, ContentFile(buffer.getvalue()))
+            written += 1
+    return written
+
+
+def make_variants(name, storage=None, on_ready=None):
+    if generate_variants(name, storage) and on_ready is not None:
+        on_ready()
+
+
+def schedule_variants(name, storage=None, on_ready=None):
+    """
+    Generate the variants of ``name`` in the background. ``on_ready()`` runs
+    once new ones are written, e.g. to drop cached payloads that left them out.
+    """
+    if name:
+        run_in_background(make_variants, name, storage, on_ready)
+
+
+def delete_images(names, storage=None):
+    """Remove stored images together with all of their variants."""
+    storage = storage or default_storage
+    for name in names:
+        _ready.discard(name)
+        for target in [name] + [n for names in variant_names(name).values() for n in names.values()]:
+            storage.delete(target)
+
+
+def schedule_deletion(names, storage=None):
+    """
+    Queue ``names`` (and their variants) for removal once the current
+    transaction commits; a rolled back delete keeps its files.
+    """
+    names = [name for name in names if name]
+    if names:
+        run_in_background(delete_images, names, storage)
@@ -0,0 +1,73 @@
+import json
+import time
+
+from django.contrib.auth.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher, get_hasher
+from django.core.management.base import BaseCommand, CommandError
+
+
+def pbkdf2_candidate(iterations):
+    return f"pbkdf2 iterations={iterations}", type("Candidate", (PBKDF2PasswordHasher,), {"iterations": iterations})()
+
+
+def argon2_candidate(spec):
+    try:
+        time_cost, memory_cost, parallelism = (int(part) for part in spec.split(":"))
+    except ValueError:
+        raise CommandError(f"--argon2 expects time:memory_kib:parallelism, got {spec!r}")
+    attrs = {"time_cost": time_cost, "memory_cost": memory_cost, "parallelism": parallelism}
+    return f"argon2 t={time_cost} m={memory_cost}KiB p={parallelism}", type("Candidate", (Argon2PasswordHasher,), attrs)()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure password hashes per second on one core for the configured hasher and "
+        "candidate cost settings, to size login capacity."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--duration", type=float, default=3.0, help="Seconds spent on each candidate.")
+        parser.add_argument("--pbkdf2-iterations", type=int, nargs="*", default=[260000, 600000, 1000000])
+        parser.add_argument("--argon2", nargs="*", default=["2:19456:1", "2:65536:1", "3:102400:8"],
+                            metavar="T:M:P", help="time_cost:memory_cost_kib:parallelism")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+
+    def measure(self, hasher, duration):
+        salt = hasher.salt()
+        hashes = 0
+        started = time.process_time()
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            hasher.encode("benchmark-password", salt)
+            hashes += 1
+        cpu = time.process_time() - started
+        return hashes, cpu
+
+    def handle(self, *args, **options):
+        candidates = [("configured (" + get_hasher().algorithm + ")", get_hasher())]
+        candidates += [pbkdf2_candidate(n) for n in options["pbkdf2_iterations"]]
+        try:
+            import argon2  # noqa: F401
+        except ImportError:
+            if options["argon2"]:
+                self.stderr.write("argon2-cffi is not installed, skipping argon2 candidates.")
+        else:
+            candidates += [argon2_candidate(spec) for spec in options["argon2"]]
+
+        results = []
+        for label, hasher in candidates:
+            hashes, cpu = self.measure(hasher, options["duration"])
+            per_second = hashes / cpu if cpu else 0.0
+            results.append({
+                "hasher": label,
+                "hashes": hashes,
+                "cpu_seconds": round(cpu, 3),
+                "hashes_per_second_per_core": round(per_second, 2),
+                "ms_per_hash": round(1000 / per_second, 2) if per_second else None,
+            })
+            if not options["json"]:
+                self.stdout.write(
+                    f"{label:<40} {per_second:>9.1f} hashes/s/core  {1000 / per_second if per_second else 0:>8.1f} ms/hash"
+                )
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,101 @@
+import json
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from Admin.models import Category, ImageUpload, SubCategory, Subscription
+from Admin.projections import ImageUploadProjection, SubscriptionProjection, UserProjection
+from Admin.renderers import FastJSONRenderer
+from Admin.serializers import ImageUploadSerializer, SubscriptionSerializer, UserSerializer
+
+User = get_user_model()
+MARKER = "benchproj"
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the /images/, /users/ and /subscriptions/ list payloads built by the "
+        "ModelSerializers and by the projections in Admin/projections.py, per 1,000 rows. "
+        "Rows are created inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+
+    def fill(self, rows):
+        category = Category.objects.create(name=f"{MARKER}-category")
+        subcategory = SubCategory.objects.create(category=category, name=f"{MARKER}-subcategory")
+        users = User.objects.bulk_create(
+            User(username=f"{MARKER}{n}", phone=f"8{n:09d}", email=f"{MARKER}{n}@example.com", password="!",
+                 profile_image=f"profile_images/{MARKER}{n}/me.jpg", logo=f"cas/ab/cd/{n:064x}.png")
+            for n in range(rows)
+        )
+        today = timezone.now().date()
+        Subscription.objects.bulk_create(
+            Subscription(user=user, plan="monthly", start_date=today, end_date=today + timedelta(days=n % 60))
+            for n, user in enumerate(users)
+        )
+        ImageUpload.objects.bulk_create(
+            ImageUpload(user=users[n], category=category, subcategory=subcategory, image=f"cas/ab/cd/{n:064x}.jpg")
+            for n in range(rows)
+        )
+        return {
+            "images": (ImageUploadSerializer, ImageUploadProjection,
+                       ImageUpload.objects.select_related("category", "subcategory").filter(category=category)),
+            "users": (UserSerializer, UserProjection,
+                      User.objects.select_related("subscriptions").filter(username__startswith=MARKER)),
+            "subscriptions": (SubscriptionSerializer, SubscriptionProjection,
+                              Subscription.objects.select_related("user").filter(user__username__startswith=MARKER)),
+        }
+
+    def best_of(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - started)
+        return result, min(timings)
+
+    def handle(self, *args, **options):
+        context = {"request": APIRequestFactory().get("/")}
+        renderer = FastJSONRenderer()
+        per_thousand = 1000 / options["rows"]
+        results = []
+
+        with transaction.atomic():
+            for name, (serializer_class, projection_class, queryset) in self.fill(options["rows"]).items():
+                def serialized():
+                    return renderer.render(serializer_class(queryset.all(), many=True, context=context).data)
+
+                def projected():
+                    projection = projection_class(context=context)
+                    return renderer.render(projection.represent(projection.values(queryset.all())))
+
+                expected, serializer_time = self.best_of(serialized, options["repeat"])
+                actual, projection_time = self.best_of(projected, options["repeat"])
+                results.append({
+                    "endpoint": name,
+                    "rows": options["rows"],
+                    "serializer_ms_per_1000": round(serializer_time * per_thousand * 1000, 2),
+                    "projection_ms_per_1000": round(projection_time * per_thousand * 1000, 2),
+                    "speedup": round(serializer_time / projection_time, 2) if projection_time else None,
+                    "identical": actual == expected,
+                })
+            transaction.set_rollback(True)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for row in results:
+            self.stdout.write(
+                f"{row['endpoint']:<14} serializer {row['serializer_ms_per_1000']:>8.2f} ms/1k rows   "
+                f"projection {row['projection_ms_per_1000']:>8.2f} ms/1k rows   x{row['speedup']}"
+                f"{'' if row['identical'] else '   OUTPUT DIFFERS'}"
+            )
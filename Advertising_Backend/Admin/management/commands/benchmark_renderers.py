@@ -0,0 +1,102 @@
+import json
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from Admin import middleware
+from Admin.models import Category, CustomUser, ImageUpload, SubCategory, Subscription
+from Admin.renderers import FastJSONRenderer, orjson
+from Admin.serializers import ImageUploadSerializer, UserSerializer
+
+
+def user_rows(count):
+    """In-memory users with subscriptions, shaped like the /users/ list."""
+    today = date.today()
+    users = []
+    for pk in range(1, count + 1):
+        user = CustomUser(id=pk, username=f"user{pk}", phone=f"9{pk:09d}", email=f"user{pk}@example.com",
+                          profile_image=f"profile_images/user{pk}/avatar.jpg", logo=f"cas/ab/cd/{pk:064x}.png")
+        user.subscriptions = Subscription(id=pk, user=user, plan="monthly", start_date=today,
+                                          end_date=today + timedelta(days=pk % 60), auto_renew=bool(pk % 2))
+        users.append(user)
+    return UserSerializer, users
+
+
+def image_rows(count):
+    """In-memory images with their category, shaped like a /images/ page."""
+    category = Category(id=1, name="Electronics")
+    subcategory = SubCategory(id=1, category=category, name="Phones")
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    images = [
+        ImageUpload(id=pk, user_id=pk % 50 + 1, category=category, subcategory=subcategory,
+                    image=f"cas/ab/cd/{pk:064x}.jpg", uploaded_at=started + timedelta(minutes=pk))
+        for pk in range(1, count + 1)
+    ]
+    return ImageUploadSerializer, images
+
+
+PAYLOADS = {"users": user_rows, "images": image_rows}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare DRF's JSONRenderer with FastJSONRenderer, uncompressed and with each "
+        "compression level CompressionMiddleware can pick, on /users/- and /images/-shaped "
+        "payloads. Reports response size, CPU per response and JSON bytes handled per CPU second."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, nargs="*", default=[20, 100, 1000, 10000])
+        parser.add_argument("--repeat", type=int, default=20, help="Renders per measurement.")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+
+    def measure(self, func, repeat):
+        started = time.thread_time()
+        for _ in range(repeat):
+            result = func()
+        return result, (time.thread_time() - started) / repeat
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stderr.write("orjson is not installed, FastJSONRenderer falls back to DRF's encoder.")
+        request = APIRequestFactory().get("/")
+        stacks = [("drf", JSONRenderer()), ("fast", FastJSONRenderer())]
+        encodings = [(encoding, level) for encoding, levels in middleware.LEVELS.items() for level in levels
+                     if encoding != "br" or middleware.brotli is not None]
+
+        results = []
+        for payload, build in PAYLOADS.items():
+            for rows in options["rows"]:
+                serializer_class, instances = build(rows)
+                data = serializer_class(instances, many=True, context={"request": request}).data
+                for name, renderer in stacks:
+                    body, render_cpu = self.measure(lambda: renderer.render(data), options["repeat"])
+                    variants = [("identity", None, body, 0.0)]
+                    for encoding, level in encodings:
+                        compressed, cpu = self.measure(
+                            lambda: middleware.compress(encoding, level, body), options["repeat"])
+                        variants.append((encoding, level, compressed, cpu))
+                    for encoding, level, output, compress_cpu in variants:
+                        cpu = render_cpu + compress_cpu
+                        results.append({
+                            "payload": payload,
+                            "rows": rows,
+                            "renderer": name,
+                            "encoding": encoding if level is None else f"{encoding}-{level}",
+                            "bytes": len(output),
+                            "cpu_ms": round(cpu * 1000, 3),
+                            "mb_per_cpu_second": round(len(body) / cpu / 1e6, 1) if cpu else None,
+                        })
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'payload':<8}{'rows':>7}  {'renderer':<9}{'encoding':<11}{'bytes':>11}{'cpu ms':>10}{'MB/s':>10}")
+        for row in results:
+            self.stdout.write(
+                f"{row['payload']:<8}{row['rows']:>7}  {row['renderer']:<9}{row['encoding']:<11}"
+                f"{row['bytes']:>11}{row['cpu_ms']:>10.3f}{row['mb_per_cpu_second'] or 0:>10.1f}"
+            )
@@ -0,0 +1,100 @@
+import os
+import time
+from functools import reduce
+from itertools import islice
+from operator import or_
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from Admin.images import variant_source
+from Admin.models import MediaBlob
+from Admin.signals import MEDIA_FIELDS
+from Admin.storage import is_cas_name
+
+MEDIA_DIRS = ("cas", "uploads", "profile_images", "user_logos", "carousel")
+
+
+def walk_files(root):
+    """Yield ``(entry, name)`` for every file below ``root``, one directory listing at a time."""
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry, os.path.relpath(entry.path, settings.MEDIA_ROOT).replace(os.sep, "/")
+        except FileNotFoundError:
+            continue
+
+
+def referenced(sources):
+    """The subset of ``sources`` still stored in some image field."""
+    found = set()
+    for model, fields in MEDIA_FIELDS.items():
+        query = reduce(or_, (Q(**{f"{field}__in": sources}) for field in fields))
+        for row in model.objects.filter(query).values_list(*fields).iterator():
+            found.update(name for name in row if name in sources)
+    return found
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete media files (and image variants) no database row points at any more. "
+        "Walks MEDIA_ROOT in batches so memory stays flat however many files there are."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-age-hours", type=float, default=24,
+                            help="Leave files younger than this alone, they may belong to an upload in flight.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted.")
+
+    def handle(self, *args, **options):
+        cutoff = time.time() - options["min_age_hours"] * 3600
+        dry_run = options["dry_run"]
+        scanned = orphans = reclaimed = 0
+
+        for directory in MEDIA_DIRS:
+            files = walk_files(os.path.join(settings.MEDIA_ROOT, directory))
+            while batch := list(islice(files, options["batch_size"])):
+                scanned += len(batch)
+                candidates = []
+                for entry, name in batch:
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    if stat.st_mtime < cutoff:
+                        candidates.append((entry.path, name, stat.st_size))
+                if not candidates:
+                    continue
+
+                kept = referenced({variant_source(name) for _, name, _ in candidates})
+                dropped = set()
+                for path, name, size in candidates:
+                    if variant_source(name) in kept:
+                        continue
+                    dropped.add(variant_source(name))
+                    orphans += 1
+                    reclaimed += size
+                    if options["verbosity"] > 1:
+                        self.stdout.write(name)
+                    if not dry_run:
+                        try:
+                            os.remove(path)
+                        except FileNotFoundError:
+                            pass
+                # refcounts of blobs nothing points at are stale by definition
+                blobs = [name for name in dropped if is_cas_name(name)]
+                if blobs and not dry_run:
+                    MediaBlob.objects.filter(name__in=blobs).delete()
+
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {scanned} files. {verb} {orphans} orphans ({reclaimed / 1048576:.1f} MiB)."
+        ))
@@ -0,0 +1,134 @@
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from Admin import ads
+from Admin.benchmark import MARKER, PASSWORD, placeholder_image
+from Admin.blobs import retain_media
+from Admin.cache import invalidate_taxonomy
+from Admin.home import SECTIONS, invalidate_sections
+from Admin.models import Category, ImageUpload, SubCategory, Subscription
+
+User = get_user_model()
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with synthetic benchmark data: users (all with the password "
+        f"'{PASSWORD}'), subscriptions, categories and subcategories, and images pointing at a "
+        "few small placeholder files. Everything is named with the 'bench-' prefix. Run it on a "
+        "dedicated database (SQLITE_PATH / DB_NAME); drop that database to start over."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1_000_000)
+        parser.add_argument("--subscribed", type=float, default=0.6, help="Share of users with a subscription.")
+        parser.add_argument("--categories", type=int, default=1000)
+        parser.add_argument("--subcategories", type=int, default=5, help="Subcategories per category.")
+        parser.add_argument("--images", type=int, default=2_000_000)
+        parser.add_argument("--placeholders", type=int, default=50, help="Distinct image files to spread the images over.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=1, help="Same seed, same data.")
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=MARKER).exists():
+            raise CommandError("This database already holds benchmark data, generate it into a fresh one.")
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+
+        users = self.step("users", self.create_users, options["users"])
+        self.step("subscriptions", self.create_subscriptions, users, options["subscribed"])
+        subcategories = self.step("categories", self.create_taxonomy, options["categories"], options["subcategories"])
+        placeholders = self.step("placeholder files", self.create_placeholders, options["placeholders"])
+        self.step("images", self.create_images, options["images"], users, subcategories, placeholders)
+
+        # bulk_create sends no signals, drop what the caches hold by hand
+        invalidate_taxonomy()
+        invalidate_sections(SECTIONS)
+        ads.invalidate_all()
+
+    def step(self, label, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        self.stdout.write(f"{label}: done in {time.perf_counter() - started:.1f}s")
+        return result
+
+    def create_users(self, count):
+        # hashing a million passwords would take hours, they all share one hash
+        password = make_password(PASSWORD)
+        ids = []
+        for batch in batched(range(count), self.batch_size):
+            created = User.objects.bulk_create(
+                User(username=f"{MARKER}user{n}", email=f"{MARKER}user{n}@example.com",
+                     phone=f"+99{n:010d}", password=password)
+                for n in batch
+            )
+            ids += [user.pk for user in created]
+        return ids
+
+    def create_subscriptions(self, user_ids, share):
+        today = timezone.now().date()
+        plans = [plan for plan, _ in Subscription.PLAN_CHOICES]
+        subscribed = self.random.sample(user_ids, int(len(user_ids) * share))
+        for batch in batched(subscribed, self.batch_size):
+            subscriptions = []
+            for user_id in batch:
+                plan = self.random.choice(plans)
+                # a spread of active, expiring and lapsed subscriptions
+                end_date = today + timedelta(days=self.random.randint(-90, Subscription.PLAN_DURATIONS[plan]))
+                revoke = self.random.random() < 0.02
+                subscriptions.append(Subscription(
+                    user_id=user_id, plan=None if revoke else plan, end_date=end_date, revoke=revoke,
+                    auto_renew=self.random.random() < 0.3,
+                ))
+            Subscription.objects.bulk_create(subscriptions)
+
+    def create_taxonomy(self, categories, per_category):
+        created = Category.objects.bulk_create(
+            Category(name=f"{MARKER}category{n}") for n in range(categories)
+        )
+        subcategories = []
+        for batch in batched(created, max(1, self.batch_size // max(1, per_category))):
+            subcategories += SubCategory.objects.bulk_create(
+                SubCategory(category=category, name=f"{MARKER}subcategory{category.pk}-{n}")
+                for category in batch for n in range(per_category)
+            )
+        return [(subcategory.category_id, subcategory.pk) for subcategory in subcategories]
+
+    def create_placeholders(self, count):
+        storage = ImageUpload._meta.get_field("image").storage
+        return [
+            storage.save(f"uploads/{MARKER}{n}.jpg", ContentFile(placeholder_image(n)))
+            for n in range(count)
+        ]
+
+    def create_images(self, count, user_ids, subcategories, placeholders):
+        if not (user_ids and subcategories and placeholders):
+            return
+        for batch in batched(range(count), self.batch_size):
+            images = []
+            for _ in batch:
+                category_id, subcategory_id = self.random.choice(subcategories)
+                images.append(ImageUpload(
+                    user_id=self.random.choice(user_ids), category_id=category_id,
+                    subcategory_id=subcategory_id, image=self.random.choice(placeholders),
+                ))
+            with transaction.atomic():
+                ImageUpload.objects.bulk_create(images)
+                # the placeholder blobs are shared, count the references like a bulk upload does
+                retain_media(Counter(image.image.name for image in images))
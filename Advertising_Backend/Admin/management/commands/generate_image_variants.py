@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from Admin.images import generate_variants
+from Admin.signals import MEDIA_FIELDS
+
+
+class Command(BaseCommand):
+    help = "Backfill resized variants for every stored upload, profile image, logo and carousel image."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Regenerate variants that already exist.")
+        parser.add_argument("--workers", type=int, default=4, help="Images processed in parallel.")
+
+    def iter_images(self):
+        for model, fields in MEDIA_FIELDS.items():
+            for row in model.objects.values_list(*fields).iterator(chunk_size=2000):
+                for field, name in zip(fields, row):
+                    if name:
+                        yield model._meta.get_field(field).storage, name
+
+    def process(self, storage, name, force):
+        try:
+            return name, generate_variants(name, storage, force=force), None
+        except Exception as exc:
+            return name, 0, exc
+
+    def handle(self, *args, **options):
+        force = options["force"]
+        images = written = failed = 0
+        source = self.iter_images()
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            # feed the pool in slices so a huge media table is never queued in memory at once
+            while batch := list(islice(source, options["workers"] * 50)):
+                for name, count, error in pool.map(lambda item: self.process(*item, force), batch):
+                    images += 1
+                    written += count
+                    if error is not None:
+                        failed += 1
+                        self.stderr.write(f"{name}: {error}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {images} images, wrote {written} variants, {failed} failed."
+        ))
@@ -0,0 +1,91 @@
+import json
+import random
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+
+from Admin.benchmark import percentile
+from Admin.models import ImageUpload, YoutubeVideo
+
+MARKER = "loadtest-"
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer the configured database with concurrent feed reads and small inserts and "
+        "report throughput, latency and lock errors. Run it once per DATABASE_ENGINE "
+        "profile to compare them. Rows it writes are removed afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run.")
+        parser.add_argument("--write-ratio", type=float, default=0.2, help="Share of operations that insert.")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+
+    def read(self):
+        list(ImageUpload.objects.select_related("category", "subcategory").order_by("-uploaded_at", "-id")[:20])
+
+    def write(self):
+        YoutubeVideo.objects.create(
+            video_url="https://example.com/loadtest", video_name=f"{MARKER}{uuid.uuid4().hex}", category="Technology"
+        )
+
+    def worker(self, deadline, write_ratio, stats, lock):
+        local = {"reads": [], "writes": [], "errors": 0}
+        try:
+            while time.perf_counter() < deadline:
+                is_write = random.random() < write_ratio
+                started = time.perf_counter()
+                try:
+                    self.write() if is_write else self.read()
+                except OperationalError:
+                    local["errors"] += 1
+                    continue
+                local["writes" if is_write else "reads"].append(time.perf_counter() - started)
+        finally:
+            connections.close_all()
+        with lock:
+            for key in ("reads", "writes"):
+                stats[key].extend(local[key])
+            stats["errors"] += local["errors"]
+
+    def handle(self, *args, **options):
+        stats = {"reads": [], "writes": [], "errors": 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options["duration"]
+        threads = [
+            threading.Thread(target=self.worker, args=(deadline, options["write_ratio"], stats, lock))
+            for _ in range(options["threads"])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        YoutubeVideo.objects.filter(video_name__startswith=MARKER).delete()
+
+        report = {
+            "vendor": connection.vendor,
+            "threads": options["threads"],
+            "seconds": round(elapsed, 2),
+            "ops_per_second": round((len(stats["reads"]) + len(stats["writes"])) / elapsed, 1),
+            "lock_errors": stats["errors"],
+        }
+        for key in ("reads", "writes"):
+            report[key] = {
+                "count": len(stats[key]),
+                "p50_ms": round(percentile(stats[key], 0.50) * 1000, 2) if stats[key] else None,
+                "p99_ms": round(percentile(stats[key], 0.99) * 1000, 2) if stats[key] else None,
+            }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            for key, value in report.items():
+                self.stdout.write(f"{key}: {value}")
@@ -0,0 +1,36 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from Admin.services import process_due_subscriptions
+
+
+class Command(BaseCommand):
+    help = (
+        "Renew or expire every lapsed subscription in batches. "
+        "Safe to run several copies at once and to re-run after an interruption."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--max-batches", type=int, default=None, help="Stop after this many batches.")
+        parser.add_argument("--date", type=date.fromisoformat, default=None,
+                            help="Process as of this day (YYYY-MM-DD), defaults to today.")
+
+    def report(self, result):
+        self.stdout.write(
+            f"batch {result.batches}: {result.renewed} renewed, {result.expired} expired, "
+            f"{result.rows_per_second:.0f} rows/s"
+        )
+
+    def handle(self, *args, **options):
+        result = process_due_subscriptions(
+            batch_size=options["batch_size"],
+            today=options["date"],
+            max_batches=options["max_batches"],
+            on_batch=self.report if options["verbosity"] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {result.processed} subscriptions ({result.renewed} renewed, {result.expired} expired) "
+            f"in {result.elapsed:.2f}s, {result.rows_per_second:.0f} rows/s."
+        ))
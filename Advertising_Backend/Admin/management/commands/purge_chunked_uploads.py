@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from Admin.models import ChunkedUpload
+from Admin.uploads import discard_upload
+
+
+class Command(BaseCommand):
+    help = "Delete chunked uploads (and their temp files) that were abandoned before completion."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=24, help="Age after which an upload is abandoned.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+        purged = 0
+        for upload in ChunkedUpload.objects.filter(created_at__lt=cutoff).iterator():
+            discard_upload(upload)
+            purged += 1
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} abandoned uploads."))
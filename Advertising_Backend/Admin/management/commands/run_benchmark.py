@@ -0,0 +1,372 @@
+import gzip
+import http.client
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import reverse
+
+from Admin.authentication import tokens_for_user
+from Admin.benchmark import MARKER, PASSWORD, percentile, placeholder_image
+from Admin.models import Category, ImageUpload, SubCategory, Subscription
+
+User = get_user_model()
+
+DEFAULT_MIX = "browse=60,login=10,signup=5,upload=10,subscription=15"
+SERVER_TIMING_QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+# users created by the signup scenario, removed afterwards
+RUN_MARKER = f"{MARKER}run-"
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class InProcessTransport:
+    """Requests through Django's test client: the whole stack, no network. Counts queries exactly."""
+    name = "in-process"
+
+    def __init__(self):
+        self.client = Client()
+
+    def __call__(self, method, path, body, headers):
+        counter = QueryCounter()
+        extra = {"HTTP_" + name.upper().replace("-", "_"): value for name, value in headers.items()
+                 if name != "Content-Type"}
+        with connection.execute_wrapper(counter):
+            response = self.client.generic(method, path, body or b"", headers.get("Content-Type"), **extra)
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, response.get("Content-Encoding"), body, counter.count
+
+    def close(self):
+        connections.close_all()
+
+
+class HTTPTransport:
+    """
+    Requests over HTTP to a running server. Query counts come from its
+    Server-Timing header: start the server with METRICS_SAMPLE_RATE=1 and
+    METRICS_PUBLIC_SERVER_TIMING=1 to get them for every request.
+    """
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.name = base_url
+        self.prefix = parts.path.rstrip("/")
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.connection = connection_class(parts.hostname, parts.port, timeout=30)
+
+    def __call__(self, method, path, body, headers):
+        try:
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (http.client.HTTPException, OSError):
+            # the server dropped the keep-alive connection, the next request reconnects
+            self.connection.close()
+            raise
+        match = SERVER_TIMING_QUERIES_RE.search(response.getheader("Server-Timing") or "")
+        return response.status, response.getheader("Content-Encoding"), content, int(match[1]) if match else None
+
+    def close(self):
+        self.connection.close()
+
+
+class Session:
+    """One simulated client: sends requests and records how each went."""
+
+    def __init__(self, transport, stats, rng):
+        self.transport = transport
+        self.stats = stats
+        self.random = rng
+
+    def call(self, endpoint, method, path, data=None, token=None, multipart=False):
+        headers = {"Accept-Encoding": "gzip"}
+        body = None
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        if multipart:
+            body = encode_multipart(BOUNDARY, data)
+            headers["Content-Type"] = MULTIPART_CONTENT
+        elif data is not None:
+            body = json.dumps(data).encode()
+            headers["Content-Type"] = "application/json"
+
+        started = time.perf_counter()
+        try:
+            status, encoding, content, queries = self.transport(method, path, body, headers)
+        except Exception as exc:
+            self.stats.record(endpoint, time.perf_counter() - started, type(exc).__name__, None)
+            return None, None
+        self.stats.record(endpoint, time.perf_counter() - started, status, queries)
+        if encoding == "gzip":
+            content = gzip.decompress(content)
+        try:
+            return status, json.loads(content) if content else None
+        except ValueError:
+            return status, None
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.recording = False
+        self.endpoints = {}
+
+    def record(self, endpoint, seconds, status, queries):
+        if not self.recording:
+            return
+        with self.lock:
+            entry = self.endpoints.setdefault(endpoint, {"latencies": [], "queries": [], "statuses": Counter()})
+            entry["latencies"].append(seconds)
+            entry["statuses"][str(status)] += 1
+            if queries is not None:
+                entry["queries"].append(queries)
+
+
+def path_of(url):
+    parts = urlsplit(url)
+    return f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+
+def ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the API with a mix of scenarios (feed browsing, login, signup, uploads and "
+        "subscription updates) at a given concurrency, against data from "
+        "generate_benchmark_data, and report throughput, p50/p95/p99 latency and query "
+        "counts per endpoint as JSON. Runs in-process by default, or against a server "
+        "with --base-url. Rows the run creates are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=8, help="Simulated clients (threads).")
+        parser.add_argument("--duration", type=float, default=30.0, help="Seconds to measure.")
+        parser.add_argument("--warmup", type=float, default=3.0, help="Seconds to run before measuring.")
+        parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Scenario weights, default {DEFAULT_MIX}.")
+        parser.add_argument("--pages", type=int, default=3, help="Feed pages a browsing client reads.")
+        parser.add_argument("--base-url", default=None, help="Benchmark a running server instead.")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", default=None, help="Write the report to this file.")
+        parser.add_argument("--baseline", default=None, help="Earlier report to compare against.")
+
+    def parse_mix(self, mix):
+        weights = {}
+        for item in mix.split(","):
+            name, _, weight = item.partition("=")
+            name = name.strip()
+            if not hasattr(self, f"scenario_{name}"):
+                raise CommandError(f"Unknown scenario {name!r}.")
+            try:
+                weights[name] = float(weight)
+            except ValueError:
+                raise CommandError(f"Bad weight for {name!r}: {weight!r}.")
+        return weights
+
+    def prepare(self):
+        """Sample the ids the scenarios pick from and mint the tokens they send."""
+        users = list(User.objects.filter(username__startswith=MARKER, is_staff=False)
+                     .exclude(username__startswith=RUN_MARKER).values_list("pk", "email")[:1000])
+        if not users:
+            raise CommandError("No benchmark data, run generate_benchmark_data first.")
+        admin, _ = User.objects.get_or_create(
+            username=f"{MARKER}admin",
+            defaults={"email": f"{MARKER}admin@example.com", "is_staff": True, "password": make_password(PASSWORD)},
+        )
+        self.emails = [email for _, email in users]
+        self.user_tokens = [str(tokens_for_user(user).access_token)
+                            for user in User.objects.filter(pk__in=[pk for pk, _ in users[:50]])]
+        self.admin_token = str(tokens_for_user(admin).access_token)
+        self.categories = list(Category.objects.filter(name__startswith=MARKER).values_list("pk", flat=True)[:1000])
+        self.subcategories = list(SubCategory.objects.filter(name__startswith=MARKER)
+                                  .values_list("category_id", "pk")[:1000])
+        self.subscriptions = list(Subscription.objects.filter(user__username__startswith=MARKER)
+                                  .values_list("pk", flat=True)[:1000])
+        self.uploads = [placeholder_image(1000 + n) for n in range(20)]
+        self.uploaded = []
+        self.uploaded_lock = threading.Lock()
+
+    # --- scenarios, each one user journey ---
+
+    def scenario_browse(self, session):
+        session.call("home", "GET", reverse("home"))
+        session.call("category-tree", "GET", reverse("category-tree"))
+        path = reverse("image-upload")
+        if self.categories and session.random.random() < 0.5:
+            path += f"?category={session.random.choice(self.categories)}"
+        for _ in range(self.pages):
+            status, data = session.call("image-upload", "GET", path)
+            if status != 200 or not data or not data.get("next"):
+                break
+            path = path_of(data["next"])
+
+    def scenario_login(self, session):
+        session.call("login", "POST", reverse("login"),
+                     {"identifier": session.random.choice(self.emails), "password": PASSWORD})
+
+    def scenario_signup(self, session):
+        name = f"{RUN_MARKER}{uuid.uuid4().hex[:12]}"
+        session.call("signup", "POST", reverse("signup"),
+                     {"username": name, "email": f"{name}@example.com", "password": PASSWORD})
+
+    def scenario_upload(self, session):
+        if not self.subcategories:
+            return
+        category, subcategory = session.random.choice(self.subcategories)
+        image = SimpleUploadedFile("upload.jpg", session.random.choice(self.uploads), content_type="image/jpeg")
+        status, data = session.call(
+            "image-upload:create", "POST", reverse("image-upload"),
+            {"category": category, "subcategory": subcategory, "image": image},
+            token=session.random.choice(self.user_tokens), multipart=True,
+        )
+        if status == 201 and data:
+            with self.uploaded_lock:
+                self.uploaded.append(data["id"])
+
+    def scenario_subscription(self, session):
+        if not self.subscriptions:
+            return
+        pk = session.random.choice(self.subscriptions)
+        session.call("subscription-detail", "PATCH", reverse("subscription-detail", args=[pk]),
+                     {"auto_renew": session.random.random() < 0.5}, token=self.admin_token)
+
+    # --- running ---
+
+    def worker(self, index, transport_factory, stats, deadline):
+        transport = transport_factory()
+        session = Session(transport, stats, random.Random(self.seed + index))
+        names, weights = zip(*self.mix.items())
+        try:
+            while time.perf_counter() < deadline:
+                name = session.random.choices(names, weights)[0]
+                getattr(self, f"scenario_{name}")(session)
+                with stats.lock:
+                    if stats.recording:
+                        self.journeys[name] += 1
+        finally:
+            transport.close()
+
+    def handle(self, *args, **options):
+        self.mix = self.parse_mix(options["mix"])
+        self.pages = options["pages"]
+        self.seed = options["seed"]
+        self.journeys = Counter()
+        self.prepare()
+        if options["base_url"]:
+            base_url = options["base_url"]
+            transport_factory = lambda: HTTPTransport(base_url)  # noqa: E731
+        else:
+            transport_factory = InProcessTransport
+
+        stats = Stats()
+        warmup, duration = options["warmup"], options["duration"]
+        deadline = time.perf_counter() + warmup + duration
+        threads = [
+            threading.Thread(target=self.worker, args=(n, transport_factory, stats, deadline))
+            for n in range(options["concurrency"])
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(warmup)
+        stats.recording = True
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        report = self.report(options, options["base_url"] or InProcessTransport.name, stats, elapsed)
+        self.cleanup()
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+        if options["baseline"]:
+            self.compare(options["baseline"], report)
+
+    def report(self, options, transport, stats, elapsed):
+        endpoints = {}
+        total = errors = 0
+        for name, entry in sorted(stats.endpoints.items()):
+            latencies, queries = entry["latencies"], entry["queries"]
+            failed = sum(count for status, count in entry["statuses"].items()
+                         if not status.isdigit() or int(status) >= 400)
+            total += len(latencies)
+            errors += failed
+            endpoints[name] = {
+                "requests": len(latencies),
+                "errors": failed,
+                "statuses": dict(entry["statuses"]),
+                "throughput_rps": round(len(latencies) / elapsed, 2),
+                "p50_ms": ms(percentile(latencies, 0.50)),
+                "p95_ms": ms(percentile(latencies, 0.95)),
+                "p99_ms": ms(percentile(latencies, 0.99)),
+                "max_ms": ms(max(latencies)),
+                "queries_mean": round(sum(queries) / len(queries), 2) if queries else None,
+                "queries_max": max(queries) if queries else None,
+            }
+        return {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "transport": transport,
+            "vendor": connection.vendor,
+            "concurrency": options["concurrency"],
+            "duration_s": round(elapsed, 2),
+            "warmup_s": options["warmup"],
+            "mix": self.mix,
+            "seed": self.seed,
+            "dataset": {
+                "users": User.objects.count(),
+                "subscriptions": Subscription.objects.count(),
+                "categories": Category.objects.count(),
+                "subcategories": SubCategory.objects.count(),
+                "images": ImageUpload.objects.count(),
+            },
+            "totals": {"requests": total, "errors": errors, "throughput_rps": round(total / elapsed, 2)},
+            "journeys": dict(self.journeys),
+            "endpoints": endpoints,
+        }
+
+    def cleanup(self):
+        # through the ORM so the media references are released by the signals
+        ImageUpload.objects.filter(pk__in=self.uploaded).delete()
+        User.objects.filter(username__startswith=RUN_MARKER).delete()
+
+    def compare(self, path, report):
+        with open(path) as file:
+            baseline = json.load(file)
+        self.stderr.write(f"{'endpoint':<24}{'rps':>18}{'p95 ms':>22}{'p99 ms':>22}{'queries':>16}")
+        for name, current in report["endpoints"].items():
+            before = baseline.get("endpoints", {}).get(name)
+            if before is None:
+                self.stderr.write(f"{name:<24} (not in baseline)")
+                continue
+            self.stderr.write(
+                f"{name:<24}"
+                f"{before['throughput_rps']:>8} -> {current['throughput_rps']:<7}"
+                f"{before['p95_ms']:>10} -> {current['p95_ms']:<9}"
+                f"{before['p99_ms']:>10} -> {current['p99_ms']:<9}"
+                f"{before['queries_mean']!s:>7} -> {current['queries_mean']!s:<6}"
+            )
@@ -0,0 +1,95 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SORT_KEYS = {
+    "total": lambda row: row["total_ms"],
+    "max": lambda row: row["max_ms"],
+    "count": lambda row: row["count"],
+    "p95": lambda row: row["p95_ms"],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarise the slow-query log (SLOW_QUERY_LOG): the worst statements by total time, "
+        "with their call count, p95 and max duration, the views that ran them and the latest plan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--log", default=None, help="Log file, SLOW_QUERY_LOG by default.")
+        parser.add_argument("--top", type=int, default=10)
+        parser.add_argument("--hours", type=float, default=None, help="Only entries from the last N hours.")
+        parser.add_argument("--sort", choices=sorted(SORT_KEYS), default="total")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+
+    def read(self, path, since):
+        try:
+            with open(path, encoding="utf-8") as log:
+                for line in log:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash, skip it
+                        continue
+                    if since is None or datetime.fromisoformat(entry["time"]) >= since:
+                        yield entry
+        except FileNotFoundError:
+            raise CommandError(f"No slow-query log at {path}.")
+
+    def summarise(self, entries):
+        groups = {}
+        for entry in entries:
+            group = groups.get(entry["fingerprint"])
+            if group is None:
+                group = groups[entry["fingerprint"]] = {
+                    "fingerprint": entry["fingerprint"], "sql": entry["sql"],
+                    "durations": [], "views": {}, "plan": None, "last_seen": None,
+                }
+            group["durations"].append(entry["duration_ms"])
+            view = " ".join(filter(None, [entry.get("view"), entry.get("serializer") and f"({entry['serializer']})"]))
+            group["views"][view or "-"] = group["views"].get(view or "-", 0) + 1
+            if entry.get("plan") is not None:
+                group["plan"] = entry["plan"]
+            group["last_seen"] = entry["time"]
+
+        rows = []
+        for group in groups.values():
+            durations = sorted(group.pop("durations"))
+            group.update(
+                count=len(durations),
+                total_ms=round(sum(durations), 3),
+                p95_ms=durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+                max_ms=durations[-1],
+                views=dict(sorted(group["views"].items(), key=lambda item: -item[1])),
+            )
+            rows.append(group)
+        return rows
+
+    def handle(self, *args, **options):
+        since = None
+        if options["hours"] is not None:
+            since = datetime.now(timezone.utc) - timedelta(hours=options["hours"])
+        rows = self.summarise(self.read(options["log"] or settings.SLOW_QUERY_LOG, since))
+        rows.sort(key=SORT_KEYS[options["sort"]], reverse=True)
+        rows = rows[:options["top"]]
+
+        if options["json"]:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+        if not rows:
+            self.stdout.write("No slow queries logged.")
+            return
+        for rank, row in enumerate(rows, 1):
+            self.stdout.write(self.style.WARNING(
+                f"#{rank} {row['fingerprint']}  {row['count']} calls  total {row['total_ms']:.1f} ms  "
+                f"p95 {row['p95_ms']:.1f} ms  max {row['max_ms']:.1f} ms  last {row['last_seen']}"
+            ))
+            self.stdout.write(f"  {row['sql']}")
+            for view, count in row["views"].items():
+                self.stdout.write(f"  from {view}: {count}")
+            for line in row["plan"] or ():
+                self.stdout.write(f"    {line}")
+            self.stdout.write("")
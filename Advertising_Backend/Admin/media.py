@@ -0,0 +1,162 @@
+"""
+Serving of MEDIA_ROOT for production (mounted at MEDIA_URL in Backend/urls.py).
+
+With ``MEDIA_ACCEL`` set the view only checks the path and answers
+conditional requests; the bytes are sent by the front proxy through
+X-Accel-Redirect (nginx) or X-Sendfile (Apache mod_xsendfile), which also
+handles ranges. Both headers carry the path percent-encoded, which nginx
+and mod_xsendfile decode, so non-ASCII names, spaces and ``%`` survive.
+Without it, files are streamed from Python with range support, which is
+fine for development and small deployments.
+
+Example nginx location for ``MEDIA_ACCEL = 'x-accel-redirect'``::
+
+    location /protected-media/ {
+        internal;
+        alias /path/to/Advertising_Backend/media/;
+    }
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .storage import CAS_PREFIX, is_cas_name
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_CHUNK_SIZE = 64 * 1024
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# partial uploads being hashed by ContentAddressedStorage, never served
+CAS_TMP_PREFIX = CAS_PREFIX + 'tmp/'
+
+
+def cache_control(name):
+    # content-addressed names (and their variants) never change meaning
+    if is_cas_name(name):
+        return IMMUTABLE_CACHE_CONTROL
+    return f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)}"
+
+
+def parse_range(header, size):
+    """
+    ``(start, end)`` inclusive for a single ``bytes=`` range, None to send
+    the whole file (no, multi-part or malformed range), or ``False`` when
+    the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # suffix range: the last N bytes
+        length = int(last)
+        if not length:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def validators(name, stat):
+    """
+    ``(etag, mtime)`` of a file. A content-addressed name already holds the
+    SHA-256 of its content, so it is the ETag and the mtime, which duplicate
+    uploads touch, is left out (None).
+    """
+    if is_cas_name(name):
+        return f'"{os.path.basename(name)}"', None
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"', stat.st_mtime
+
+
+def if_range_matches(request, etag, mtime):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return parse_etags(if_range) == [etag]
+    # a content-addressed file never changes, whatever date the client saw
+    return mtime is None or parse_http_date_safe(if_range) == int(mtime)
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    name = os.path.relpath(full_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+    if not os.path.isfile(full_path) or name.startswith(CAS_TMP_PREFIX):
+        raise Http404
+
+    etag, mtime = validators(name, stat)
+    headers = {
+        'ETag': etag,
+        'Cache-Control': cache_control(name),
+        'Accept-Ranges': 'bytes',
+        'X-Content-Type-Options': 'nosniff',
+    }
+    if mtime is not None:
+        headers['Last-Modified'] = http_date(mtime)
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=int(mtime) if mtime is not None else None)
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    accel = getattr(settings, 'MEDIA_ACCEL', None)
+    if accel == 'x-accel-redirect':
+        prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['X-Accel-Redirect'] = prefix + quote(name)
+        return response
+    if accel == 'x-sendfile':
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['X-Sendfile'] = quote(full_path)
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    if if_range_matches(request, etag, mtime):
+        byte_range = parse_range(request.headers.get('Range'), size)
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{size}'
+        return HttpResponse(status=416, headers=headers)
+
+    if byte_range is None:
+        if request.method == 'HEAD':
+            return HttpResponse(content_type=content_type, headers={**headers, 'Content-Length': size})
+        # FileResponse lets the WSGI server use sendfile() when it can
+        return FileResponse(open(full_path, 'rb'), content_type=content_type, headers=headers)
+
+    start, end = byte_range
+    length = end - start + 1
+    headers.update({'Content-Range': f'bytes {start}-{end}/{size}', 'Content-Length': length})
+    if request.method == 'HEAD':
+        return HttpResponse(status=206, content_type=content_type, headers=headers)
+    return StreamingHttpResponse(read_range(full_path, start, length), status=206,
+                                 content_type=content_type, headers=headers)
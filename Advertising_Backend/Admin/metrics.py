@@ -0,0 +1,290 @@
+"""
+Per-request instrumentation: latency histograms, DB query count and time,
+serialization and render time and response bytes per URL name, exported in
+the Prometheus text format at /metrics/ and summarised per response in
+Server-Timing.
+
+Figures are kept per process; scrape every worker (or run one per pod).
+Only a METRICS_SAMPLE_RATE share of requests pays for DB, serialization and
+render timing, the request count and latency histogram cover every request.
+/metrics/ and the Server-Timing header are for staff (or the holder of
+METRICS_TOKEN) only, unless the settings open them up.
+"""
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.exceptions import APIException
+
+from .authentication import ClaimsJWTAuthentication
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# the sampled request being served in this thread / task, None otherwise
+_current = ContextVar('request_metrics', default=None)
+# the request being served, sampled or not (see current_request())
+_request = ContextVar('request', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db_time', 'serialize_time', 'render_time', 'serialize_depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.render_time = 0.0
+        self.serialize_depth = 0
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper installed on every connection, see install_query_wrapper()."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - started
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def current_request():
+    """The request MetricsMiddleware is serving in this thread / task, if any."""
+    return _request.get()
+
+
+def record_render(seconds):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.render_time += seconds
+
+
+class measure_serialization:
+    """
+    Context manager counting the time spent inside as serialization (model
+    instances or rows to Python data), less the queries run meanwhile, which
+    already count as DB time. Nested uses count once, at the outermost level.
+    """
+    __slots__ = ('metrics', 'started', 'db_time')
+
+    def __enter__(self):
+        metrics = self.metrics = _current.get()
+        if metrics is not None:
+            metrics.serialize_depth += 1
+            if metrics.serialize_depth == 1:
+                self.started, self.db_time = time.perf_counter(), metrics.db_time
+        return self
+
+    def __exit__(self, *exc_info):
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.serialize_depth -= 1
+            if not metrics.serialize_depth:
+                elapsed = time.perf_counter() - self.started
+                metrics.serialize_time += elapsed - (metrics.db_time - self.db_time)
+
+
+def is_staff_request(request):
+    """
+    Whether the request was authenticated as staff. Only looks at a user
+    that authentication already resolved (DRF copies its user onto the
+    Django request), so it never runs a query, not even from async code.
+    """
+    user = request.__dict__.get('user')
+    if user is None:
+        return False
+    if isinstance(user, SimpleLazyObject) and user._wrapped is empty and '_claims' not in user.__dict__:
+        return False
+    return bool(getattr(user, 'is_staff', False))
+
+
+class Registry:
+    """Thread-safe in-process store of the aggregated figures."""
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or getattr(settings, 'METRICS_LATENCY_BUCKETS', DEFAULT_BUCKETS))
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}    # (route, method, status) -> count
+            self.latency = {}     # (route, method) -> [bucket counts..., sum, count]
+            self.sampled = {}     # route -> [requests, queries, db seconds, serialize seconds, render seconds, bytes]
+
+    def observe(self, route, method, status, seconds, sample=None, size=0):
+        index = bisect_left(self.buckets, seconds)
+        with self.lock:
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.latency.get((route, method))
+            if histogram is None:
+                histogram = self.latency[route, method] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                histogram[index] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            if sample is not None:
+                totals = self.sampled.setdefault(route, [0, 0, 0.0, 0.0, 0.0, 0])
+                totals[0] += 1
+                totals[1] += sample.queries
+                totals[2] += sample.db_time
+                totals[3] += sample.serialize_time
+                totals[4] += sample.render_time
+                totals[5] += size
+
+    def render(self):
+        with self.lock:
+            requests = dict(self.requests)
+            latency = {key: list(values) for key, values in self.latency.items()}
+            sampled = {key: list(values) for key, values in self.sampled.items()}
+
+        lines = [
+            '# HELP http_requests_total Requests served, by URL name, method and status.',
+            '# TYPE http_requests_total counter',
+        ]
+        for (route, method, status), count in sorted(requests.items()):
+            lines.append(f'http_requests_total{{route="{route}",method="{method}",status="{status}"}} {count}')
+
+        lines += [
+            '# HELP http_request_duration_seconds Time from the first to the last middleware.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (route, method), values in sorted(latency.items()):
+            labels = f'route="{route}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {values[-1]}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {values[-2]}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {values[-1]}')
+
+        for index, (name, kind, help_text) in enumerate([
+            ('http_sampled_requests_total', 'counter', 'Requests the figures below were measured on.'),
+            ('db_queries_total', 'counter', 'ORM queries run by sampled requests.'),
+            ('db_query_duration_seconds_total', 'counter', 'Time spent in the database by sampled requests.'),
+            ('serialize_duration_seconds_total', 'counter',
+             'Time spent turning instances and rows into response data by sampled requests.'),
+            ('render_duration_seconds_total', 'counter', 'Time spent rendering response bodies of sampled requests.'),
+            ('http_response_bytes_total', 'counter', 'Response bytes sent by sampled requests.'),
+        ]):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for route, totals in sorted(sampled.items()):
+                lines.append(f'{name}{{route="{route}"}} {totals[index]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def response_size(response):
+    if response.streaming:
+        return int(response.get('Content-Length') or 0)
+    return len(response.content)
+
+
+class MetricsMiddleware:
+    """
+    Times every request and, for sampled ones, counts queries, serialization
+    and render time, and adds a Server-Timing header to the responses staff
+    get (everyone's with METRICS_PUBLIC_SERVER_TIMING). Put it first in
+    MIDDLEWARE so the latency covers the whole stack. Works under WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'METRICS_SAMPLE_RATE', 0.1)
+        self.public_timing = getattr(settings, 'METRICS_PUBLIC_SERVER_TIMING', False)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        sample, tokens, started = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.stop(tokens)
+        return self.finish(request, response, sample, started)
+
+    async def __acall__(self, request):
+        sample, tokens, started = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop(tokens)
+        return self.finish(request, response, sample, started)
+
+    def start(self, request):
+        sample = None
+        tokens = [(_request, _request.set(request))]
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            sample = RequestMetrics()
+            tokens.append((_current, _current.set(sample)))
+        return sample, tokens, time.perf_counter()
+
+    def stop(self, tokens):
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+    def finish(self, request, response, sample, started):
+        elapsed = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        route = (match.view_name if match else None) or 'unmatched'
+        size = 0
+        if sample is not None:
+            size = response_size(response)
+            if self.public_timing or is_staff_request(request):
+                app = max(elapsed - sample.db_time - sample.serialize_time - sample.render_time, 0.0)
+                response['Server-Timing'] = ', '.join([
+                    f'db;dur={sample.db_time * 1000:.1f};desc="{sample.queries} queries"',
+                    f'serialize;dur={sample.serialize_time * 1000:.1f}',
+                    f'render;dur={sample.render_time * 1000:.1f}',
+                    f'app;dur={app * 1000:.1f}',
+                    f'total;dur={elapsed * 1000:.1f}',
+                ])
+        registry.observe(route, request.method, response.status_code, elapsed, sample, size)
+        return response
+
+
+def scrape_allowed(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    if getattr(settings, 'METRICS_PUBLIC', False):
+        return True
+    # staff, through the API's JWT authentication or the admin session
+    try:
+        authenticated = ClaimsJWTAuthentication().authenticate(request)
+    except APIException:
+        return False
+    user = authenticated[0] if authenticated else getattr(request, 'user', None)
+    return bool(user is not None and user.is_staff)
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, for ``Authorization: Bearer <METRICS_TOKEN>``
+    and staff users. METRICS_PUBLIC opens it to everyone.
+    """
+    if not scrape_allowed(request):
+        return HttpResponse(status=403)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
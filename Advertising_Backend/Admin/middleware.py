@@ -0,0 +1,124 @@
+import gzip
+import re
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    # listed in requirements.txt; without it only gzip is offered
+    brotli = None
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+COMPRESSIBLE_TYPES = re.compile(r'^(application/(json|javascript|xml)|text/|image/svg\+xml)')
+ACCEPT_ENCODING_RE = re.compile(r'\s*([^\s;,]+)\s*(?:;\s*q=([0-9.]+))?')
+
+# (encoding, level) candidates, best ratio first. The middleware picks the
+# first one whose expected CPU time fits COMPRESSION_CPU_BUDGET_MS.
+LEVELS = {
+    'br': (5, 1),
+    'gzip': (6, 1),
+}
+
+
+def compress(encoding, level, body):
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def accepted_encodings(header):
+    """Encodings the client accepts, as ``{encoding: q}``."""
+    accepted = {}
+    for match in ACCEPT_ENCODING_RE.finditer(header or ''):
+        encoding, q = match.group(1).lower(), match.group(2)
+        try:
+            accepted[encoding] = float(q) if q is not None else 1.0
+        except ValueError:
+            continue
+    return accepted
+
+
+class CompressionMiddleware:
+    """
+    Negotiated brotli/gzip compression of API responses.
+
+    Responses smaller than COMPRESSION_MIN_SIZE, already encoded, streaming
+    or of a non-text type are left alone. Each (encoding, level) keeps a
+    running estimate of its throughput on this process; a response is
+    compressed with the best level expected to finish within
+    COMPRESSION_CPU_BUDGET_MS, and sent as-is when even the cheapest would not.
+    """
+    # bytes per second, refined as responses are compressed
+    _throughput = {('br', 5): 40e6, ('br', 1): 250e6, ('gzip', 6): 60e6, ('gzip', 1): 150e6}
+    _lock = threading.Lock()
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        if self.should_compress(request, response):
+            self.compress_response(request, response)
+        return response
+
+    def should_compress(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding') or response.status_code < 200:
+            return False
+        if response.status_code in (204, 304) or request.method == 'HEAD':
+            return False
+        if len(response.content) < getattr(settings, 'COMPRESSION_MIN_SIZE', 1024):
+            return False
+        return bool(COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')))
+
+    def choose(self, request, size):
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding'))
+        encodings = [enc for enc in LEVELS if accepted.get(enc, 0) > 0 and (enc != 'br' or brotli is not None)]
+        budget = getattr(settings, 'COMPRESSION_CPU_BUDGET_MS', 20) / 1000
+        for encoding in encodings:
+            for level in LEVELS[encoding]:
+                if size / self._throughput[encoding, level] <= budget:
+                    return encoding, level
+        return None
+
+    def record(self, key, size, seconds):
+        if seconds <= 0:
+            return
+        with self._lock:
+            # exponential moving average, recent responses weigh more
+            self._throughput[key] = 0.9 * self._throughput[key] + 0.1 * (size / seconds)
+
+    def compress_response(self, request, response):
+        # the choice depends on Accept-Encoding whether or not we compress
+        patch_vary_headers(response, ('Accept-Encoding',))
+        body = response.content
+        choice = self.choose(request, len(body))
+        if choice is None:
+            return
+        started = time.thread_time()
+        compressed = compress(*choice, body)
+        self.record(choice, len(body), time.thread_time() - started)
+        if len(compressed) >= len(body):
+            return
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = choice[0]
+        # the representation changed, a strong ETag would now lie
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
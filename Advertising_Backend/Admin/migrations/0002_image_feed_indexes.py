@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Admin", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="imageupload",
+            index=models.Index(fields=["uploaded_at", "id"], name="image_feed_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="imageupload",
+            index=models.Index(fields=["subcategory", "uploaded_at", "id"], name="image_subcat_feed_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="imageupload",
+            index=models.Index(fields=["category", "uploaded_at", "id"], name="image_cat_feed_idx"),
+        ),
+    ]
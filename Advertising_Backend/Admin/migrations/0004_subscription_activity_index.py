@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Admin", "0003_chunked_upload"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="subscription",
+            index=models.Index(fields=["revoke", "end_date"], name="subscription_activity_idx"),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Admin", "0004_subscription_activity_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="subscription",
+            name="auto_renew",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="subscription",
+            name="expired_on",
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:21
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Admin", "0005_subscription_renewal"),
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="customuser",
+            name="username",
+            field=models.CharField(db_index=True, max_length=150),
+        ),
+        migrations.AddIndex(
+            model_name="customuser",
+            index=models.Index(django.db.models.functions.text.Lower("email"), name="user_email_lower_idx"),
+        ),
+    ]
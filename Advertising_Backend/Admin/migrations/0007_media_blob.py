@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:29
+
+import Admin.models
+import Admin.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Admin", "0006_login_identifier_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MediaBlob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("refs", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="carousel",
+            name="image1",
+            field=models.ImageField(blank=True, null=True, storage=Admin.storage.cas_storage, upload_to=Admin.models.carousel_image_path),
+        ),
+        migrations.AlterField(
+            model_name="carousel",
+            name="image2",
+            field=models.ImageField(blank=True, null=True, storage=Admin.storage.cas_storage, upload_to=Admin.models.carousel_image_path),
+        ),
+        migrations.AlterField(
+            model_name="carousel",
+            name="image3",
+            field=models.ImageField(blank=True, null=True, storage=Admin.storage.cas_storage, upload_to=Admin.models.carousel_image_path),
+        ),
+        migrations.AlterField(
+            model_name="carousel",
+            name="image4",
+            field=models.ImageField(blank=True, null=True, storage=Admin.storage.cas_storage, upload_to=Admin.models.carousel_image_path),
+        ),
+        migrations.AlterField(
+            model_name="customuser",
+            name="logo",
+            field=models.ImageField(blank=True, null=True, storage=Admin.storage.cas_storage, upload_to=Admin.models.user_logo_path),
+        ),
+        migrations.AlterField(
+            model_name="imageupload",
+            name="image",
+            field=models.ImageField(storage=Admin.storage.cas_storage, upload_to="uploads/"),
+        ),
+    ]
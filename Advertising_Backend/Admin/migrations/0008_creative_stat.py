@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Admin", "0007_media_blob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CreativeStat",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("kind", models.CharField(choices=[("image", "Image"), ("video", "Video")], max_length=10)),
+                ("creative_id", models.PositiveBigIntegerField()),
+                ("bucket", models.DateTimeField()),
+                ("impressions", models.PositiveBigIntegerField(default=0)),
+                ("clicks", models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                "indexes": [models.Index(fields=["bucket"], name="creative_stat_bucket_idx")],
+                "constraints": [models.UniqueConstraint(fields=("kind", "creative_id", "bucket"), name="creative_stat_bucket_uniq")],
+            },
+        ),
+    ]
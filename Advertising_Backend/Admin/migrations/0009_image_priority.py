@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Admin", "0008_creative_stat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imageupload",
+            name="priority",
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
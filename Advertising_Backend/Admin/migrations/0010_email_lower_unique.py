@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:02
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_duplicate_emails(apps, schema_editor):
+    # emails differing only in case cannot be merged automatically, name them instead
+    User = apps.get_model("Admin", "CustomUser")
+    duplicates = list(
+        User.objects.filter(email__isnull=False)
+        .values(email_lower=Lower("email"))
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .values_list("email_lower", flat=True)[:20]
+    )
+    if duplicates:
+        raise RuntimeError(
+            "These emails belong to several users once lowercased, make them unique before migrating: "
+            + ", ".join(duplicates)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Admin", "0009_image_priority"),
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="customuser",
+            name="user_email_lower_idx",
+        ),
+        migrations.AddConstraint(
+            model_name="customuser",
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower("email"), name="user_email_lower_uniq", violation_error_message="A user with this email already exists."),
+        ),
+    ]
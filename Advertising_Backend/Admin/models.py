@@ -1,11 +1,15 @@
+import uuid
 from datetime import date, timedelta
 from django.conf import settings
 
 
 
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 
+from .storage import cas_storage
+
 def user_profile_image_path(instance, filename):
     # file will be uploaded to MEDIA_ROOT/profile_images/<username>/<filename>
     return f'profile_images/{instance.username}/{filename}'
@@ -36,13 +40,38 @@ class CustomUserManager(BaseUserManager):
         extra_fields.setdefault("is_superuser", True)
         return self.create_user(username, phone, email, password, **extra_fields)
 
+    def get_by_login_identifier(self, identifier):
+        """
+        Resolve what a user typed into the login box (email, phone or username)
+        with a single indexed lookup. Emails match case-insensitively through
+        the unique Lower(email) index. Returns None when nothing matches.
+        """
+        identifier = (identifier or "").strip()
+        if not identifier:
+            return None
+        if "@" in identifier:
+            queryset = self.alias(email_lower=Lower("email")).filter(email_lower=identifier.lower())
+        elif identifier.lstrip("+").isdigit():
+            queryset = self.filter(phone=identifier)
+        else:
+            # usernames are not unique, the oldest account wins
+            queryset = self.filter(username=identifier)
+        return queryset.order_by("pk").first()
+
+    def email_taken(self, email, exclude_pk=None):
+        """Whether another user already has ``email``, compared case-insensitively."""
+        queryset = self.alias(email_lower=Lower("email")).filter(email_lower=email.lower())
+        if exclude_pk is not None:
+            queryset = queryset.exclude(pk=exclude_pk)
+        return queryset.exists()
+
 
 class CustomUser(AbstractBaseUser, PermissionsMixin):
-    username = models.CharField(max_length=150)
+    username = models.CharField(max_length=150, db_index=True)
     phone = models.CharField(max_length=15, unique=True, null=True, blank=True)
     email = models.EmailField(unique=True, null=True, blank=True)
     profile_image = models.ImageField(upload_to=user_profile_image_path, null=True, blank=True)
-    logo = models.ImageField(upload_to=user_logo_path, null=True, blank=True)
+    logo = models.ImageField(upload_to=user_logo_path, storage=cas_storage, null=True, blank=True)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
 
@@ -51,6 +80,13 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = "username"
     REQUIRED_FIELDS = ["phone", "email"]
 
+    class Meta:
+        constraints = [
+            # emails are matched case-insensitively at login, so they must be unique that way too
+            models.UniqueConstraint(Lower("email"), name="user_email_lower_uniq",
+                                    violation_error_message="A user with this email already exists."),
+        ]
+
     def __str__(self):
         return self.username
 
@@ -81,8 +117,18 @@ class ImageUpload(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='images',null=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     subcategory = models.ForeignKey(SubCategory, on_delete=models.CASCADE)
-    image = models.ImageField(upload_to="uploads/")
+    image = models.ImageField(upload_to="uploads/", storage=cas_storage)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # relative weight of the creative in ad selection (see ads.py), 0 pauses it
+    priority = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            # backs the keyset-paginated feed, see pagination.KeysetPagination
+            models.Index(fields=['uploaded_at', 'id'], name='image_feed_idx'),
+            models.Index(fields=['subcategory', 'uploaded_at', 'id'], name='image_subcat_feed_idx'),
+            models.Index(fields=['category', 'uploaded_at', 'id'], name='image_cat_feed_idx'),
+        ]
 
     def __str__(self):
         return self.title or f"Image {self.id}"
@@ -111,21 +157,75 @@ class YoutubeVideo(models.Model):
 # ------------------ Subscriptions -------------------
 
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 from datetime import timedelta
 from django.conf import settings
 
+
+def subscription_q(status, prefix='', today=None, days=None):
+    """
+    The SQL form of ``Subscription.is_active`` and friends. ``prefix`` lets the
+    same conditions filter other models, e.g. ``prefix='subscriptions__'`` on users.
+    """
+    today = today or timezone.now().date()
+    field = lambda name: f'{prefix}{name}'
+    # revoke__in rather than revoke=False: SQLite compiles the latter to
+    # "NOT revoke", which cannot use the (revoke, end_date) index.
+    if status == 'active':
+        return Q(**{field('revoke__in'): [False], field('end_date__gte'): today, field('plan__isnull'): False})
+    if status == 'expiring':
+        return subscription_q('active', prefix, today) & Q(**{field('end_date__lte'): today + timedelta(days=days)})
+    if status == 'expired':
+        return Q(**{field('revoke__in'): [False], field('end_date__lt'): today})
+    if status == 'revoked':
+        return Q(**{field('revoke__in'): [True]})
+    raise ValueError(f"Unknown subscription status {status!r}")
+
+
+class SubscriptionQuerySet(models.QuerySet):
+    def active(self, today=None):
+        return self.filter(subscription_q('active', today=today))
+
+    def expired(self, today=None):
+        return self.filter(subscription_q('expired', today=today))
+
+    def revoked(self):
+        return self.filter(subscription_q('revoked'))
+
+    def expiring_within(self, days, today=None):
+        """Active subscriptions that end within the next ``days`` days."""
+        return self.filter(subscription_q('expiring', today=today, days=days))
+
+
 class Subscription(models.Model):
     PLAN_CHOICES = [
         ('monthly', 'Monthly'),
         ('yearly', 'Yearly'),
     ]
 
+    # length of one billing period, in days
+    PLAN_DURATIONS = {
+        'monthly': 30,
+        'yearly': 365,
+    }
+
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='subscriptions')
     plan = models.CharField(max_length=20, choices=PLAN_CHOICES,null=True, blank=True)
     start_date = models.DateField(auto_now_add=True)
     end_date = models.DateField(blank=True, null=True)
     revoke=models.BooleanField(default=False)
+    auto_renew = models.BooleanField(default=False)
+    # set by the expiry job (services.process_due_subscriptions) once it has handled the lapse
+    expired_on = models.DateField(blank=True, null=True)
+
+    objects = SubscriptionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # every subscription_q() status is a range scan on this index
+            models.Index(fields=['revoke', 'end_date'], name='subscription_activity_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if self.revoke:
@@ -134,11 +234,12 @@ class Subscription(models.Model):
         if not self.start_date:
             self.start_date = timezone.now().date()
 
-        if not self.end_date:
-            if self.plan == 'monthly':
-                self.end_date = self.start_date + timedelta(days=30)
-            elif self.plan == 'yearly':
-                self.end_date = self.start_date + timedelta(days=365)
+        if not self.end_date and self.plan in self.PLAN_DURATIONS:
+            self.end_date = self.start_date + timedelta(days=self.PLAN_DURATIONS[self.plan])
+
+        if self.expired_on and self.end_date and self.end_date >= timezone.now().date():
+            # renewed after the expiry job marked it
+            self.expired_on = None
 
         super().save(*args, **kwargs)
 
@@ -157,10 +258,10 @@ class Subscription(models.Model):
 # ------------------------------------------------------
 
 class Carousel(models.Model):
-    image1 = models.ImageField(upload_to=carousel_image_path, blank=True, null=True)
-    image2 = models.ImageField(upload_to=carousel_image_path, blank=True, null=True)
-    image3 = models.ImageField(upload_to=carousel_image_path, blank=True, null=True)
-    image4 = models.ImageField(upload_to=carousel_image_path, blank=True, null=True)
+    image1 = models.ImageField(upload_to=carousel_image_path, storage=cas_storage, blank=True, null=True)
+    image2 = models.ImageField(upload_to=carousel_image_path, storage=cas_storage, blank=True, null=True)
+    image3 = models.ImageField(upload_to=carousel_image_path, storage=cas_storage, blank=True, null=True)
+    image4 = models.ImageField(upload_to=carousel_image_path, storage=cas_storage, blank=True, null=True)
 
     def add_image(self, new_image):
 
@@ -173,11 +274,82 @@ class Carousel(models.Model):
         elif not self.image4:
             self.image4 = new_image
         else:
-            # shift images: drop oldest (image1) and move others left
-            self.image1.delete(save=False)  # delete old file
+            # shift images: drop oldest (image1) and move others left; the
+            # dropped file is deleted in the background after save (signals.sync_media)
             self.image1, self.image2, self.image3 = self.image2, self.image3, self.image4
             self.image4 = new_image
         self.save()
 
     def __str__(self):
         return "Carousel"
+
+
+# ------------------ Chunked uploads -------------------
+
+class ChunkedUpload(models.Model):
+    """
+    A resumable upload in progress. Chunks are appended to a temp file on disk
+    (see uploads.py); ``offset`` is how many bytes have been received so far.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chunked_uploads')
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def is_complete(self):
+        return self.offset == self.size
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+
+# ------------------ Deduplicated media -------------------
+
+class MediaBlob(models.Model):
+    """
+    One stored file under cas/ (see storage.py) and how many image fields
+    point at it. The file is deleted once ``refs`` drops to zero.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    refs = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refs} refs)"
+
+
+# ------------------ Creative statistics -------------------
+
+class CreativeStat(models.Model):
+    """
+    Impressions and clicks of one creative (an image or a video) during one
+    time bucket. Written only by counters.py, which adds to the counts in
+    batched upserts; ``bucket`` is the start of the bucket.
+    """
+    KIND_CHOICES = [
+        ('image', 'Image'),
+        ('video', 'Video'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # no foreign key: one table for both kinds, and counts outlive deleted creatives
+    creative_id = models.PositiveBigIntegerField()
+    bucket = models.DateTimeField()
+    impressions = models.PositiveBigIntegerField(default=0)
+    clicks = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # the ON CONFLICT target of the flush upsert
+            models.UniqueConstraint(fields=['kind', 'creative_id', 'bucket'], name='creative_stat_bucket_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['bucket'], name='creative_stat_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.creative_id} @ {self.bucket}: {self.impressions}/{self.clicks}"
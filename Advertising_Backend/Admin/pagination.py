@@ -0,0 +1,109 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over ``(uploaded_at, id)``, newest first.
+
+    The cursor carries the last row's ``uploaded_at`` and ``id``, so every page
+    is a single indexed range scan: ``WHERE (uploaded_at, id) < cursor LIMIT n``.
+    Unlike offset pagination the cost does not grow with the page number.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        params = getattr(request, 'query_params', request.GET)
+        try:
+            size = int(params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        params = getattr(request, 'query_params', request.GET)
+        encoded = params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            timestamp, pk = raw.rsplit('|', 1)
+            uploaded_at = parse_datetime(timestamp)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if uploaded_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return uploaded_at, pk
+
+    def encode_cursor(self, row):
+        if isinstance(row, dict):
+            uploaded_at, pk = row['uploaded_at'], row['id']
+        else:
+            uploaded_at, pk = row.uploaded_at, row.id
+        raw = f"{uploaded_at.isoformat()}|{pk}"
+        return urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def get_page_queryset(self, queryset, request):
+        """
+        Return the sliced queryset for the requested page without evaluating it,
+        so callers can fetch rows synchronously or with the async ORM.
+        """
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            uploaded_at, pk = cursor
+            queryset = queryset.filter(
+                Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=pk)
+            )
+        # one extra row tells us whether a next page exists
+        return queryset.order_by('-uploaded_at', '-id')[:self.page_size_value + 1]
+
+    def finish_page(self, rows):
+        rows = list(rows)
+        self.has_next = len(rows) > self.page_size_value
+        rows = rows[:self.page_size_value]
+        self.next_cursor = self.encode_cursor(rows[-1]) if self.has_next and rows else None
+        return rows
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finish_page(self.get_page_queryset(queryset, request))
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_data(self, data):
+        return OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ])
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,309 @@
+"""
+Read-only "projection" serializers for the hot list endpoints.
+
+They read ``.values()`` rows and build the response dicts directly, skipping
+DRF's per-field machinery, and must produce exactly what the matching
+ModelSerializer would (tests.ProjectionParityTests keeps them honest). Keep
+the field order and formatting in sync whenever those serializers change.
+"""
+from operator import itemgetter
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .images import variant_names, variants_ready
+from .metrics import measure_serialization
+from .models import ImageUpload
+
+User = get_user_model()
+
+
+class URLBuilder:
+    """
+    ``storage.url()`` plus ``request.build_absolute_uri()`` for many names,
+    resolving the scheme, host and media prefix once per storage.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.prefixes = {}
+
+    def __call__(self, storage, name):
+        if not name:
+            return None
+        prefix = self.prefixes.get(storage)
+        if prefix is None:
+            base_url = storage.base_url
+            prefix = self.request.build_absolute_uri(base_url) if self.request is not None else base_url
+            self.prefixes[storage] = prefix
+        return prefix + filepath_to_uri(name).lstrip('/')
+
+    def variants(self, storage, name):
+        """Same shape as serializers.ImageVariantsField."""
+        if not name or not variants_ready(name, storage):
+            return None
+        return {
+            str(width): {fmt: self(storage, variant) for fmt, variant in names.items()}
+            for width, names in variant_names(name).items()
+        }
+
+
+class Projection:
+    """
+    Base class. ``lookups`` maps each output field, in output order, to the
+    ``values()`` lookups it reads; a field renders as its first lookup
+    unless the class defines ``render_<field>(row)``. Fields listed in
+    ``expanded_lookups`` can be rendered as nested objects instead, by
+    ``expand_<field>(row)``, when named in ``expand`` (``default_expand``
+    when it is not given).
+
+    ``fields`` limits the output to the named fields (plus those named in
+    ``expand``), and only the lookups of the chosen fields are
+    selected, so unused columns and joins are never read.
+    """
+    lookups = {}
+    expanded_lookups = {}
+    # read for every row whatever fields were asked for (e.g. the pagination key)
+    required_lookups = ()
+    default_expand = ()
+
+    def __init__(self, context=None, fields=None, expand=None):
+        self.context = context or {}
+        self.urls = URLBuilder(self.context.get('request'))
+        self.datetime_field = serializers.DateTimeField()
+        self.today = timezone.now().date()
+
+        lookups = self.get_lookups()
+        self.expand = set(self.default_expand if expand is None else expand)
+        # fields named in an explicit ?expand= are included even if ?fields= leaves them out
+        selected = [name for name in lookups if fields is None or name in fields or name in (expand or ())]
+        needed = list(self.required_lookups)
+        self.columns = []
+        for name in selected:
+            if name in self.expand:
+                needed += self.expanded_lookups[name]
+                render = getattr(self, f'expand_{name}')
+            else:
+                needed += lookups[name]
+                render = getattr(self, f'render_{name}', None) or itemgetter(lookups[name][0])
+            self.columns.append((name, render))
+        self.fields = tuple(dict.fromkeys(needed))
+
+    def get_lookups(self):
+        return self.lookups
+
+    @classmethod
+    def from_request(cls, request, context=None):
+        """Build the projection for ``?fields=`` and ``?expand=`` (comma separated)."""
+        params, options, errors = request.query_params, {}, {}
+        for param, allowed in (('fields', cls.lookups), ('expand', cls.expanded_lookups)):
+            if param not in params:
+                continue
+            names = [name.strip() for name in params[param].split(',') if name.strip()]
+            unknown = [name for name in names if name not in allowed]
+            if unknown:
+                errors[param] = [f"Unknown {param}: {', '.join(unknown)}. Choose from: {', '.join(allowed)}."]
+            options[param] = names
+        if errors:
+            raise serializers.ValidationError(errors)
+        return cls(context=context, **options)
+
+    def values(self, queryset):
+        return queryset.values(*self.fields)
+
+    def to_representation(self, row):
+        return {name: render(row) for name, render in self.columns}
+
+    def represent(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+    def date(self, value):
+        return value.isoformat() if value else None
+
+    def datetime(self, value):
+        return self.datetime_field.to_representation(value)
+
+    def is_active(self, plan, end_date, revoke):
+        # Subscription.is_active on plain values
+        if not end_date or not plan or revoke:
+            return False
+        return end_date >= self.today
+
+
+class ImageUploadProjection(Projection):
+    """ImageUploadSerializer."""
+    lookups = {
+        'id': ('id',),
+        'category_name': ('category__name',),
+        'subcategory_name': ('subcategory__name',),
+        'image_variants': ('image',),
+        'image': ('image',),
+        'uploaded_at': ('uploaded_at',),
+        'priority': ('priority',),
+        'user': ('user',),
+        'category': ('category',),
+        'subcategory': ('subcategory',),
+    }
+    expanded_lookups = {
+        'user': ('user', 'user__username'),
+        'category': ('category', 'category__name'),
+        'subcategory': ('subcategory', 'subcategory__name'),
+    }
+    # KeysetPagination builds its cursor from these
+    required_lookups = ('id', 'uploaded_at')
+    storage = ImageUpload._meta.get_field('image').storage
+
+    def render_image_variants(self, row):
+        return self.urls.variants(self.storage, row['image'])
+
+    def render_image(self, row):
+        return self.urls(self.storage, row['image'])
+
+    def render_uploaded_at(self, row):
+        return self.datetime(row['uploaded_at'])
+
+    def expand_user(self, row):
+        if row['user'] is None:
+            return None
+        return {'id': row['user'], 'username': row['user__username']}
+
+    def expand_category(self, row):
+        return {'id': row['category'], 'name': row['category__name']}
+
+    def expand_subcategory(self, row):
+        return {'id': row['subcategory'], 'name': row['subcategory__name']}
+
+
+class SubscriptionProjection(Projection):
+    """
+    SubscriptionSerializer (read side). ``prefix`` reads the subscription
+    columns of a joined row and ``user_prefix`` the columns of its user,
+    so UserProjection can reuse it on its own rows.
+    """
+    lookups = {
+        'id': ('id',),
+        'user': ('user__username',),
+        'user_email': ('user__email',),
+        'user_phone': ('user__phone',),
+        'plan': ('plan',),
+        'start_date': ('start_date',),
+        'end_date': ('end_date',),
+        'is_active': ('plan', 'end_date', 'revoke'),
+        'revoke': ('revoke',),
+        'auto_renew': ('auto_renew',),
+        'expired_on': ('expired_on',),
+    }
+    expanded_lookups = {
+        'user': ('user', 'user__username', 'user__email', 'user__phone'),
+    }
+
+    def __init__(self, context=None, fields=None, expand=None, prefix='', user_prefix='user__'):
+        self.prefix, self.user_prefix = prefix, user_prefix
+        self.expanded_lookups = {
+            name: tuple(self.column(lookup) for lookup in lookups)
+            for name, lookups in type(self).expanded_lookups.items()
+        }
+        super().__init__(context, fields, expand)
+
+    def column(self, lookup):
+        if lookup.startswith('user__'):
+            return self.user_prefix + lookup[len('user__'):]
+        return self.prefix + lookup
+
+    def get_lookups(self):
+        return {name: tuple(self.column(lookup) for lookup in lookups) for name, lookups in self.lookups.items()}
+
+    def render_start_date(self, row):
+        return self.date(row[self.prefix + 'start_date'])
+
+    def render_end_date(self, row):
+        return self.date(row[self.prefix + 'end_date'])
+
+    def render_expired_on(self, row):
+        return self.date(row[self.prefix + 'expired_on'])
+
+    def render_is_active(self, row):
+        prefix = self.prefix
+        return self.is_active(row[prefix + 'plan'], row[prefix + 'end_date'], row[prefix + 'revoke'])
+
+    def expand_user(self, row):
+        user_prefix = self.user_prefix
+        return {
+            'id': row[self.column('user')],
+            'username': row[user_prefix + 'username'],
+            'email': row[user_prefix + 'email'],
+            'phone': row[user_prefix + 'phone'],
+        }
+
+
+class UserProjection(Projection):
+    """UserSerializer, with the nested subscription read through the same join."""
+    lookups = {
+        'id': ('id',),
+        'username': ('username',),
+        'phone': ('phone',),
+        'email': ('email',),
+        'is_active': ('is_active',),
+        'is_staff': ('is_staff',),
+        'profile_image': ('profile_image',),
+        'logo': ('logo',),
+        'profile_image_variants': ('profile_image',),
+        'logo_variants': ('logo',),
+        'subscriptions': ('subscriptions__id',),
+    }
+    expanded_lookups = {
+        'subscriptions': tuple(
+            'subscriptions__' + field
+            for field in ('id', 'plan', 'start_date', 'end_date', 'revoke', 'auto_renew', 'expired_on')
+        ) + ('username', 'email', 'phone'),
+    }
+    default_expand = ('subscriptions',)
+    profile_image_storage = User._meta.get_field('profile_image').storage
+    logo_storage = User._meta.get_field('logo').storage
+
+    def __init__(self, context=None, fields=None, expand=None):
+        super().__init__(context, fields, expand)
+        # the subscription's user is the row's user, its columns are already there
+        self.subscription = SubscriptionProjection(self.context, prefix='subscriptions__', user_prefix='')
+
+    def render_profile_image(self, row):
+        return self.urls(self.profile_image_storage, row['profile_image'])
+
+    def render_logo(self, row):
+        return self.urls(self.logo_storage, row['logo'])
+
+    def render_profile_image_variants(self, row):
+        return self.urls.variants(self.profile_image_storage, row['profile_image'])
+
+    def render_logo_variants(self, row):
+        return self.urls.variants(self.logo_storage, row['logo'])
+
+    def expand_subscriptions(self, row):
+        if row['subscriptions__id'] is None:
+            return None
+        return self.subscription.to_representation(row)
+
+
+class ProjectionListMixin:
+    """
+    List GETs go through ``projection_class`` instead of the serializer,
+    honouring ``?fields=`` and ``?expand=``.
+    Works with pagination classes that accept a values() queryset
+    (KeysetPagination does) and with unpaginated lists.
+    """
+    projection_class = None
+
+    def list(self, request, *args, **kwargs):
+        projection = self.projection_class.from_request(request, context=self.get_serializer_context())
+        queryset = projection.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        # rows are fetched first so the query does not count as serialization
+        rows = list(page if page is not None else queryset)
+        with measure_serialization():
+            data = projection.represent(rows)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
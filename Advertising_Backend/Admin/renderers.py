@@ -0,0 +1,47 @@
+import time
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .metrics import record_render
+
+if orjson is not None:
+    # datetimes, decimals etc. go through DRF's encoder so the output matches JSONRenderer
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed. The bytes are
+    the same as DRF's compact output; indented (browsable/``indent=``)
+    requests and installs without orjson fall back to the stock renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        started = time.perf_counter()
+        try:
+            return self.encode(data, accepted_media_type, renderer_context)
+        finally:
+            record_render(time.perf_counter() - started)
+
+    def encode(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        renderer_context = renderer_context or {}
+        if self.ensure_ascii or not self.compact or self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=JSONEncoder().default, option=ORJSON_OPTIONS)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which the stdlib encoder handles
+            return super().render(data, accepted_media_type, renderer_context)
+        # same escaping JSONRenderer applies for JavaScript compatibility
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
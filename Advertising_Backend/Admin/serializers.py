@@ -1,13 +1,63 @@
 
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Category, CustomUser, SubCategory, ImageUpload, Subscription, YoutubeVideo,Carousel
+from .models import Category, CustomUser, SubCategory, ImageUpload, Subscription, YoutubeVideo,Carousel, ChunkedUpload, \
+    CreativeStat
+from .images import variant_names, variants_ready
+from .metrics import measure_serialization
+from .uploads import IMAGE_SIGNATURES
+from .backends import authenticate_identifier
+from django.conf import settings
 
 User = get_user_model()
 
 
+class TimedModelSerializer(serializers.ModelSerializer):
+    """ModelSerializer whose output building shows up as ``serialize`` in the request metrics."""
+
+    def to_representation(self, instance):
+        with measure_serialization():
+            return super().to_representation(instance)
+
+
+class UniqueEmailMixin:
+    """Rejects an email another user already has, in any letter case."""
+
+    def validate_email(self, value):
+        # the unique Lower(email) constraint would otherwise surface as a 500
+        instance_pk = self.instance.pk if self.instance is not None else None
+        if value and User.objects.email_taken(value, exclude_pk=instance_pk):
+            raise serializers.ValidationError("A user with this email already exists.")
+        return value
+
+
+class ImageVariantsField(serializers.Field):
+    """
+    URLs of the resized derivatives of an image field, keyed by width and
+    format: ``{"320": {"webp": ..., "jpeg": ...}, ...}``. ``None`` without an
+    image, or while its variants are not generated yet; use the original then.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value or not variants_ready(value.name, value.storage):
+            return None
+        request = self.context.get('request', None)
+        variants = {}
+        for width, names in variant_names(value.name).items():
+            urls = {}
+            for fmt, name in names.items():
+                url = value.storage.url(name)
+                urls[fmt] = request.build_absolute_uri(url) if request is not None else url
+            variants[str(width)] = urls
+        return variants
+
+
 # -------------------- Subscription --------------------
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(TimedModelSerializer):
     user = serializers.StringRelatedField(read_only=True)  # show username
     user_id = serializers.PrimaryKeyRelatedField(
         queryset=Subscription._meta.get_field("user").related_model.objects.all(),
@@ -24,9 +74,10 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         model = Subscription
         fields = [
             'id', 'user', 'user_id', "user_email", "user_phone",
-            'plan', 'start_date', 'end_date', 'is_active', 'revoke'
+            'plan', 'start_date', 'end_date', 'is_active', 'revoke',
+            'auto_renew', 'expired_on'
         ]
-        read_only_fields = ['start_date', 'is_active', 'user_email', 'user_phone']
+        read_only_fields = ['start_date', 'is_active', 'user_email', 'user_phone', 'expired_on']
 
     def get_is_active(self, obj):
         return obj.is_active
@@ -53,37 +104,44 @@ class SubscriptionSerializer(serializers.ModelSerializer):
             instance.end_date = validated_data.get('end_date', instance.end_date)
 
         instance.revoke = validated_data.get('revoke', instance.revoke)
+        instance.auto_renew = validated_data.get('auto_renew', instance.auto_renew)
         instance.save()
         return instance
 
 
 # -------------------- User --------------------
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedModelSerializer):
     subscriptions = SubscriptionSerializer(read_only=True)
+    profile_image_variants = ImageVariantsField(source='profile_image')
+    logo_variants = ImageVariantsField(source='logo')
 
     class Meta:
         model = User
         fields = [
             'id', 'username', 'phone', 'email',
             'is_active', 'is_staff', 'profile_image', 'logo',
+            'profile_image_variants', 'logo_variants',
             "subscriptions"
         ]
 
 
-class EditUserSerializer(serializers.ModelSerializer):
+class EditUserSerializer(UniqueEmailMixin, TimedModelSerializer):
     subscription = SubscriptionSerializer(read_only=True, source='subscriptions')  # read-only
+    profile_image_variants = ImageVariantsField(source='profile_image')
+    logo_variants = ImageVariantsField(source='logo')
 
     class Meta:
         model = CustomUser
         fields = [
             'id', 'username', 'phone', 'email',
             'is_active', 'is_staff', 'profile_image', 'logo',
+            'profile_image_variants', 'logo_variants',
             'subscription'  # include subscription info
         ]
 
 
 
-class RegisterSerializer(serializers.ModelSerializer):
+class RegisterSerializer(UniqueEmailMixin, TimedModelSerializer):
     password = serializers.CharField(write_only=True)
     is_staff = serializers.BooleanField(default=False)
 
@@ -119,15 +177,8 @@ class LoginSerializer(serializers.Serializer):
         identifier = data.get('identifier')
         password = data.get('password')
 
-        user = None
-        if '@' in identifier:
-            user = User.objects.filter(email=identifier).first()
-        elif identifier.isdigit():
-            user = User.objects.filter(phone=identifier).first()
-        else:
-            user = User.objects.filter(username=identifier).first()
-
-        if user and user.check_password(password):
+        user = authenticate_identifier(identifier, password)
+        if user:
             if not user.is_active:
                 raise serializers.ValidationError("User is inactive")
             data['user'] = user
@@ -139,37 +190,85 @@ class LoginSerializer(serializers.Serializer):
 
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
 
 
-class SubCategorySerializer(serializers.ModelSerializer):
+class SubCategorySerializer(TimedModelSerializer):
     class Meta:
         model = SubCategory
         fields = '__all__'
 
 
-class ImageUploadSerializer(serializers.ModelSerializer):
+class CategoryTreeSerializer(TimedModelSerializer):
+    class SubCategoryNodeSerializer(TimedModelSerializer):
+        class Meta:
+            model = SubCategory
+            fields = ['id', 'name']
+
+    subcategories = SubCategoryNodeSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'subcategories']
+
+
+class ImageUploadSerializer(TimedModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     subcategory_name = serializers.CharField(source='subcategory.name', read_only=True)
+    image_variants = ImageVariantsField(source='image')
 
     class Meta:
         model = ImageUpload
         fields = '__all__'
-        
+
+    def validate_priority(self, value):
+        request = self.context.get('request')
+        if request is None or not request.user.is_staff:
+            raise serializers.ValidationError("Only staff can set the ad priority.")
+        return value
+
+
+class ImageBulkUploadSerializer(serializers.Serializer):
+    """Metadata shared by every file of a bulk upload; the files are validated one by one."""
+    category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
+    subcategory = serializers.PrimaryKeyRelatedField(queryset=SubCategory.objects.all())
+
+    def validate(self, data):
+        if data['subcategory'].category_id != data['category'].id:
+            raise serializers.ValidationError({"subcategory": "Subcategory does not belong to this category."})
+        return data
+
+
+class ImageBulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
+
+    def validate_ids(self, value):
+        if len(value) > settings.BULK_IMAGE_MAX_ITEMS:
+            raise serializers.ValidationError(f"At most {settings.BULK_IMAGE_MAX_ITEMS} ids per request.")
+        return list(dict.fromkeys(value))
+
 #---------------------------------------------------
-class YoutubeVideoSerializer(serializers.ModelSerializer):
+class YoutubeVideoSerializer(TimedModelSerializer):
     class Meta:
         model = YoutubeVideo
         fields = "__all__"
 
 
-class CarouselSerializer(serializers.ModelSerializer):
+class CarouselSerializer(TimedModelSerializer):
+    image1_variants = ImageVariantsField(source='image1')
+    image2_variants = ImageVariantsField(source='image2')
+    image3_variants = ImageVariantsField(source='image3')
+    image4_variants = ImageVariantsField(source='image4')
+
     class Meta:
         model = Carousel
-        fields = ["id", "image1", "image2", "image3", "image4"]
+        fields = [
+            "id", "image1", "image2", "image3", "image4",
+            "image1_variants", "image2_variants", "image3_variants", "image4_variants",
+        ]
 
     def update(self, instance, validated_data):
         for field in ["image1", "image2", "image3", "image4"]:
@@ -177,4 +276,93 @@ class CarouselSerializer(serializers.ModelSerializer):
                 # Update only if new value is provided
                 setattr(instance, field, validated_data[field])
         instance.save()
-        return instance
\ No newline at end of file
+        return instance
+
+
+#---------------------------------------------------
+class ChunkedUploadSerializer(TimedModelSerializer):
+    class Meta:
+        model = ChunkedUpload
+        fields = ['id', 'filename', 'content_type', 'size', 'offset', 'created_at']
+        read_only_fields = ['id', 'offset', 'created_at']
+
+    def validate_content_type(self, value):
+        if value not in IMAGE_SIGNATURES:
+            raise serializers.ValidationError(
+                f"Unsupported content type. Allowed: {', '.join(IMAGE_SIGNATURES)}."
+            )
+        return value
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Size must be positive.")
+        if value > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"File is larger than the {settings.CHUNKED_UPLOAD_MAX_SIZE} byte limit."
+            )
+        return value
+
+
+class ChunkedUploadCompleteSerializer(serializers.Serializer):
+    TARGET_CHOICES = [
+        ('image', 'Image upload'),
+        ('profile_image', 'Profile image'),
+        ('logo', 'Logo'),
+    ]
+
+    target = serializers.ChoiceField(choices=TARGET_CHOICES)
+    category = serializers.IntegerField(required=False)
+    subcategory = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        if data['target'] == 'image' and not (data.get('category') and data.get('subcategory')):
+            raise serializers.ValidationError("category and subcategory are required for an image upload.")
+        return data
+
+
+#---------------------------------------------------
+class CreativeEventSerializer(serializers.Serializer):
+    creative = serializers.ChoiceField(choices=CreativeStat.KIND_CHOICES)
+    id = serializers.IntegerField(min_value=1)
+    type = serializers.ChoiceField(choices=[('impression', 'Impression'), ('click', 'Click')])
+    # lets clients batch repeated impressions of one creative
+    count = serializers.IntegerField(min_value=1, max_value=100, default=1)
+
+
+class CreativeEventBatchSerializer(serializers.Serializer):
+    events = serializers.ListField(child=CreativeEventSerializer(), allow_empty=False)
+
+    def validate_events(self, value):
+        if len(value) > settings.COUNTER_MAX_EVENTS:
+            raise serializers.ValidationError(f"At most {settings.COUNTER_MAX_EVENTS} events per request.")
+        return value
+
+
+class CreativeStatsQuerySerializer(serializers.Serializer):
+    INTERVAL_CHOICES = [
+        ('bucket', 'Stored buckets'),
+        ('day', 'Day'),
+        ('total', 'Whole range'),
+    ]
+
+    creative = serializers.ChoiceField(choices=CreativeStat.KIND_CHOICES, required=False)
+    id = serializers.IntegerField(min_value=1, required=False)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    interval = serializers.ChoiceField(choices=INTERVAL_CHOICES, default='day')
+
+
+class AdSelectionQuerySerializer(serializers.Serializer):
+    category = serializers.IntegerField(min_value=1, required=False)
+    subcategory = serializers.IntegerField(min_value=1, required=False)
+    count = serializers.IntegerField(min_value=1, default=1)
+
+    def validate_count(self, value):
+        if value > settings.ADS_MAX_COUNT:
+            raise serializers.ValidationError(f"At most {settings.ADS_MAX_COUNT} creatives per request.")
+        return value
+
+    def validate(self, data):
+        if ('category' in data) == ('subcategory' in data):
+            raise serializers.ValidationError("Pass either category or subcategory.")
+        return data
@@ -0,0 +1,100 @@
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import ads
+from .authentication import forget_user_states
+from .models import Subscription, subscription_q
+
+
+# ------------------ Subscription expiry / renewal -------------------
+
+@dataclass
+class SubscriptionRunResult:
+    renewed: int = 0
+    expired: int = 0
+    batches: int = 0
+    started: float = field(default_factory=time.monotonic)
+    elapsed: float = 0.0
+
+    @property
+    def processed(self):
+        return self.renewed + self.expired
+
+    @property
+    def rows_per_second(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+
+def due_subscriptions(today):
+    """Lapsed subscriptions the job has not handled yet."""
+    return Subscription.objects.filter(
+        subscription_q('expired', today=today),
+        plan__isnull=False,
+        expired_on__isnull=True,
+    )
+
+
+def renew(subscription, today):
+    period = timedelta(days=Subscription.PLAN_DURATIONS[subscription.plan])
+    # skip whole periods at once if the job did not run for a while
+    missed = -(-(today - subscription.end_date) // period)
+    subscription.end_date += period * missed
+
+
+def process_due_subscriptions(batch_size=500, today=None, max_batches=None, on_batch=None):
+    """
+    Renew (``auto_renew``) or mark expired every lapsed subscription, one
+    batch of at most ``batch_size`` rows per transaction.
+
+    Rows are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED``, so several
+    copies can run side by side without touching the same rows, and each
+    handled row stops matching ``due_subscriptions``, so an interrupted run
+    simply resumes where it stopped. ``on_batch(result)`` is called after
+    every committed batch. bulk_update sends no signals, so the ad pools of
+    the renewed users and the cached rows of every handled user are dropped
+    here.
+    """
+    today = today or timezone.now().date()
+    result = SubscriptionRunResult()
+
+    while max_batches is None or result.batches < max_batches:
+        with transaction.atomic():
+            batch = list(
+                due_subscriptions(today)
+                .select_for_update(skip_locked=True)
+                .only('id', 'user_id', 'plan', 'end_date', 'auto_renew', 'expired_on')
+                .order_by('end_date', 'id')[:batch_size]
+            )
+            if not batch:
+                break
+
+            renewed, expired = [], []
+            for subscription in batch:
+                if subscription.auto_renew and subscription.plan in Subscription.PLAN_DURATIONS:
+                    renew(subscription, today)
+                    renewed.append(subscription)
+                else:
+                    subscription.expired_on = today
+                    expired.append(subscription)
+
+            Subscription.objects.bulk_update(renewed, ['end_date'])
+            Subscription.objects.bulk_update(expired, ['expired_on'])
+            # expired owners already dropped out of their pools when their end_date passed
+            ads.invalidate_owners([subscription.user_id for subscription in renewed])
+            # bulk_update sends no signals, retire the cached user rows by hand
+            user_ids = [subscription.user_id for subscription in batch]
+            transaction.on_commit(lambda: forget_user_states(user_ids))
+
+        result.renewed += len(renewed)
+        result.expired += len(expired)
+        result.batches += 1
+        result.elapsed = time.monotonic() - result.started
+        if on_batch is not None:
+            on_batch(result)
+
+    result.elapsed = time.monotonic() - result.started
+    return result
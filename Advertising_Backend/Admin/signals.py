@@ -0,0 +1,154 @@
+from collections import Counter
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.fields.files import FieldFile
+from django.db.models.signals import post_delete, post_init, post_save
+
+from .ads import invalidate_owner, invalidate_pools
+from .authentication import forget_user_states, set_user_state
+from .blobs import release_media, retain_media
+from .home import SECTION_MODELS, invalidate_sections
+from .images import schedule_variants
+from .models import Carousel, ImageUpload, Subscription
+
+User = get_user_model()
+
+# Image fields that get derivatives, per model.
+MEDIA_FIELDS = {
+    ImageUpload: ('image',),
+    User: ('profile_image', 'logo'),
+    Carousel: ('image1', 'image2', 'image3', 'image4'),
+}
+
+
+def file_name(value):
+    return getattr(value, 'name', value) or ''
+
+
+def stored_name(value):
+    """The storage name of a field value, '' for a file that is not saved yet."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, FieldFile) and value._committed:
+        return value.name or ''
+    # an upload passed to the constructor: its name is the client's file name, not a stored file
+    return ''
+
+
+def remember_media(sender, instance, **kwargs):
+    # read the raw attribute, going through the descriptor would build a FieldFile per row
+    instance._media_names = {
+        field: stored_name(instance.__dict__.get(field)) for field in MEDIA_FIELDS[sender]
+    }
+
+
+def media_changed(sender, instance, update_fields=None, **kwargs):
+    """Yield ``(field, old_name, new_name)`` for image fields changed by this save."""
+    previous = getattr(instance, '_media_names', {})
+    for field in MEDIA_FIELDS[sender]:
+        if update_fields is not None and field not in update_fields:
+            continue
+        if field not in instance.__dict__:
+            # deferred and untouched, reading it would cost a query
+            continue
+        old, new = previous.get(field, ''), file_name(getattr(instance, field))
+        if old != new:
+            yield field, old, new
+
+
+def media_by_storage(sender, pairs):
+    """Group ``(field, name)`` pairs into ``{storage: Counter(names)}``."""
+    grouped = {}
+    for field, name in pairs:
+        if name:
+            storage = sender._meta.get_field(field).storage
+            grouped.setdefault(storage, Counter())[name] += 1
+    return grouped
+
+
+def sync_media(sender, instance, created=False, **kwargs):
+    """
+    Build variants for new files and drop the references (and files) this
+    save replaced. Names are diffed across all fields as a whole because a
+    file can move between fields (Carousel.add_image shifts images left).
+    """
+    if created:
+        # nothing to replace, every file the new row points at is a new reference
+        instance._media_names = {}
+    changes = list(media_changed(sender, instance, **kwargs))
+    added = media_by_storage(sender, ((field, new) for field, _, new in changes))
+    removed = media_by_storage(sender, ((field, old) for field, old, _ in changes))
+    sections = SECTION_MODELS.get(sender)
+    # cached home sections list the image without variants until they exist
+    on_ready = partial(invalidate_sections, sections) if sections else None
+    for storage in added.keys() | removed.keys():
+        new, old = added.get(storage, Counter()), removed.get(storage, Counter())
+        for name in new - old:
+            schedule_variants(name, storage, on_ready)
+        retain_media(new - old)
+        release_media(old - new, storage)
+    remember_media(sender, instance)
+
+
+def delete_media(sender, instance, **kwargs):
+    fields = [field for field in MEDIA_FIELDS[sender] if field in instance.__dict__]
+    names = media_by_storage(sender, ((field, file_name(instance.__dict__[field])) for field in fields))
+    for storage, counts in names.items():
+        release_media(counts, storage)
+
+
+def invalidate_home(sender, **kwargs):
+    invalidate_sections(SECTION_MODELS[sender])
+
+
+def remember_ad_pool(sender, instance, **kwargs):
+    instance._ad_pool = (instance.__dict__.get('category_id'), instance.__dict__.get('subcategory_id'))
+
+
+def invalidate_ad_pools(sender, instance, **kwargs):
+    # the pools the image was in and the ones it is in now
+    old_category, old_subcategory = getattr(instance, '_ad_pool', (None, None))
+    invalidate_pools([old_category, instance.category_id], [old_subcategory, instance.subcategory_id])
+    remember_ad_pool(sender, instance)
+
+
+def invalidate_owner_ads(sender, instance, **kwargs):
+    invalidate_owner(instance.user_id)
+
+
+def refresh_user_state(sender, instance, **kwargs):
+    # every save, not only is_active / is_staff ones: the new version retires cached rows
+    user_id, is_active, is_staff = instance.pk, instance.is_active, instance.is_staff
+    transaction.on_commit(lambda: set_user_state(user_id, is_active, is_staff))
+
+
+def forget_deleted_user(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: set_user_state(user_id, False, False))
+
+
+def forget_subscriber(sender, instance, **kwargs):
+    # cached user rows carry the subscription
+    user_id = instance.user_id
+    transaction.on_commit(lambda: forget_user_states([user_id]))
+
+
+def connect():
+    for model in MEDIA_FIELDS:
+        post_init.connect(remember_media, sender=model, dispatch_uid=f'remember_media_{model.__name__}')
+        post_save.connect(sync_media, sender=model, dispatch_uid=f'sync_media_{model.__name__}')
+        post_delete.connect(delete_media, sender=model, dispatch_uid=f'delete_media_{model.__name__}')
+    for model in SECTION_MODELS:
+        post_save.connect(invalidate_home, sender=model, dispatch_uid=f'invalidate_home_{model.__name__}')
+        post_delete.connect(invalidate_home, sender=model, dispatch_uid=f'invalidate_home_delete_{model.__name__}')
+    post_init.connect(remember_ad_pool, sender=ImageUpload, dispatch_uid='remember_ad_pool')
+    post_save.connect(invalidate_ad_pools, sender=ImageUpload, dispatch_uid='invalidate_ad_pools')
+    post_delete.connect(invalidate_ad_pools, sender=ImageUpload, dispatch_uid='invalidate_ad_pools_delete')
+    post_save.connect(invalidate_owner_ads, sender=Subscription, dispatch_uid='invalidate_owner_ads')
+    post_delete.connect(invalidate_owner_ads, sender=Subscription, dispatch_uid='invalidate_owner_ads_delete')
+    post_save.connect(forget_subscriber, sender=Subscription, dispatch_uid='forget_subscriber')
+    post_delete.connect(forget_subscriber, sender=Subscription, dispatch_uid='forget_subscriber_delete')
+    post_save.connect(refresh_user_state, sender=User, dispatch_uid='refresh_user_state')
+    post_delete.connect(forget_deleted_user, sender=User, dispatch_uid='forget_deleted_user')
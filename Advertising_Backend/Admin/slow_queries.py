@@ -0,0 +1,182 @@
+"""
+Slow-query log. Queries slower than SLOW_QUERY_THRESHOLD_MS are appended to
+SLOW_QUERY_LOG as JSON lines with their normalized SQL, the view and
+serializer of the request that ran them and the query plan. Summarise the
+log with ``manage.py slow_queries``.
+
+The plan is captured on the raw DB-API cursor, so it never shows up as a
+query of its own (assertNumQueries, connection.queries, Admin.metrics).
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from .metrics import current_request
+
+logger = logging.getLogger(__name__)
+
+# the same statement is explained at most once per interval (seconds) and process
+EXPLAIN_INTERVAL = 300
+EXPLAINABLE_RE = re.compile(r'^\s*(SELECT|WITH|UPDATE|DELETE|INSERT)\b', re.IGNORECASE)
+QMARK_RE = re.compile(r'(?<!%)%s')
+
+NORMALIZE = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),              # string literals
+    (re.compile(r'(?<![\w"])-?\d+(?:\.\d+)?\b'), '?'),  # numbers
+    (re.compile(r'%s|\?'), '?'),                       # placeholders
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),  # IN (?, ?, ...)
+    (re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+'), '(...)'),  # VALUES (...), (...)
+    (re.compile(r'\s+'), ' '),
+]
+
+_plans = {}
+_write_lock = threading.Lock()
+
+
+def normalize(sql):
+    """The statement with literals and parameters replaced, so repeats of one query group together."""
+    for pattern, replacement in NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+def origin():
+    """Route, view and serializer of the request being served, if any."""
+    request = current_request()
+    info = {'route': None, 'view': None, 'serializer': None, 'method': None, 'path': None}
+    if request is None:
+        return info
+    info.update(method=request.method, path=request.path)
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        # before URL resolution (middleware, sessions)
+        return info
+    view = getattr(match.func, 'view_class', None) or match.func
+    serializer = getattr(view, 'serializer_class', None)
+    if request.method == 'GET' and getattr(view, 'projection_class', None) is not None:
+        serializer = view.projection_class
+    info.update(
+        route=match.view_name,
+        view=f'{view.__module__}.{view.__qualname__}',
+        serializer=serializer.__name__ if serializer is not None else None,
+    )
+    return info
+
+
+def explain(connection, sql, params):
+    """The plan of ``sql`` as a list of lines, None if the backend has no EXPLAIN we read."""
+    if connection.vendor == 'sqlite':
+        statement = 'EXPLAIN QUERY PLAN ' + sql
+        if params is not None:
+            # what SQLiteCursorWrapper does before handing the query to sqlite3
+            statement = QMARK_RE.sub('?', statement).replace('%%', '%')
+    elif connection.vendor == 'postgresql':
+        statement = 'EXPLAIN ' + sql
+    else:
+        return None
+
+    # a failed statement aborts the whole transaction on PostgreSQL
+    savepoint = connection.vendor == 'postgresql' and not connection.get_autocommit()
+    cursor = connection.connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            if params is None:
+                cursor.execute(statement)
+            else:
+                cursor.execute(statement, params)
+            rows = cursor.fetchall()
+        except Exception as exc:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            return [f'EXPLAIN failed: {exc}']
+        finally:
+            if savepoint:
+                cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+    finally:
+        cursor.close()
+
+    if connection.vendor == 'postgresql':
+        return [row[0] for row in rows]
+    # (id, parent, notused, detail) rows, indented like the sqlite3 shell does
+    depth, plan = {0: -1}, []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        plan.append('  ' * depth[node] + detail)
+    return plan
+
+
+def cached_plan(connection, key, sql, params):
+    now = time.monotonic()
+    explained = _plans.get(key)
+    if explained is not None and now - explained[0] < EXPLAIN_INTERVAL:
+        return explained[1]
+    plan = explain(connection, sql, params)
+    _plans[key] = (now, plan)
+    return plan
+
+
+def write(record):
+    path = settings.SLOW_QUERY_LOG
+    line = json.dumps(record, default=str) + '\n'
+    with _write_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as log:
+            log.write(line)
+
+
+class SlowQueryLogger:
+    """Execute wrapper installed on every connection, see install()."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __call__(self, execute, sql, params, many, context):
+        threshold = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', None)
+        if not threshold:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = (time.perf_counter() - started) * 1000
+        if duration >= threshold:
+            try:
+                self.log(sql, params, many, duration)
+            except Exception:
+                # never fail the query because the log could not be written
+                logger.exception("Could not log a slow query")
+        return result
+
+    def log(self, sql, params, many, duration):
+        normalized = normalize(sql)
+        key = fingerprint(normalized)
+        plan = None
+        if not many and EXPLAINABLE_RE.match(sql):
+            plan = cached_plan(self.connection, key, sql, params)
+        write({
+            'time': datetime.now(timezone.utc).isoformat(),
+            'duration_ms': round(duration, 3),
+            'fingerprint': key,
+            'sql': normalized,
+            'database': self.connection.alias,
+            'vendor': self.connection.vendor,
+            'many': many,
+            **origin(),
+            'plan': plan,
+        })
+
+
+def install(sender, connection, **kwargs):
+    if not any(isinstance(wrapper, SlowQueryLogger) for wrapper in connection.execute_wrappers):
+        connection.execute_wrappers.append(SlowQueryLogger(connection))
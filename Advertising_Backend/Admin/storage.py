@@ -0,0 +1,81 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+
+# Uploads are stored once per distinct content at cas/<h[:2]>/<h[2:4]>/<sha256><ext>.
+# A blob's name never changes meaning, so its URL can be cached forever.
+CAS_PREFIX = 'cas/'
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def is_cas_name(name):
+    return bool(name) and name.startswith(CAS_PREFIX)
+
+
+def blob_name(digest, ext):
+    return f"{CAS_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that files new uploads under their SHA-256. The hash is
+    computed while the upload streams to disk, so identical files cost one
+    copy and one pass. Names already under ``cas/`` (image variants) are
+    written as-is. Reference counts live in MediaBlob, see blobs.py.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        if is_cas_name(name):
+            return super().get_available_name(name, max_length)
+        # the final name comes from the content, see _save()
+        return name
+
+    def _save(self, name, content):
+        if is_cas_name(name):
+            return super()._save(name, content)
+
+        ext = os.path.splitext(name)[1].lower()
+        if hasattr(content, 'temporary_file_path'):
+            digest = hashlib.sha256()
+            with open(content.temporary_file_path(), 'rb') as fh:
+                while chunk := fh.read(HASH_CHUNK_SIZE):
+                    digest.update(chunk)
+            return self._store(content.temporary_file_path(), blob_name(digest.hexdigest(), ext))
+
+        tmp_dir = self.path(CAS_PREFIX + 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    fh.write(chunk)
+            return self._store(tmp_path, blob_name(digest.hexdigest(), ext))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _store(self, source, name):
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            # already stored; refresh the mtime so blobs.delete_blob() sees it as in use
+            os.utime(full_path)
+            return name
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        file_move_safe(source, full_path, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+
+def cas_storage():
+    return _cas_storage
+
+
+_cas_storage = ContentAddressedStorage()
@@ -0,0 +1,49 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'BACKGROUND_TASK_WORKERS', 2),
+                thread_name_prefix='admin-background',
+            )
+    return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed", getattr(func, '__name__', func))
+    finally:
+        # worker threads get their own DB connections, don't leak them
+        connections.close_all()
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Run ``func(*args, **kwargs)`` on the background thread pool once the
+    current transaction commits, so the request thread never waits for it.
+
+    With ``BACKGROUND_TASKS_EAGER`` the call runs inline (still after commit),
+    which is what tests and management commands want.
+    """
+    def submit():
+        if getattr(settings, 'BACKGROUND_TASKS_EAGER', False):
+            func(*args, **kwargs)
+        else:
+            get_executor().submit(_run, func, args, kwargs)
+
+    transaction.on_commit(submit)
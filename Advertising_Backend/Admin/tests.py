@@ -1,3 +1,1523 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from urllib.parse import quote, unquote
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import ads, images, metrics, middleware, slow_queries
+from .authentication import get_user_state, load_user, tokens_for_user
+from .backends import authenticate_identifier
+from .benchmark import MARKER, PASSWORD, percentile, placeholder_image
+from .counters import CounterBuffer
+from .models import (
+    Carousel, Category, ChunkedUpload, CreativeStat, ImageUpload, MediaBlob, SubCategory, Subscription,
+)
+from .projections import ImageUploadProjection, SubscriptionProjection, UserProjection
+from .serializers import ImageUploadSerializer, SubscriptionSerializer, UserSerializer
+from .services import process_due_subscriptions
+
+User = get_user_model()
+
+# Row counts each list endpoint is exercised at. The query count must not move.
+ROW_COUNTS = (1, 100, 10_000)
+
+
+class ListQueryCountTests(TestCase):
+    """List endpoints must run a fixed number of queries regardless of row count."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Food")
+        cls.subcategory = SubCategory.objects.create(category=cls.category, name="Bakery")
+        cls.admin = User.objects.create_user("admin", "0000000000", "admin@example.com", "pw", is_staff=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def fill_images(self, count):
+        missing = count - ImageUpload.objects.count()
+        ImageUpload.objects.bulk_create(
+            ImageUpload(user=self.admin, category=self.category, subcategory=self.subcategory,
+                        image=f"uploads/{n}.jpg")
+            for n in range(missing)
+        )
+
+    def fill_users(self, count):
+        # the admin user created in setUpTestData counts towards the total
+        start = User.objects.count()
+        users = User.objects.bulk_create(
+            User(username=f"user{n}", phone=f"9{n:09d}", email=f"user{n}@example.com", password="!")
+            for n in range(start, count + 1)
+        )
+        end_date = timezone.now().date() + timedelta(days=30)
+        Subscription.objects.bulk_create(
+            Subscription(user=user, plan="monthly", end_date=end_date) for user in users
+        )
+
+    def assert_list_queries(self, url, fill, expected):
+        for count in ROW_COUNTS:
+            with self.subTest(url=url, rows=count):
+                fill(count)
+                with self.assertNumQueries(expected):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_image_feed(self):
+        self.assert_list_queries("/images/", self.fill_images, 1)
+
+    def test_image_list_unpaginated(self):
+        self.assert_list_queries("/images/?paginate=false", self.fill_images, 1)
+
+    def test_user_list(self):
+        self.assert_list_queries("/users/", self.fill_users, 1)
+
+    def test_subscription_list(self):
+        self.assert_list_queries("/subscriptions/", self.fill_users, 1)
+
+
+class ProjectionParityTests(TestCase):
+    """Projections must render byte-for-byte what their serializers render."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Café & Bar")
+        subcategory = SubCategory.objects.create(category=category, name="Coffee")
+        today = timezone.now().date()
+        owner = User.objects.create_user("owner", "1111111111", "owner@example.com", "pw",
+                                         profile_image="profile_images/owner/me.jpg",
+                                         logo="cas/ab/cd/abcd.png")
+        plain = User.objects.create_user("plain", "2222222222", None, "pw")
+        nophone = User.objects.create_user("nophone", None, "nophone@example.com", "pw", is_active=False)
+        # bulk_create skips Subscription.save(), which would fill in the dates
+        Subscription.objects.bulk_create([
+            Subscription(user=owner, plan="monthly", start_date=today, end_date=today + timedelta(days=3),
+                         auto_renew=True),
+            Subscription(user=plain, plan="yearly", start_date=today - timedelta(days=366),
+                         end_date=today - timedelta(days=1), expired_on=today),
+            Subscription(user=nophone, plan=None, revoke=True),
+        ])
+        User.objects.create_user("nosub", "3333333333", "nosub@example.com", "pw")
+        for name in ["uploads/a.jpg", "uploads/with space é.png", "cas/12/34/1234.jpg"]:
+            ImageUpload.objects.create(user=owner, category=category, subcategory=subcategory, image=name)
+        ImageUpload.objects.create(user=None, category=category, subcategory=subcategory, image="uploads/b.webp")
+
+    def setUp(self):
+        self.context = {"request": APIRequestFactory().get("/", HTTP_HOST="media.example.com")}
+
+    def assert_parity(self, serializer_class, projection_class, queryset):
+        expected = JSONRenderer().render(serializer_class(queryset, many=True, context=self.context).data)
+        projection = projection_class(context=self.context)
+        actual = JSONRenderer().render(projection.represent(projection.values(queryset)))
+        self.assertEqual(actual, expected)
+
+    def test_images(self):
+        queryset = ImageUpload.objects.select_related("category", "subcategory").order_by("id")
+        self.assert_parity(ImageUploadSerializer, ImageUploadProjection, queryset)
+
+    def test_users(self):
+        self.assert_parity(UserSerializer, UserProjection, User.objects.select_related("subscriptions").order_by("id"))
+
+    def test_subscriptions(self):
+        queryset = Subscription.objects.select_related("user").order_by("id")
+        self.assert_parity(SubscriptionSerializer, SubscriptionProjection, queryset)
+
+    def test_without_request(self):
+        self.context = {}
+        self.test_images()
+        self.test_users()
+
+
+class TokenRevocationTests(TestCase):
+    """Tokens must follow is_active and is_staff changes, even once the cache forgets them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", "0000000000", "admin@example.com", "pw", is_staff=True)
+        cls.subscription = Subscription.objects.create(user=cls.admin, plan="monthly")
+
+    def setUp(self):
+        caches["default"].clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens_for_user(self.admin).access_token}")
+        self.url = f"/subscriptions/{self.subscription.pk}/"
+
+    def update_admin(self, **fields):
+        for name, value in fields.items():
+            setattr(self.admin, name, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.save()
+
+    def test_demoted(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.update_admin(is_staff=False)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_deactivated(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.update_admin(is_active=False)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deactivated_after_eviction(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.update_admin(is_active=False)
+        caches["default"].clear()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        # without the signal too: the state is read back from the database
+        User.objects.filter(pk=self.admin.pk).update(is_active=True, is_staff=False)
+        caches["default"].clear()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_token_carries_no_subscription(self):
+        token = tokens_for_user(self.admin).access_token
+        self.assertNotIn("sub_end", token.payload)
+
+    def test_profile_follows_subscription_changes(self):
+        self.assertEqual(self.client.get("/profile/").json()["subscription"]["plan"], "monthly")
+        self.subscription.plan = "yearly"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subscription.save()
+        self.assertEqual(self.client.get("/profile/").json()["subscription"]["plan"], "yearly")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subscription.delete()
+        self.assertIsNone(self.client.get("/profile/").json()["subscription"])
+
+    def test_cached_users_are_copies(self):
+        _, _, version = get_user_state(self.admin.pk)
+        first = load_user(self.admin.pk, version)
+        first.username = "changed"
+        first.subscriptions.plan = "changed"
+        with self.assertNumQueries(0):
+            second = load_user(self.admin.pk, version)
+        self.assertEqual(second.username, "admin")
+        self.assertEqual(second.subscriptions.plan, "monthly")
+
+
+class CounterBufferTests(TestCase):
+    """Buffered counts must reach CreativeStat exactly once, whatever the flushes run into."""
+
+    def setUp(self):
+        # no flusher thread, the tests flush by hand
+        patcher = mock.patch.object(CounterBuffer, "start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = CounterBuffer()
+
+    def totals(self):
+        return {(stat.creative_id, stat.impressions, stat.clicks) for stat in CreativeStat.objects.all()}
+
+    def test_flush(self):
+        self.buffer.add("image", 1, "impression", 3)
+        self.buffer.add("image", 1, "click")
+        self.buffer.add("image", 2, "impression")
+        self.assertTrue(self.buffer.flush())
+        self.buffer.add("image", 1, "impression")
+        self.assertTrue(self.buffer.flush())
+        self.assertEqual(self.totals(), {(1, 4, 1), (2, 1, 0)})
+        self.assertEqual(self.buffer.pending, {})
+
+    def test_failed_upsert_keeps_counts(self):
+        self.buffer.add("image", 1, "impression", 2)
+        with mock.patch("Admin.counters.upsert", side_effect=DatabaseError), self.assertLogs("Admin.counters"):
+            self.assertFalse(self.buffer.flush())
+        # counted while the flush was failing
+        self.buffer.add("image", 1, "click")
+        self.assertEqual(self.totals(), set())
+        self.assertTrue(self.buffer.flush())
+        self.assertEqual(self.totals(), {(1, 2, 1)})
+
+    def test_close_retries_the_final_flush(self):
+        self.buffer.add("image", 1, "impression")
+        with mock.patch("Admin.counters.upsert", side_effect=[DatabaseError, None]) as upsert, \
+                self.assertLogs("Admin.counters"):
+            self.buffer.close()
+        self.assertEqual(upsert.call_count, 2)
+        self.assertEqual(self.buffer.pending, {})
+
+
+class KeysetPaginationTests(TestCase):
+    """The image feed pages through every row once, newest first, whatever the page size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Food")
+        subcategory = SubCategory.objects.create(category=category, name="Bakery")
+        owner = User.objects.create_user("owner", "1111111111", "owner@example.com", "pw")
+        # same uploaded_at for a run of rows, the id must break the tie
+        uploaded_at = timezone.now()
+        images = ImageUpload.objects.bulk_create(
+            ImageUpload(user=owner, category=category, subcategory=subcategory, image=f"uploads/{n}.jpg")
+            for n in range(25)
+        )
+        ImageUpload.objects.filter(pk__in=[image.pk for image in images[:10]]).update(uploaded_at=uploaded_at)
+        cls.expected = list(ImageUpload.objects.order_by("-uploaded_at", "-id").values_list("id", flat=True))
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [image["id"] for image in response.json()["results"]]
+            url = response.json()["next"]
+        return ids
+
+    def test_pages_cover_every_row_once(self):
+        for size in (1, 7, 25, 100):
+            with self.subTest(page_size=size):
+                self.assertEqual(self.walk(f"/images/?page_size={size}"), self.expected)
+
+    def test_page_size_is_capped(self):
+        response = self.client.get("/images/?page_size=100000")
+        self.assertEqual(len(response.json()["results"]), 25)
+        self.assertIsNone(response.json()["next"])
+
+    def test_invalid_cursor(self):
+        for cursor in ("garbage", "bm90LWEtZGF0ZXwx", "MjAyNi0wMS0wMXxub3QtYW4taWQ=", "%FF"):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(f"/images/?cursor={cursor}").status_code, 404)
+
+    def test_cursor_round_trip(self):
+        first = self.client.get("/images/?page_size=10").json()
+        second = self.client.get(first["next"]).json()
+        self.assertEqual([image["id"] for image in second["results"]], self.expected[10:20])
+
+    def test_legacy_unpaginated_list(self):
+        response = self.client.get("/images/?paginate=false")
+        self.assertCountEqual([image["id"] for image in response.json()], self.expected)
+        self.assertEqual(response["Deprecation"], "true")
+
+
+class TaxonomyCacheTests(TestCase):
+    """Taxonomy lists come from the versioned cache, answer If-None-Match and follow writes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Food")
+        SubCategory.objects.create(category=cls.category, name="Bakery")
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_cached_and_conditional(self):
+        for url in ("/categories/", "/subcategories/", "/categories/tree/"):
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                self.assertEqual(first.status_code, 200)
+                etag = first["ETag"]
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.client.get(url).json(), first.json())
+                    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                    # the weak form CompressionMiddleware sends matches too
+                    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=f"W/{etag}").status_code, 304)
+
+    def test_writes_invalidate(self):
+        etag = self.client.get("/categories/tree/")["ETag"]
+        self.assertEqual(self.client.post("/categories/", {"name": "Drinks"}).status_code, 201)
+        response = self.client.get("/categories/tree/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertIn("Drinks", [category["name"] for category in response.json()])
+
+        etag = response["ETag"]
+        self.client.patch(f"/categories/{self.category.pk}/", {"name": "Meals"}, content_type="application/json")
+        response = self.client.get("/categories/tree/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Meals", [category["name"] for category in response.json()])
+
+
+class MediaTestMixin:
+    """A throwaway MEDIA_ROOT, background tasks run inline after commit."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, BACKGROUND_TASKS_EAGER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        images._ready.clear()
+        self.storage = ImageUpload._meta.get_field("image").storage
+
+
+class ImageVariantTests(MediaTestMixin, TestCase):
+    """Variants are written once, never upscaled, and only advertised once they exist."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Food")
+        cls.subcategory = SubCategory.objects.create(category=cls.category, name="Bakery")
+
+    def store(self, seed=1):
+        return self.storage.save("uploads/photo.jpg", ContentFile(placeholder_image(seed)))
+
+    def test_generate_variants(self):
+        name = self.store()
+        self.assertEqual(images.generate_variants(name, self.storage), 6)
+        self.assertEqual(images.generate_variants(name, self.storage), 0)
+        self.assertEqual(images.generate_variants(name, self.storage, force=True), 6)
+        for width, names in images.variant_names(name).items():
+            for fmt, variant in names.items():
+                with self.storage.open(variant) as fh, images.Image.open(fh) as image:
+                    # the 64px placeholder is never upscaled
+                    self.assertEqual(image.size, (64, 64))
+                    self.assertEqual(image.format, images.VARIANT_FORMATS[fmt][0])
+
+    def test_variants_advertised_once_ready(self):
+        image = ImageUpload.objects.bulk_create([ImageUpload(
+            category=self.category, subcategory=self.subcategory, image=self.store())])[0]
+        queryset = ImageUpload.objects.filter(pk=image.pk)
+        projection = ImageUploadProjection(context={})
+
+        self.assertIsNone(ImageUploadSerializer(image).data["image_variants"])
+        self.assertIsNone(projection.represent(projection.values(queryset))[0]["image_variants"])
+
+        images.generate_variants(image.image.name, self.storage)
+        variants = ImageUploadSerializer(image).data["image_variants"]
+        self.assertEqual(set(variants), {"320", "640", "1080"})
+        self.assertEqual(projection.represent(projection.values(queryset))[0]["image_variants"], variants)
+
+    def test_upload_generates_variants(self):
+        owner = User.objects.create_user("owner", "1111111111", "owner@example.com", "pw")
+        upload = ContentFile(placeholder_image(2), name="photo.jpg")
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ImageUpload.objects.create(user=owner, category=self.category,
+                                               subcategory=self.subcategory, image=upload)
+        self.assertTrue(images.variants_ready(image.image.name, self.storage))
+
+    def test_backfill_command(self):
+        name = self.store()
+        ImageUpload.objects.bulk_create([ImageUpload(category=self.category, subcategory=self.subcategory, image=name)])
+        out = StringIO()
+        call_command("generate_image_variants", "--workers", "1", stdout=out, stderr=StringIO())
+        self.assertIn("Processed 1 images, wrote 6 variants, 0 failed.", out.getvalue())
+        self.assertTrue(images.variants_ready(name, self.storage))
+
+
+class ChunkedUploadTests(MediaTestMixin, TestCase):
+    """Start, resume and complete a chunked upload; malformed chunks are rejected before any write."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Food")
+        cls.subcategory = SubCategory.objects.create(category=cls.category, name="Bakery")
+        cls.owner = User.objects.create_user("owner", "1111111111", "owner@example.com", "pw")
+
+    def setUp(self):
+        super().setUp()
+        upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_dir, ignore_errors=True)
+        settings_override = override_settings(CHUNKED_UPLOAD_DIR=upload_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.content = placeholder_image(3)
+
+    def start(self):
+        response = self.client.post("/uploads/", {
+            "filename": "photo.jpg", "content_type": "image/jpeg", "size": len(self.content),
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        return f"/uploads/{response.json()['id']}/"
+
+    def put(self, url, start, end, body=None):
+        body = self.content[start:end] if body is None else body
+        return self.client.put(url, body, content_type="application/octet-stream",
+                               HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(self.content)}")
+
+    def test_upload_resume_and_complete(self):
+        url = self.start()
+        middle = len(self.content) // 2
+        self.assertEqual(self.put(url, 0, middle).json()["offset"], middle)
+        # a client that lost track asks where to resume
+        self.assertEqual(self.client.get(url).json()["offset"], middle)
+        self.assertEqual(self.put(url, 0, middle).status_code, 409)
+        self.assertEqual(self.put(url, middle, len(self.content)).json()["offset"], len(self.content))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url + "complete/", {
+                "target": "image", "category": self.category.pk, "subcategory": self.subcategory.pk,
+            }, format="json")
+        self.assertEqual(response.status_code, 201)
+        image = ImageUpload.objects.get(pk=response.json()["id"])
+        with image.image.open("rb") as fh:
+            self.assertEqual(fh.read(), self.content)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_incomplete_upload_cannot_complete(self):
+        url = self.start()
+        self.put(url, 0, 10)
+        response = self.client.post(url + "complete/", {"target": "logo"}, format="json")
+        self.assertEqual(response.status_code, 409)
+
+    def test_empty_chunk(self):
+        url = self.start()
+        # no Content-Length at all
+        response = self.put(url, 0, 10, body=b"")
+        self.assertEqual(response.status_code, 411)
+        self.assertEqual(response.json()["offset"], 0)
+        response = self.client.put(url, b"", content_type="application/octet-stream", CONTENT_LENGTH="0",
+                                   HTTP_CONTENT_RANGE=f"bytes 0-9/{len(self.content)}")
+        self.assertEqual(response.status_code, 400)
+
+    def test_wrong_length_chunk(self):
+        url = self.start()
+        response = self.put(url, 0, 10, body=self.content[:5])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).json()["offset"], 0)
+
+    def test_not_an_image(self):
+        url = self.start()
+        self.assertEqual(self.put(url, 0, 10, body=b"x" * 10).status_code, 415)
+
+    def test_purge_abandoned_uploads(self):
+        old, fresh = self.start(), self.start()
+        self.put(old, 0, 10)
+        old_id = old.split("/")[2]
+        ChunkedUpload.objects.filter(pk=old_id).update(created_at=timezone.now() - timedelta(hours=25))
+        out = StringIO()
+        call_command("purge_chunked_uploads", stdout=out)
+        self.assertIn("Purged 1 abandoned uploads.", out.getvalue())
+        self.assertEqual(list(ChunkedUpload.objects.values_list("pk", flat=True)), [uuid.UUID(fresh.split("/")[2])])
+        self.assertFalse(os.path.exists(os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{old_id}.part")))
+
+
+class SubscriptionActivityTests(TestCase):
+    """The SQL statuses agree with Subscription.is_active, and the list filters use them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", "0000000000", "admin@example.com", "pw", is_staff=True)
+        today = timezone.now().date()
+        cls.cases = {}
+        for name, fields in {
+            "active": dict(plan="monthly", end_date=today + timedelta(days=20)),
+            "ends_today": dict(plan="monthly", end_date=today),
+            "ends_in_5": dict(plan="yearly", end_date=today + timedelta(days=5)),
+            "lapsed": dict(plan="monthly", end_date=today - timedelta(days=1)),
+            "no_plan": dict(plan=None, end_date=today + timedelta(days=20)),
+            "revoked": dict(plan=None, end_date=today + timedelta(days=20), revoke=True),
+        }.items():
+            user = User.objects.create_user(name, None, f"{name}@example.com", "pw")
+            cls.cases[name] = Subscription.objects.bulk_create([Subscription(user=user, **fields)])[0]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def names(self, queryset):
+        return {subscription.user.username for subscription in queryset.select_related("user")}
+
+    def test_active_matches_property(self):
+        expected = {name for name, subscription in self.cases.items() if subscription.is_active}
+        self.assertEqual(self.names(Subscription.objects.active()), expected)
+        self.assertEqual(self.names(Subscription.objects.expired()), {"lapsed"})
+        self.assertEqual(self.names(Subscription.objects.revoked()), {"revoked"})
+        self.assertEqual(self.names(Subscription.objects.expiring_within(5)), {"ends_today", "ends_in_5"})
+
+    def test_list_filters(self):
+        response = self.client.get("/subscriptions/?status=active")
+        self.assertEqual({row["user"] for row in response.json()}, {"active", "ends_today", "ends_in_5"})
+        response = self.client.get("/subscriptions/?expiring_within=0")
+        self.assertEqual({row["user"] for row in response.json()}, {"ends_today"})
+        response = self.client.get("/users/?subscription_expiring_within=5")
+        self.assertEqual({row["username"] for row in response.json()}, {"ends_today", "ends_in_5"})
+
+    def test_expiring_within_bounds(self):
+        for value in ("-1", "3651", "5000000", "99999999999999999999999", "1e400", "inf", "nan", "soon"):
+            with self.subTest(value=value):
+                self.assertEqual(self.client.get(f"/subscriptions/?expiring_within={value}").status_code, 400)
+                self.assertEqual(
+                    self.client.get(f"/users/?subscription_expiring_within={value}").status_code, 400)
+        self.assertEqual(self.client.get("/subscriptions/?expiring_within=3650").status_code, 200)
+
+
+class SubscriptionJobTests(TestCase):
+    """process_due_subscriptions renews or expires each lapsed subscription exactly once."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.now().date()
+        users = User.objects.bulk_create(
+            User(username=f"user{n}", phone=f"8{n:09d}", password="!") for n in range(7)
+        )
+        cls.renewing = Subscription(user=users[0], plan="monthly", end_date=cls.today - timedelta(days=1),
+                                    auto_renew=True)
+        # the job did not run for 65 days: skip whole periods at once
+        cls.long_lapsed = Subscription(user=users[1], plan="monthly", end_date=cls.today - timedelta(days=65),
+                                       auto_renew=True)
+        cls.lapsing = Subscription(user=users[2], plan="yearly", end_date=cls.today - timedelta(days=3))
+        cls.current = Subscription(user=users[3], plan="monthly", end_date=cls.today, auto_renew=True)
+        cls.revoked = Subscription(user=users[4], plan=None, end_date=cls.today - timedelta(days=3), revoke=True)
+        cls.extra = [
+            Subscription(user=user, plan="monthly", end_date=cls.today - timedelta(days=2)) for user in users[5:]
+        ]
+        Subscription.objects.bulk_create(
+            [cls.renewing, cls.long_lapsed, cls.lapsing, cls.current, cls.revoked, *cls.extra]
+        )
+
+    def refresh(self, subscription):
+        return Subscription.objects.get(pk=subscription.pk)
+
+    def test_renew_and_expire(self):
+        result = process_due_subscriptions(batch_size=2, today=self.today)
+        self.assertEqual((result.renewed, result.expired, result.batches), (2, 3, 3))
+
+        self.assertEqual(self.refresh(self.renewing).end_date, self.today + timedelta(days=29))
+        self.assertEqual(self.refresh(self.long_lapsed).end_date, self.today + timedelta(days=25))
+        self.assertEqual(self.refresh(self.lapsing).expired_on, self.today)
+        for untouched in (self.current, self.revoked):
+            subscription = self.refresh(untouched)
+            self.assertEqual((subscription.end_date, subscription.expired_on), (untouched.end_date, None))
+
+        # handled rows stop matching, a second run has nothing to do
+        self.assertEqual(process_due_subscriptions(today=self.today).processed, 0)
+
+    def test_resumes_after_max_batches(self):
+        self.assertEqual(process_due_subscriptions(batch_size=2, today=self.today, max_batches=1).processed, 2)
+        self.assertEqual(process_due_subscriptions(batch_size=2, today=self.today).processed, 3)
+
+    def test_rows_are_claimed_with_skip_locked(self):
+        if not connection.features.has_select_for_update_skip_locked:
+            self.skipTest("the database has no SELECT ... FOR UPDATE SKIP LOCKED")
+        with CaptureQueriesContext(connection) as queries:
+            process_due_subscriptions(today=self.today)
+        self.assertTrue(any("SKIP LOCKED" in query["sql"] for query in queries))
+
+    def test_command(self):
+        out = StringIO()
+        call_command("process_subscriptions", "--date", self.today.isoformat(), stdout=out)
+        self.assertIn("Processed 5 subscriptions (2 renewed, 3 expired)", out.getvalue())
+
+
+class LoginIdentifierTests(TestCase):
+    """Login by email (any case), phone or username, and emails unique in any case."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", "+15550001", "Owner@Example.com", "pw")
+        cls.other = User.objects.create_user("other", "+15550002", "other@example.com", "pw")
+
+    def login(self, identifier, password="pw"):
+        return self.client.post("/login/", {"identifier": identifier, "password": password})
+
+    def test_login_identifiers(self):
+        for identifier in ("owner@example.com", "OWNER@EXAMPLE.COM", " Owner@Example.com ", "+15550001", "owner"):
+            with self.subTest(identifier=identifier):
+                response = self.login(identifier)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["user"]["id"], self.owner.pk)
+        self.assertEqual(self.login("owner@example.com", "wrong").status_code, 400)
+        self.assertEqual(self.login("nobody@example.com").status_code, 400)
+
+    def test_missing_user_costs_one_hash(self):
+        with mock.patch.object(User, "set_password") as set_password:
+            self.assertIsNone(authenticate_identifier("nobody@example.com", "pw"))
+        set_password.assert_called_once_with("pw")
+
+    def test_email_unique_in_any_case(self):
+        response = self.client.post("/signup/", {
+            "username": "copy", "phone": "+15550003", "email": "OWNER@example.COM", "password": "pw",
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("email", response.json())
+
+        response = self.client.patch(f"/edit-user/{self.other.pk}/", {"email": "owner@EXAMPLE.com"},
+                                     content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        # changing the case of one's own email is fine
+        response = self.client.patch(f"/edit-user/{self.owner.pk}/", {"email": "owner@example.com"},
+                                     content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+
+class EmailMigrationTests(TransactionTestCase):
+    """Migration 0010 refuses to run while two emails differ only in case."""
+
+    before, after = [("Admin", "0009_image_priority")], [("Admin", "0010_email_lower_unique")]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicate_emails_block_the_migration(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        OldUser = executor.loader.project_state(self.before).apps.get_model("Admin", "CustomUser")
+        OldUser.objects.create(username="a", email="same@example.com", password="!")
+        duplicate = OldUser.objects.create(username="b", email="SAME@example.com", password="!")
+
+        executor = MigrationExecutor(connection)
+        with self.assertRaisesMessage(RuntimeError, "same@example.com"):
+            executor.migrate(self.after)
+
+        duplicate.delete()
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+
+
+class PasswordHasherTests(TestCase):
+    """Hash cost comes from settings and outdated hashes are upgraded on login."""
+
+    def login(self, password="pw"):
+        return self.client.post("/login/", {"identifier": "hasher", "password": password})
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_rehash_on_login_after_cost_change(self):
+        user = User.objects.create_user("hasher", "+15550010", "hasher@example.com", "pw")
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$1000$"))
+
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login("wrong").status_code, 400)
+            user.refresh_from_db()
+            self.assertTrue(user.password.startswith("pbkdf2_sha256$1000$"))
+
+            self.assertEqual(self.login().status_code, 200)
+            user.refresh_from_db()
+            self.assertTrue(user.password.startswith("pbkdf2_sha256$2000$"))
+
+    def test_rehash_on_login_after_algorithm_change(self):
+        with override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher"]):
+            user = User.objects.create_user("hasher", "+15550010", "hasher@example.com", "pw")
+        self.assertTrue(user.password.startswith("pbkdf2_sha1$"))
+
+        self.assertEqual(self.login().status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$"))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command("benchmark_password_hashers", "--duration", "0.01", "--pbkdf2-iterations", "1000",
+                     "--argon2", "--json", stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual([r["hasher"] for r in results], ["configured (pbkdf2_sha256)", "pbkdf2 iterations=1000"])
+        self.assertTrue(all(r["hashes"] > 0 for r in results))
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite only")
+class SqlitePragmaTests(TestCase):
+    """SQLITE_PRAGMAS reach every new connection; WAL only when asked for."""
+
+    def pragmas(self, names):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        other = connection.copy()
+        other.settings_dict = {**connection.settings_dict, "NAME": os.path.join(directory, "db.sqlite3")}
+        other.ensure_connection()
+        try:
+            with other.cursor() as cursor:
+                return {name: cursor.execute(f"PRAGMA {name}").fetchone()[0] for name in names}
+        finally:
+            other.close()
+
+    def test_default_pragmas(self):
+        applied = self.pragmas(["journal_mode", "busy_timeout", "cache_size"])
+        self.assertEqual(applied, {"journal_mode": "delete", "busy_timeout": 20000, "cache_size": -20000})
+
+    @override_settings(SQLITE_PRAGMAS={"journal_mode": "WAL", "synchronous": "NORMAL"})
+    def test_wal_on_request(self):
+        self.assertEqual(self.pragmas(["journal_mode", "synchronous"]), {"journal_mode": "wal", "synchronous": 1})
+
+
+class BulkImageTests(MediaTestMixin, TestCase):
+    """Bulk upload and delete report per item; 207 when only some succeed, 400 when none do."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Food")
+        cls.subcategory = SubCategory.objects.create(category=cls.category, name="Bakery")
+        cls.owner = User.objects.create_user("owner", "1111111111", "owner@example.com", "pw")
+        cls.stranger = User.objects.create_user("stranger", "2222222222", "stranger@example.com", "pw")
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def upload(self, *files):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post("/images/bulk/", {
+                "category": self.category.pk, "subcategory": self.subcategory.pk, "images": list(files),
+            }, format="multipart")
+
+    def test_upload_reports_invalid_files(self):
+        response = self.upload(ContentFile(placeholder_image(1), name="a.jpg"),
+                               ContentFile(b"not an image", name="b.jpg"),
+                               ContentFile(placeholder_image(1), name="c.jpg"))
+        self.assertEqual(response.status_code, 207)
+        body = response.json()
+        self.assertEqual(len(body["created"]), 2)
+        self.assertEqual([(e["index"], e["name"]) for e in body["errors"]], [(1, "b.jpg")])
+
+        # both copies share one blob
+        name = ImageUpload.objects.values_list("image", flat=True).distinct().get()
+        self.assertEqual(MediaBlob.objects.get(name=name).refs, 2)
+        self.assertTrue(images.variants_ready(name, self.storage))
+
+    def test_upload_all_invalid(self):
+        response = self.upload(ContentFile(b"nope", name="a.jpg"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["created"], [])
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_upload_rejects_mismatched_subcategory(self):
+        other = SubCategory.objects.create(category=Category.objects.create(name="Cars"), name="Used")
+        response = self.client.post("/images/bulk/", {
+            "category": self.category.pk, "subcategory": other.pk,
+            "images": [ContentFile(placeholder_image(1), name="a.jpg")],
+        }, format="multipart")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("subcategory", response.json())
+
+    def test_delete_own_images_only(self):
+        mine, theirs = ImageUpload.objects.bulk_create([
+            ImageUpload(user=self.owner, category=self.category, subcategory=self.subcategory, image="uploads/a.jpg"),
+            ImageUpload(user=self.stranger, category=self.category, subcategory=self.subcategory, image="uploads/b.jpg"),
+        ])
+        missing = theirs.pk + 100
+        response = self.client.post("/images/bulk-delete/", {"ids": [mine.pk, theirs.pk, missing, mine.pk]},
+                                    format="json")
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()["deleted"], [mine.pk])
+        self.assertEqual([e["id"] for e in response.json()["errors"]], [theirs.pk, missing])
+        self.assertEqual(list(ImageUpload.objects.values_list("pk", flat=True)), [theirs.pk])
+
+        response = self.client.post("/images/bulk-delete/", {"ids": [theirs.pk]}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+        self.client.force_authenticate(User.objects.create_user("staff", "3333333333", "staff@example.com", "pw",
+                                                                is_staff=True))
+        response = self.client.post("/images/bulk-delete/", {"ids": [theirs.pk]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_delete_validates_ids(self):
+        self.assertEqual(self.client.post("/images/bulk-delete/", {"ids": []}, format="json").status_code, 400)
+        with override_settings(BULK_IMAGE_MAX_ITEMS=2):
+            response = self.client.post("/images/bulk-delete/", {"ids": [1, 2, 3]}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(MEDIA_BLOB_DELETE_GRACE=0)
+class MediaDeletionTests(MediaTestMixin, TestCase):
+    """Files go after the deleting transaction commits, shared blobs with their last reference."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Food")
+        cls.subcategory = SubCategory.objects.create(category=cls.category, name="Bakery")
+
+    def create(self, seed=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ImageUpload.objects.create(category=self.category, subcategory=self.subcategory,
+                                              image=ContentFile(placeholder_image(seed), name="photo.jpg"))
+
+    def delete(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+
+    def test_shared_blob_goes_with_last_reference(self):
+        first, second = self.create(), self.create()
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertTrue(images.variants_ready(name, self.storage))
+
+        self.delete(first)
+        self.assertEqual(MediaBlob.objects.get(name=name).refs, 1)
+        self.assertTrue(self.storage.exists(name))
+
+        self.delete(second)
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(self.storage.exists(images.last_variant_name(name)))
+
+    def test_rolled_back_delete_keeps_files(self):
+        image = self.create()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    image.delete()
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertTrue(self.storage.exists(image.image.name))
+
+    def test_legacy_files_deleted_after_commit(self):
+        # stored before deduplication, so not under cas/ and not refcounted
+        name = "uploads/legacy.jpg"
+        os.makedirs(self.storage.path("uploads"))
+        with open(self.storage.path(name), "wb") as fh:
+            fh.write(placeholder_image(1))
+        image = ImageUpload.objects.bulk_create([ImageUpload(category=self.category, subcategory=self.subcategory,
+                                                             image=name)])[0]
+        with self.captureOnCommitCallbacks() as callbacks:
+            ImageUpload.objects.get(pk=image.pk).delete()
+            self.assertTrue(self.storage.exists(name))
+        for callback in callbacks:
+            callback()
+        self.assertFalse(self.storage.exists(name))
+
+    def test_collect_orphan_media(self):
+        kept = self.create(1).image.name
+        orphan = self.storage.save("uploads/orphan.jpg", ContentFile(b"orphan"))
+        fresh = self.storage.save("uploads/fresh.jpg", ContentFile(b"fresh"))
+        old = timezone.now().timestamp() - 2 * 86400
+        for name in (kept, orphan):
+            os.utime(self.storage.path(name), (old, old))
+
+        out = StringIO()
+        call_command("collect_orphan_media", "--dry-run", stdout=out)
+        self.assertIn("Would delete 1 orphans", out.getvalue())
+        self.assertTrue(self.storage.exists(orphan))
+
+        call_command("collect_orphan_media", "--batch-size", "1", stdout=StringIO())
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertTrue(self.storage.exists(kept))
+        self.assertTrue(self.storage.exists(fresh))
+
+
+class ContentAddressedStorageTests(MediaTestMixin, TestCase):
+    """Identical uploads are stored once and refcounted; a replaced file releases its blob."""
+
+    def test_same_content_same_blob(self):
+        content = placeholder_image(1)
+        first = self.storage.save("uploads/a.JPG", ContentFile(content))
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(first, f"cas/{digest[:2]}/{digest[2:4]}/{digest}.jpg")
+        self.assertEqual(self.storage.save("profile_images/b.jpg", ContentFile(content)), first)
+        self.assertNotEqual(self.storage.save("uploads/c.jpg", ContentFile(placeholder_image(2))), first)
+        self.assertEqual(os.listdir(self.storage.path("cas/tmp")), [])
+
+    def test_temporary_upload(self):
+        upload = TemporaryUploadedFile("a.jpg", "image/jpeg", 0, None)
+        upload.write(placeholder_image(1))
+        upload.flush()
+        self.addCleanup(upload.close)
+        self.assertEqual(self.storage.save("uploads/a.jpg", upload),
+                         self.storage.save("uploads/b.jpg", ContentFile(placeholder_image(1))))
+
+    def test_reupload_refreshes_mtime(self):
+        name = self.storage.save("uploads/a.jpg", ContentFile(placeholder_image(1)))
+        old = timezone.now().timestamp() - 86400
+        os.utime(self.storage.path(name), (old, old))
+        self.storage.save("uploads/a.jpg", ContentFile(placeholder_image(1)))
+        self.assertGreater(os.path.getmtime(self.storage.path(name)), old + 3600)
+
+    def test_refs_follow_the_rows(self):
+        category = Category.objects.create(name="Food")
+        subcategory = SubCategory.objects.create(category=category, name="Bakery")
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ImageUpload.objects.create(category=category, subcategory=subcategory,
+                                               image=ContentFile(placeholder_image(1), name="a.jpg"))
+            ImageUpload.objects.create(category=category, subcategory=subcategory,
+                                       image=ContentFile(placeholder_image(1), name="b.jpg"))
+        shared = image.image.name
+        self.assertEqual(MediaBlob.objects.get(name=shared).refs, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.image = ContentFile(placeholder_image(2), name="c.jpg")
+            image.save()
+        self.assertEqual(MediaBlob.objects.get(name=shared).refs, 1)
+        self.assertEqual(MediaBlob.objects.get(name=image.image.name).refs, 1)
+
+
+class MediaServingTests(MediaTestMixin, TestCase):
+    """Ranges, conditional requests and proxy offload of /media/."""
+
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 4
+        self.name = "uploads/naïve photo 100%.bin"
+        os.makedirs(self.storage.path("uploads"))
+        with open(self.storage.path(self.name), "wb") as fh:
+            fh.write(self.content)
+        self.url = "/media/" + quote(self.name)
+
+    def get(self, url=None, **headers):
+        response = self.client.get(url or self.url, headers=headers)
+        if response.streaming:
+            response.body = b"".join(response.streaming_content)
+            response.close()
+        return response
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, self.content)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+
+    def test_ranges(self):
+        for header, start, end in (("bytes=0-9", 0, 9), ("bytes=1000-", 1000, 1023),
+                                   ("bytes=-24", 1000, 1023), ("bytes=1020-5000", 1020, 1023)):
+            with self.subTest(header=header):
+                response = self.get(Range=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response.body, self.content[start:end + 1])
+                self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/1024")
+
+        for header in ("bytes=1024-", "bytes=-0", "bytes=9-1"):
+            with self.subTest(header=header):
+                response = self.get(Range=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response["Content-Range"], "bytes */1024")
+
+        # a multi-part or stale If-Range request gets the whole file
+        self.assertEqual(self.get(Range="bytes=0-1,5-6").status_code, 200)
+        self.assertEqual(self.get(Range="bytes=0-9", **{"If-Range": '"stale"'}).status_code, 200)
+        etag = self.get()["ETag"]
+        self.assertEqual(self.get(Range="bytes=0-9", **{"If-Range": etag}).status_code, 206)
+
+    def test_conditional(self):
+        response = self.get()
+        not_modified = self.get(**{"If-None-Match": response["ETag"]})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["ETag"], response["ETag"])
+        self.assertEqual(self.get(**{"If-Modified-Since": response["Last-Modified"]}).status_code, 304)
+
+    def test_content_addressed(self):
+        name = self.storage.save("uploads/a.jpg", ContentFile(placeholder_image(1)))
+        response = self.get("/media/" + name)
+        self.assertEqual(response["ETag"], f'"{os.path.basename(name)}"')
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertNotIn("Last-Modified", response)
+        # touched by a duplicate upload, still the same validator
+        os.utime(self.storage.path(name))
+        self.assertEqual(self.get("/media/" + name, **{"If-None-Match": response["ETag"]}).status_code, 304)
+
+    def test_hidden_paths(self):
+        os.makedirs(self.storage.path("cas/tmp"))
+        with open(self.storage.path("cas/tmp/partial"), "wb") as fh:
+            fh.write(b"partial")
+        for url in ("/media/cas/tmp/partial", "/media/uploads/missing.bin", "/media/uploads", "/media/../manage.py"):
+            with self.subTest(url=url):
+                self.assertEqual(self.get(url).status_code, 404)
+
+    def test_offload(self):
+        with override_settings(MEDIA_ACCEL="x-accel-redirect", MEDIA_ACCEL_PREFIX="/protected-media/"):
+            response = self.get()
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/uploads/na%C3%AFve%20photo%20100%25.bin")
+        self.assertEqual(response.content, b"")
+
+        with override_settings(MEDIA_ACCEL="x-sendfile"):
+            response = self.get()
+        self.assertEqual(unquote(response["X-Sendfile"]), self.storage.path(self.name))
+        self.assertTrue(response["X-Sendfile"].isascii())
+
+        with override_settings(MEDIA_ACCEL="x-accel-redirect"):
+            self.assertEqual(self.get(**{"If-None-Match": response["ETag"]}).status_code, 304)
+
+
+class HomePayloadTests(TestCase):
+    """The shared /home/ payload takes its links from SITE_URL, never from the Host header."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Food")
+        subcategory = SubCategory.objects.create(category=category, name="Bakery")
+        ImageUpload.objects.bulk_create([ImageUpload(category=category, subcategory=subcategory,
+                                                     image="uploads/a.jpg")])
+        Carousel.objects.bulk_create([Carousel(image1="carousel/b.jpg")])
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def home(self, host):
+        response = self.client.get("/home/", headers={"Host": host})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def urls(self, response):
+        body = response.json()
+        return body["images"]["results"][0]["image"], body["carousels"][0]["image1"]
+
+    def test_host_header_is_ignored(self):
+        first = self.home("evil.example")
+        self.assertEqual(self.urls(first), ("/media/uploads/a.jpg", "/media/carousel/b.jpg"))
+        second = self.home("api.example.com")
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(second.content, first.content)
+
+    @override_settings(SITE_URL="https://api.example.com")
+    def test_site_url(self):
+        response = self.home("evil.example")
+        self.assertEqual(self.urls(response), ("https://api.example.com/media/uploads/a.jpg",
+                                               "https://api.example.com/media/carousel/b.jpg"))
+        with override_settings(SITE_URL="https://cdn.example.com"):
+            self.assertNotEqual(self.home("evil.example")["ETag"], response["ETag"])
+
+
+class CompressionMiddlewareTests(TestCase):
+    """Negotiated compression within the CPU budget; Vary whenever the choice depended on the request."""
+
+    body = b'{"items": [' + b",".join(b'{"id": %d, "name": "item"}' % i for i in range(200)) + b"]}"
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        throughput = mock.patch.dict(middleware.CompressionMiddleware._throughput)
+        throughput.start()
+        self.addCleanup(throughput.stop)
+
+    def respond(self, accept="gzip, br", body=None, content_type="application/json", method="get", **headers):
+        def view(request):
+            return HttpResponse(self.body if body is None else body, content_type=content_type,
+                                headers={"ETag": '"abc"', **headers})
+        request = getattr(self.factory, method)("/", HTTP_ACCEPT_ENCODING=accept)
+        return middleware.CompressionMiddleware(view)(request)
+
+    @mock.patch.object(middleware, "brotli", None)
+    def test_gzip(self):
+        response = self.respond()
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), self.body)
+        self.assertEqual(response["Content-Length"], str(len(response.content)))
+        self.assertEqual(response["ETag"], 'W/"abc"')
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+
+    @skipUnless(middleware.brotli, "brotli is not installed")
+    def test_brotli_preferred(self):
+        response = self.respond()
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(middleware.brotli.decompress(response.content), self.body)
+
+    def test_negotiation(self):
+        for accept in ("", "identity", "gzip;q=0, br;q=0", "compress"):
+            with self.subTest(accept=accept):
+                response = self.respond(accept)
+                self.assertNotIn("Content-Encoding", response)
+                self.assertEqual(response.content, self.body)
+                self.assertEqual(response["ETag"], '"abc"')
+                self.assertEqual(response["Vary"], "Accept-Encoding")
+        with mock.patch.object(middleware, "brotli", None):
+            self.assertEqual(self.respond("br;q=1.0, gzip;q=0.5")["Content-Encoding"], "gzip")
+
+    def test_left_alone(self):
+        cases = {
+            "small": {"body": b"{}"},
+            "binary": {"content_type": "image/png"},
+            "encoded": {"Content-Encoding": "gzip"},
+            "head": {"method": "head"},
+        }
+        for case, kwargs in cases.items():
+            with self.subTest(case=case):
+                response = self.respond(**kwargs)
+                self.assertNotIn("Vary", response)
+                self.assertEqual(response.get("Content-Encoding"), kwargs.get("Content-Encoding"))
+        with override_settings(COMPRESSION_MIN_SIZE=len(self.body) + 1):
+            self.assertNotIn("Content-Encoding", self.respond())
+
+    @mock.patch.object(middleware, "brotli", None)
+    def test_cpu_budget(self):
+        compression = middleware.CompressionMiddleware(None)
+        request = self.factory.get("/", HTTP_ACCEPT_ENCODING="gzip")
+        size = 10 * 1024 * 1024
+        throughput = compression._throughput
+        # 20ms for 10 MiB needs ~500 MB/s
+        throughput.update({("gzip", 6): 100e6, ("gzip", 1): 1e9})
+        self.assertEqual(compression.choose(request, size), ("gzip", 1))
+        throughput.update({("gzip", 6): 1e9})
+        self.assertEqual(compression.choose(request, size), ("gzip", 6))
+        throughput.update({("gzip", 6): 100e6, ("gzip", 1): 100e6})
+        self.assertIsNone(compression.choose(request, size))
+        with override_settings(COMPRESSION_CPU_BUDGET_MS=200):
+            self.assertEqual(compression.choose(request, size), ("gzip", 6))
+
+        # too slow for the budget: sent uncompressed, still with Vary
+        throughput.update({("gzip", 6): 1.0, ("gzip", 1): 1.0})
+        response = self.respond("gzip")
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+
+        # measurements move the estimate
+        compression.record(("gzip", 1), size, 0.01)
+        self.assertGreater(throughput["gzip", 1], 1.0)
+
+
+class HomeViewEncodingTests(TestCase):
+    """The gzipped and plain /home/ bodies carry distinct ETags."""
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_etags(self):
+        plain = self.client.get("/home/", headers={"Accept-Encoding": "identity"})
+        zipped = self.client.get("/home/", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(zipped["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Encoding", plain)
+        self.assertEqual(gzip.decompress(zipped.content), plain.content)
+        self.assertNotEqual(plain["ETag"], zipped["ETag"])
+        self.assertIn("Accept-Encoding", plain["Vary"])
+
+        for accept, response in (("identity", plain), ("gzip", zipped)):
+            with self.subTest(accept=accept):
+                headers = {"Accept-Encoding": accept, "If-None-Match": response["ETag"]}
+                self.assertEqual(self.client.get("/home/", headers=headers).status_code, 304)
+        headers = {"Accept-Encoding": "identity", "If-None-Match": zipped["ETag"]}
+        self.assertEqual(self.client.get("/home/", headers=headers).status_code, 200)
+
+
+class SparseFieldsetTests(TestCase):
+    """?fields= trims the output and the selected columns, ?expand= nests related rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Food")
+        subcategory = SubCategory.objects.create(category=category, name="Bakery")
+        cls.admin = User.objects.create_user("admin", "0000000000", "admin@example.com", "pw", is_staff=True)
+        cls.image = ImageUpload.objects.bulk_create([ImageUpload(
+            user=cls.admin, category=category, subcategory=subcategory, image="uploads/a.jpg")])[0]
+        Subscription.objects.bulk_create([Subscription(
+            user=cls.admin, plan="monthly", end_date=timezone.now().date() + timedelta(days=30))])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json(), queries[-1]["sql"]
+
+    def test_fields(self):
+        body, sql = self.get("/images/?paginate=false&fields=id, image")
+        self.assertEqual(body, [{"id": self.image.pk, "image": "http://testserver/media/uploads/a.jpg"}])
+        self.assertNotIn("JOIN", sql)
+        self.assertNotIn("priority", sql)
+
+    def test_expand(self):
+        body, sql = self.get("/images/?paginate=false&fields=id&expand=user,category")
+        self.assertEqual(body, [{
+            "id": self.image.pk,
+            "user": {"id": self.admin.pk, "username": "admin"},
+            "category": {"id": self.image.category_id, "name": "Food"},
+        }])
+        self.assertIn("JOIN", sql)
+
+        body, _ = self.get("/images/?paginate=false&fields=user,category")
+        self.assertEqual(body, [{"user": self.admin.pk, "category": self.image.category_id}])
+
+    def test_default_expand(self):
+        body, _ = self.get("/users/?fields=id,subscriptions")
+        self.assertEqual(body[0]["subscriptions"]["plan"], "monthly")
+        body, _ = self.get("/users/?fields=id,subscriptions&expand=")
+        self.assertEqual(body, [{"id": self.admin.pk, "subscriptions": Subscription.objects.get().pk}])
+
+    def test_unknown_names(self):
+        response = self.client.get("/images/?fields=id,secret&expand=image")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {"fields", "expand"})
+        self.assertIn("Unknown fields: secret.", response.json()["fields"][0])
+
+
+@override_settings(METRICS_SAMPLE_RATE=1, METRICS_TOKEN="scrape-me", METRICS_PUBLIC=False,
+                   METRICS_PUBLIC_SERVER_TIMING=False)
+class MetricsTests(TestCase):
+    """/metrics/ is for staff and the scrape token; Server-Timing only reaches staff."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user("staff", "0000000000", "staff@example.com", "pw", is_staff=True)
+        cls.member = User.objects.create_user("member", "1111111111", "member@example.com", "pw")
+
+    def setUp(self):
+        caches["default"].clear()
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+
+    def client_for(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens_for_user(user).access_token}")
+        return client
+
+    def test_scrape_access(self):
+        self.assertEqual(self.client_for().get("/metrics/").status_code, 403)
+        self.assertEqual(self.client_for(self.member).get("/metrics/").status_code, 403)
+        self.assertEqual(self.client_for(self.staff).get("/metrics/").status_code, 200)
+        self.assertEqual(self.client.get("/metrics/", headers={"Authorization": "Bearer scrape-me"}).status_code, 200)
+        self.assertEqual(self.client.get("/metrics/", headers={"Authorization": "Bearer guess"}).status_code, 403)
+        with override_settings(METRICS_PUBLIC=True):
+            self.assertEqual(self.client.get("/metrics/").status_code, 200)
+
+    def test_server_timing_for_staff_only(self):
+        self.assertNotIn("Server-Timing", self.client_for().get("/home/"))
+        self.assertNotIn("Server-Timing", self.client_for(self.member).get("/profile/"))
+        timing = self.client_for(self.staff).get("/profile/")["Server-Timing"]
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, render;dur=[\d.]+, '
+                                 r'app;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_labels(self):
+        client = self.client_for()
+        client.get("/home/")
+        client.get("/home/")
+        client.get("/no-such-page/")
+        client.post("/login/", {"identifier": "staff", "password": "wrong"})
+
+        body = self.client.get("/metrics/", headers={"Authorization": "Bearer scrape-me"}).content.decode()
+        self.assertIn('http_requests_total{route="home",method="GET",status="200"} 2\n', body)
+        self.assertIn('http_requests_total{route="unmatched",method="GET",status="404"} 1\n', body)
+        self.assertIn('http_requests_total{route="login",method="POST",status="400"} 1\n', body)
+        self.assertIn('http_request_duration_seconds_bucket{route="home",method="GET",le="+Inf"} 2\n', body)
+        self.assertIn('http_request_duration_seconds_count{route="home",method="GET"} 2\n', body)
+        self.assertIn('http_sampled_requests_total{route="home"} 2\n', body)
+        self.assertRegex(body, r'db_queries_total\{route="home"\} [1-9]\d*\n')
+        self.assertRegex(body, r'http_response_bytes_total\{route="home"\} [1-9]\d*\n')
+
+
+class SlowQueryLogTests(TestCase):
+    """Slow queries are logged with their origin and plan, and summarised by the slow_queries command."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Food")
+        subcategory = SubCategory.objects.create(category=category, name="Bakery")
+        cls.admin = User.objects.create_user("admin", "0000000000", "admin@example.com", "pw", is_staff=True)
+        ImageUpload.objects.bulk_create([ImageUpload(user=cls.admin, category=category, subcategory=subcategory,
+                                                     image="uploads/a.jpg")])
+
+    def setUp(self):
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir, ignore_errors=True)
+        self.log = os.path.join(log_dir, "slow.jsonl")
+        settings_override = override_settings(SLOW_QUERY_LOG=self.log)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        slow_queries._plans.clear()
+
+    def entries(self):
+        with open(self.log, encoding="utf-8") as log:
+            return [json.loads(line) for line in log]
+
+    def test_normalize(self):
+        self.assertEqual(
+            slow_queries.normalize('SELECT "a"."id" FROM "a"\n WHERE "x1" = \'it\'\'s\' AND y IN (1, 2, %s) LIMIT 21'),
+            'SELECT "a"."id" FROM "a" WHERE "x1" = ? AND y IN (...) LIMIT ?',
+        )
+
+    def test_logs_origin_and_plan(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=1e-6):
+            with self.assertNumQueries(1):
+                self.assertEqual(client.get("/images/?paginate=false").status_code, 200)
+            client.get("/images/?paginate=false")
+
+        entries = [entry for entry in self.entries() if entry["route"] == "image-upload"]
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0]["fingerprint"], entries[1]["fingerprint"])
+        self.assertEqual(entries[0]["serializer"], "ImageUploadProjection")
+        self.assertEqual(entries[0]["view"], "Admin.views.ImageUploadView")
+        self.assertEqual((entries[0]["method"], entries[0]["path"]), ("GET", "/images/"))
+        self.assertTrue(entries[0]["sql"].startswith("SELECT "))
+        if connection.vendor == "sqlite":
+            self.assertTrue(any("Admin_imageupload" in line for line in entries[0]["plan"]))
+
+    def test_zero_threshold_turns_it_off(self):
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0):
+            list(Category.objects.all())
+        self.assertFalse(os.path.exists(self.log))
+
+    def test_command(self):
+        with self.assertRaises(CommandError):
+            call_command("slow_queries", stdout=StringIO())
+
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=1e-6):
+            for _ in range(3):
+                list(Category.objects.filter(name="Food"))
+            list(SubCategory.objects.all())
+        with open(self.log, "a", encoding="utf-8") as log:
+            log.write('{"truncated')
+
+        out = StringIO()
+        call_command("slow_queries", "--json", "--sort", "count", "--top", "1", stdout=out)
+        [row] = json.loads(out.getvalue())
+        self.assertEqual(row["count"], 3)
+        self.assertIn('"Admin_category"."name" = ?', row["sql"])
+        self.assertEqual(row["views"], {"-": 3})
+        self.assertIsNotNone(row["plan"])
+
+        out = StringIO()
+        call_command("slow_queries", "--hours", "1", stdout=out)
+        self.assertIn("#1 ", out.getvalue())
+        self.assertIn("3 calls", out.getvalue())
+
+
+GENERATE_SMALL = ["--users", "20", "--categories", "3", "--subcategories", "2", "--images", "30",
+                  "--placeholders", "2", "--batch-size", "7"]
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class BenchmarkDataTests(MediaTestMixin, TestCase):
+    """generate_benchmark_data at a small scale."""
+
+    def test_generate(self):
+        out = StringIO()
+        call_command("generate_benchmark_data", *GENERATE_SMALL, stdout=out)
+        self.assertIn("images: done", out.getvalue())
+        self.assertEqual(User.objects.filter(username__startswith=MARKER).count(), 20)
+        self.assertEqual(Subscription.objects.count(), 12)
+        self.assertEqual(SubCategory.objects.filter(name__startswith=MARKER).count(), 6)
+        self.assertEqual(ImageUpload.objects.count(), 30)
+        # the placeholders are shared blobs, referenced once per image
+        self.assertEqual(sum(MediaBlob.objects.values_list("refs", flat=True)), 30)
+        self.assertTrue(User.objects.get(username=f"{MARKER}user0").check_password(PASSWORD))
+
+        with self.assertRaisesMessage(CommandError, "already holds benchmark data"):
+            call_command("generate_benchmark_data", *GENERATE_SMALL, stdout=StringIO())
+
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 0.5))
+        self.assertEqual(percentile([3, 1, 2], 0.5), 2)
+        self.assertEqual(percentile(range(100), 0.99), 99)
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class RunBenchmarkTests(MediaTestMixin, TransactionTestCase):
+    """A short in-process run_benchmark; the worker threads need committed data."""
+
+    def test_run(self):
+        with self.assertRaisesMessage(CommandError, "No benchmark data"):
+            call_command("run_benchmark", stdout=StringIO())
+        call_command("generate_benchmark_data", *GENERATE_SMALL, stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, "Unknown scenario 'scroll'"):
+            call_command("run_benchmark", "--mix", "scroll=1", stdout=StringIO())
+
+        output = os.path.join(self.storage.location, "report.json")
+        images_before = ImageUpload.objects.count()
+        # one client: the in-memory test database locks whole tables on writes
+        call_command("run_benchmark", "--concurrency", "1", "--duration", "1", "--warmup", "0",
+                     "--mix", "browse=1,login=1,signup=1,upload=1,subscription=1", "--output", output,
+                     stdout=StringIO())
+        with open(output) as file:
+            report = json.load(file)
+
+        self.assertEqual(report["transport"], "in-process")
+        self.assertGreater(report["totals"]["requests"], 0)
+        self.assertEqual(report["totals"]["errors"], 0, report["endpoints"])
+        self.assertLessEqual(set(report["endpoints"]), {
+            "home", "category-tree", "image-upload", "login", "signup", "image-upload:create", "subscription-detail",
+        })
+        for endpoint in report["endpoints"].values():
+            self.assertIsNotNone(endpoint["queries_mean"])
+            self.assertLessEqual(endpoint["p50_ms"], endpoint["max_ms"])
+        # what the run created is gone again
+        self.assertFalse(User.objects.filter(username__startswith=f"{MARKER}run-").exists())
+        self.assertEqual(ImageUpload.objects.count(), images_before)
+
+        stderr = StringIO()
+        call_command("run_benchmark", "--concurrency", "1", "--duration", "0.2", "--warmup", "0",
+                     "--mix", "login=1", "--baseline", output, stdout=StringIO(), stderr=stderr)
+        self.assertIn("login", stderr.getvalue())
+
+
+class AliasTableTests(TestCase):
+    """Weighted draws, and distinct samples that are never short."""
+
+    def test_distribution(self):
+        table = ads.AliasTable(["a", "b", "c"], [1, 2, 7])
+        rng = random.Random(1)
+        counts = Counter(table.draw(rng) for _ in range(20000))
+        for item, share in (("a", 0.1), ("b", 0.2), ("c", 0.7)):
+            self.assertAlmostEqual(counts[item] / 20000, share, delta=0.02)
+
+    def test_sample(self):
+        table = ads.AliasTable(list(range(10)), [1] * 10)
+        rng = random.Random(1)
+        for count in (0, 1, 5, 10, 15):
+            with self.subTest(count=count):
+                sample = table.sample(count, rng)
+                self.assertEqual(len(sample), min(count, 10))
+                self.assertEqual(len(set(sample)), len(sample))
+
+    def test_skewed_weights_still_fill_the_sample(self):
+        table = ads.AliasTable(["heavy", "a", "b", "c"], [10 ** 9, 1, 1, 1])
+        sample = table.sample(3, random.Random(1))
+        self.assertEqual(sample[0], "heavy")
+        self.assertEqual(len(set(sample)), 3)
+
+
+class AdPoolTests(TestCase):
+    """Pools serve prioritised images of subscribed owners and rebuild when that changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.now().date()
+        category = Category.objects.create(name="Food")
+        cls.subcategory = SubCategory.objects.create(category=category, name="Bakery")
+        owner, lapsed = User.objects.bulk_create([
+            User(username="owner", phone="1111111111", password="!"),
+            User(username="lapsed", phone="2222222222", password="!"),
+        ])
+        Subscription.objects.bulk_create([
+            Subscription(user=owner, plan="monthly", end_date=cls.today + timedelta(days=10)),
+            Subscription(user=lapsed, plan="monthly", end_date=cls.today - timedelta(days=1), auto_renew=True),
+        ])
+        cls.served, cls.paused, cls.unsubscribed = ImageUpload.objects.bulk_create([
+            ImageUpload(user=user, category=category, subcategory=cls.subcategory, image=f"uploads/{n}.jpg",
+                        priority=priority)
+            for n, (user, priority) in enumerate([(owner, 5), (owner, 0), (lapsed, 5)])
+        ])
+
+    def setUp(self):
+        caches["default"].clear()
+        ads._pools.clear()
+        self.addCleanup(ads._pools.clear)
+
+    def select(self):
+        return set(ads.select("subcategory", self.subcategory.pk, 10))
+
+    def test_zero_priority_is_paused(self):
+        self.assertEqual(self.select(), {self.served.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ImageUpload.objects.get(pk=self.paused.pk)
+            image.priority = 3
+            image.save()
+        self.assertEqual(self.select(), {self.served.pk, self.paused.pk})
+
+    def test_rebuilt_after_renewal(self):
+        self.assertEqual(self.select(), {self.served.pk})
+        # bulk_update inside, the job invalidates the owners' pools itself
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_due_subscriptions(today=self.today).renewed, 1)
+        self.assertEqual(self.select(), {self.served.pk, self.unsubscribed.pk})
+
+    def test_rebuilt_when_a_subscription_runs_out(self):
+        self.assertEqual(self.select(), {self.served.pk})
+        later = timezone.now() + timedelta(days=11)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            self.assertEqual(self.select(), set())
+
+    @override_settings(ADS_POOL_MAX_AGE=300)
+    def test_rebuilt_after_max_age(self):
+        self.assertEqual(self.select(), {self.served.pk})
+        # no signals, the pool only notices once it is too old
+        ImageUpload.objects.filter(pk=self.paused.pk).update(priority=1)
+        self.assertEqual(self.select(), {self.served.pk})
+        with mock.patch.object(ads.time, "monotonic", return_value=time.monotonic() + 301):
+            self.assertEqual(self.select(), {self.served.pk, self.paused.pk})
@@ -0,0 +1,108 @@
+import os
+import re
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+# Leading bytes of the image formats we accept, checked on the first chunk so
+# a bogus upload is rejected before the rest of it is transferred.
+IMAGE_SIGNATURES = {
+    'image/jpeg': (b'\xff\xd8\xff',),
+    'image/png': (b'\x89PNG\r\n\x1a\n',),
+    'image/gif': (b'GIF87a', b'GIF89a'),
+    'image/webp': (b'RIFF',),
+}
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class AssembledUpload(UploadedFile):
+    """
+    A finished chunked upload. Exposing ``temporary_file_path`` lets Pillow
+    validate it from disk and lets FileSystemStorage move it into MEDIA_ROOT
+    instead of copying it through memory.
+    """
+
+    def __init__(self, path, name, content_type, size):
+        super().__init__(open(path, 'rb'), name, content_type, size)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def get_upload_dir():
+    path = settings.CHUNKED_UPLOAD_DIR
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_upload_path(upload):
+    return os.path.join(get_upload_dir(), f'{upload.pk}.part')
+
+
+def matches_signature(content_type, head):
+    if content_type == 'image/webp':
+        return head[:4] == b'RIFF' and head[8:12] == b'WEBP'
+    return any(head.startswith(sig) for sig in IMAGE_SIGNATURES.get(content_type, ()))
+
+
+def parse_content_range(header, upload):
+    """Return ``(start, end)`` (end exclusive) from a ``Content-Range`` header."""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        raise UploadError("Content-Range header 'bytes start-end/total' is required.", 400)
+    start, last, total = (int(part) for part in match.groups())
+    if total != upload.size or last < start or last >= upload.size:
+        raise UploadError("Content-Range does not match the declared upload size.", 416)
+    if last - start + 1 > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        raise UploadError("Chunk is larger than CHUNKED_UPLOAD_MAX_CHUNK_SIZE.", 413)
+    return start, last + 1
+
+
+def check_chunk_length(content_length, start, end):
+    """The request body must hold exactly the bytes of the Content-Range."""
+    try:
+        length = int(content_length)
+    except (TypeError, ValueError):
+        raise UploadError("Content-Length header is required.", 411)
+    if length != end - start:
+        raise UploadError("Content-Length does not match the Content-Range.", 400)
+
+
+def write_chunk(upload, stream, start, end):
+    """
+    Stream ``end - start`` bytes from ``stream`` into the upload's temp file at
+    ``start``, READ_SIZE at a time. Returns the number of bytes written.
+    """
+    path = get_upload_path(upload)
+    expected = end - start
+    written = 0
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as fh:
+        fh.seek(start)
+        while written < expected:
+            data = stream.read(min(READ_SIZE, expected - written))
+            if not data:
+                break
+            if start == 0 and written == 0 and not matches_signature(upload.content_type, data[:12]):
+                raise UploadError(f"File content is not {upload.content_type}.", 415)
+            fh.write(data)
+            written += len(data)
+    if written != expected:
+        raise UploadError("Request body is shorter than the Content-Range.", 400)
+    return written
+
+
+def discard_upload(upload):
+    try:
+        os.remove(get_upload_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
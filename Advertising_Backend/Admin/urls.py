@@ -1,13 +1,20 @@
 from django.urls import path
+from . import async_views
+from .metrics import metrics_view
 from .views import CategoryRetrieveUpdateDestroyView, EditUserByIdView, RegisterView, LoginView, \
     SubCategoryRetrieveUpdateDestroyView, SubscriptionDetailView, SubscriptionListCreateView, UserList, UserProfileView, \
     YoutubeVideoDetailView, YoutubeVideoListCreateView, CarouselListCreateView, CarouselDetailView
 
-from .views import CategoryListCreateView, SubCategoryListCreateView, ImageUploadView,ImageUploadDeleteView
+from .views import CategoryListCreateView, SubCategoryListCreateView, ImageUploadView,ImageUploadDeleteView, CategoryTreeView
+from .views import ImageBulkUploadView, ImageBulkDeleteView, HomeView
+from .views import ChunkedUploadCreateView, ChunkedUploadChunkView, ChunkedUploadCompleteView
+from .views import AdSelectionView, CreativeEventView, CreativeStatsView
 
 
 urlpatterns = [
     
+    path('home/', HomeView.as_view(), name='home'),
+    path('metrics/', metrics_view, name='metrics'),
     path('signup/', RegisterView.as_view(), name='signup'),
     path('login/', LoginView.as_view(), name='login'),
     path('users/',UserList.as_view(),name='users'),
@@ -16,6 +23,7 @@ urlpatterns = [
 
 
      path('categories/', CategoryListCreateView.as_view(), name='category-list'),
+    path('categories/tree/', CategoryTreeView.as_view(), name='category-tree'),
     path('categories/<int:pk>/', CategoryRetrieveUpdateDestroyView.as_view(), name='category-detail'),
 
     path('subcategories/', SubCategoryListCreateView.as_view(), name='subcategory-list'),
@@ -23,6 +31,8 @@ urlpatterns = [
 
     path('images/', ImageUploadView.as_view(), name='image-upload'),
     path('images/<int:pk>/', ImageUploadDeleteView.as_view(), name='image-delete'),
+    path('images/bulk/', ImageBulkUploadView.as_view(), name='image-bulk-upload'),
+    path('images/bulk-delete/', ImageBulkDeleteView.as_view(), name='image-bulk-delete'),
 
     path('videos/', YoutubeVideoListCreateView.as_view(), name='video-list-create'),
     path('videos/<int:pk>/', YoutubeVideoDetailView.as_view(), name='video-detail'),
@@ -32,4 +42,18 @@ urlpatterns = [
     path('subscriptions/', SubscriptionListCreateView.as_view(), name='subscription-list-create'),
     path('subscriptions/<int:pk>/', SubscriptionDetailView.as_view(), name='subscription-detail'),
 
+    # async (ASGI) read-only versions of the hot list endpoints
+    path('async/images/', async_views.image_feed, name='async-image-feed'),
+    path('async/videos/', async_views.video_list, name='async-video-list'),
+    path('async/carousels/', async_views.carousel_list, name='async-carousel-list'),
+    path('async/categories/', async_views.category_list, name='async-category-list'),
+
+    path('uploads/', ChunkedUploadCreateView.as_view(), name='chunked-upload-create'),
+    path('uploads/<uuid:pk>/', ChunkedUploadChunkView.as_view(), name='chunked-upload-chunk'),
+    path('uploads/<uuid:pk>/complete/', ChunkedUploadCompleteView.as_view(), name='chunked-upload-complete'),
+
+    path('events/', CreativeEventView.as_view(), name='creative-events'),
+    path('stats/creatives/', CreativeStatsView.as_view(), name='creative-stats'),
+    path('ads/', AdSelectionView.as_view(), name='ad-selection'),
+
 ]
\ No newline at end of file
@@ -12,11 +12,42 @@ from rest_framework import generics, status, permissions, viewsets
 from rest_framework.views import APIView
 from .serializers import RegisterSerializer, LoginSerializer, UserSerializer
 from rest_framework.permissions import AllowAny,IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import tokens_for_user
 
 from rest_framework import generics, permissions
 from .models import Subscription
 from .serializers import SubscriptionSerializer
+from .pagination import KeysetPagination
+from .projections import ImageUploadProjection, ProjectionListMixin, SubscriptionProjection, UserProjection
+from .filters import SubscriptionFilter, UserFilter
+from .cache import etag_matches, get_taxonomy, invalidate_taxonomy
+from .serializers import CategoryTreeSerializer
+from django.shortcuts import get_object_or_404
+from .models import ChunkedUpload
+from .serializers import ChunkedUploadSerializer, ChunkedUploadCompleteSerializer
+from .serializers import ImageBulkUploadSerializer, ImageBulkDeleteSerializer
+from .blobs import retain_media
+from .home import get_home_payload, invalidate_sections
+from .middleware import accepted_encodings
+from .images import schedule_variants
+import gzip
+from collections import Counter
+from functools import partial
+from django.http import HttpResponse
+from django.conf import settings
+from django.db import transaction
+from rest_framework import serializers
+from rest_framework.fields import get_error_detail
+from django.core.exceptions import ValidationError as DjangoValidationError
+from .uploads import AssembledUpload, UploadError, check_chunk_length, discard_upload, get_upload_path, \
+    parse_content_range, write_chunk
+from . import ads, counters
+from .models import CreativeStat
+from .serializers import AdSelectionQuerySerializer, CreativeEventBatchSerializer, CreativeStatsQuerySerializer
+from datetime import timedelta
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
 User=get_user_model()
@@ -34,7 +65,7 @@ class LoginView(APIView):
         serializer.is_valid(raise_exception=True)
 
         user = serializer.validated_data['user']
-        refresh = RefreshToken.for_user(user)
+        refresh = tokens_for_user(user)
 
         return Response({
             "user": UserSerializer(user).data,
@@ -42,16 +73,17 @@ class LoginView(APIView):
             "access": str(refresh.access_token)
         })
 
-class UserList(generics.ListAPIView):
-    queryset = User.objects.all()
+class UserList(ProjectionListMixin, generics.ListAPIView):
+    queryset = User.objects.select_related('subscriptions')
     serializer_class = UserSerializer
+    projection_class = UserProjection
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['username', 'email', 'phone','id']
+    filterset_class = UserFilter
     permission_classes =  [AllowAny]
 
 
 class EditUserByIdView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = User.objects.all()
+    queryset = User.objects.select_related('subscriptions')
     serializer_class = EditUserSerializer
     # permission_classes = [permissions.IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser,JSONParser]
@@ -84,40 +116,97 @@ class UserProfileView(APIView):
 # -----------------------------------------------------------
 
 
-class CategoryListCreateView(generics.ListCreateAPIView):
+class TaxonomyCacheMixin:
+    """
+    Serves list GETs from the versioned taxonomy cache (with ETag /
+    If-None-Match) and invalidates it on every write.
+    """
+    taxonomy_name = None
+
+    def list(self, request, *args, **kwargs):
+        def build():
+            queryset = self.filter_queryset(self.get_queryset())
+            return self.get_serializer(queryset, many=True).data
+
+        etag, data = get_taxonomy(self.taxonomy_name, build)
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(data, headers={'ETag': etag})
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        invalidate_taxonomy()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        invalidate_taxonomy()
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        invalidate_taxonomy()
+
+
+class CategoryListCreateView(TaxonomyCacheMixin, generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    taxonomy_name = 'categories'
 
 
-class SubCategoryListCreateView(generics.ListCreateAPIView):
+class SubCategoryListCreateView(TaxonomyCacheMixin, generics.ListCreateAPIView):
     queryset = SubCategory.objects.all()
     serializer_class = SubCategorySerializer
+    taxonomy_name = 'subcategories'
+
+class CategoryTreeView(TaxonomyCacheMixin, generics.ListAPIView):
+    queryset = Category.objects.prefetch_related('subcategories')
+    serializer_class = CategoryTreeSerializer
+    taxonomy_name = 'tree'
 
-class CategoryRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
+class CategoryRetrieveUpdateDestroyView(TaxonomyCacheMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
 
-class SubCategoryRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
+class SubCategoryRetrieveUpdateDestroyView(TaxonomyCacheMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = SubCategory.objects.all()
     serializer_class = SubCategorySerializer
 
 
 #-----------------------------------------------------------------------
 
-class ImageUploadView(generics.ListCreateAPIView):
+class ImageUploadView(ProjectionListMixin, generics.ListCreateAPIView):
     # permission_classes = [IsAuthenticated]
-    queryset = ImageUpload.objects.all()
+    queryset = ImageUpload.objects.select_related('category', 'subcategory')
     serializer_class = ImageUploadSerializer
+    projection_class = ImageUploadProjection
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['category','subcategory','id','user']
-    
+    pagination_class = KeysetPagination
+
+    # Deprecated: ?paginate=false returns the whole (filtered) table as a plain
+    # list, like before cursor pagination. Will be removed in the next release.
+    legacy_query_param = 'paginate'
+
+    def is_legacy_request(self):
+        return self.request.query_params.get(self.legacy_query_param, '').lower() in ('false', '0', 'no')
+
+    def paginate_queryset(self, queryset):
+        if self.is_legacy_request():
+            return None
+        return super().paginate_queryset(queryset)
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if self.is_legacy_request():
+            response['Deprecation'] = 'true'
+            response['Warning'] = '299 - "Unpaginated image list is deprecated, use the cursor-paginated feed"'
+        return response
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 class ImageUploadDeleteView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = ImageUpload.objects.all()
+    queryset = ImageUpload.objects.select_related('category', 'subcategory')
     serializer_class = ImageUploadSerializer
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
@@ -132,6 +221,113 @@ class ImageUploadDeleteView(generics.RetrieveUpdateDestroyAPIView):
 
 
 
+class ImageBulkUploadView(APIView):
+    """
+    POST many images with one shared category/subcategory: multipart fields
+    ``category``, ``subcategory`` and ``images`` (repeated). Valid files are
+    written with a single bulk_create; invalid ones are reported by index.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        meta = ImageBulkUploadSerializer(data=request.data)
+        meta.is_valid(raise_exception=True)
+        files = request.FILES.getlist('images')
+        if not files:
+            return Response({'images': ["No files were submitted."]}, status=status.HTTP_400_BAD_REQUEST)
+        if len(files) > settings.BULK_IMAGE_MAX_ITEMS:
+            return Response({'images': [f"At most {settings.BULK_IMAGE_MAX_ITEMS} files per request."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        image_field = serializers.ImageField()
+        images, errors = [], []
+        for index, file in enumerate(files):
+            try:
+                image_field.run_validation(file)
+            except (serializers.ValidationError, DjangoValidationError) as exc:
+                errors.append({'index': index, 'name': file.name, 'errors': get_error_detail(exc)})
+                continue
+            images.append(ImageUpload(user=request.user, image=file, **meta.validated_data))
+
+        if images:
+            # bulk_create sends no post_save, so count the blob references
+            # and queue the variants ourselves
+            with transaction.atomic():
+                ImageUpload.objects.bulk_create(images)
+                names = Counter(image.image.name for image in images)
+                retain_media(names)
+                invalidate_sections(['images'])
+                ads.invalidate_pools([meta.validated_data['category'].pk], [meta.validated_data['subcategory'].pk])
+            storage = ImageUpload._meta.get_field('image').storage
+            for name in names:
+                schedule_variants(name, storage, on_ready=partial(invalidate_sections, ['images']))
+
+        return Response({
+            'created': ImageUploadSerializer(images, many=True, context={'request': request}).data,
+            'errors': errors,
+        }, status=bulk_status(images, errors, success=status.HTTP_201_CREATED))
+
+
+class ImageBulkDeleteView(APIView):
+    """
+    POST ``{"ids": [...]}`` to delete many images, and their files, at once.
+    Staff may delete any image, other users only their own.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = ImageBulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+
+        rows = {row['id']: row for row in ImageUpload.objects.filter(id__in=ids).values('id', 'user_id', 'image')}
+        deleted, errors = [], []
+        for pk in ids:
+            row = rows.get(pk)
+            if row is None:
+                errors.append({'id': pk, 'error': "Not found."})
+            elif not request.user.is_staff and row['user_id'] != request.user.id:
+                errors.append({'id': pk, 'error': "You do not have permission to delete this image."})
+            else:
+                deleted.append(pk)
+
+        if deleted:
+            # files are queued for removal by the post_delete handler (signals.delete_media)
+            ImageUpload.objects.filter(id__in=deleted).delete()
+
+        return Response({'deleted': deleted, 'errors': errors}, status=bulk_status(deleted, errors))
+
+
+def bulk_status(succeeded, errors, success=status.HTTP_200_OK):
+    # 207 when only some items went through, 400 when none did
+    if not errors:
+        return success
+    return status.HTTP_207_MULTI_STATUS if succeeded else status.HTTP_400_BAD_REQUEST
+
+
+class HomeView(APIView):
+    """
+    Everything the app shows on launch in one round trip, see home.py.
+    The payload is cached gzipped and sent as-is to clients that accept it.
+    """
+
+    def get(self, request):
+        etag, blob = get_home_payload(request)
+        gzipped = accepted_encodings(request.headers.get('Accept-Encoding')).get('gzip', 0) > 0
+        if gzipped:
+            # a different representation, it must not share the strong ETag
+            etag = etag[:-1] + '-gzip"'
+        headers = {'ETag': etag, 'Vary': 'Accept-Encoding'}
+        if etag_matches(request, etag):
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        if gzipped:
+            headers['Content-Encoding'] = 'gzip'
+        else:
+            blob = gzip.decompress(blob)
+        return HttpResponse(blob, content_type='application/json', headers=headers)
+
+
 #-----------------------------------------------------------------------
 
 
@@ -148,10 +344,13 @@ class YoutubeVideoDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 
 
-class SubscriptionListCreateView(generics.ListCreateAPIView):
-    queryset = Subscription.objects.all()
+class SubscriptionListCreateView(ProjectionListMixin, generics.ListCreateAPIView):
+    queryset = Subscription.objects.select_related('user')
     serializer_class = SubscriptionSerializer
+    projection_class = SubscriptionProjection
     permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = SubscriptionFilter
 
     def perform_create(self, serializer):
         serializer.save()    # respects user_id from request data
@@ -159,7 +358,7 @@ class SubscriptionListCreateView(generics.ListCreateAPIView):
 
 
 class SubscriptionDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Subscription.objects.all()
+    queryset = Subscription.objects.select_related('user')
     serializer_class = SubscriptionSerializer
     permission_classes = [permissions.IsAdminUser]
 
@@ -167,8 +366,8 @@ class SubscriptionDetailView(generics.RetrieveUpdateDestroyAPIView):
         user = self.request.user
         if user.is_staff:  
             # staff/admin can update any subscription
-            return Subscription.objects.all()
-        return Subscription.objects.filter(user=user)
+            return self.queryset.all()
+        return self.queryset.filter(user_id=user.id)
 
 
 
@@ -183,4 +382,174 @@ class CarouselListCreateView(generics.ListCreateAPIView):
 class CarouselDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Carousel.objects.all()
     serializer_class = CarouselSerializer
-    parser_classes = [MultiPartParser, FormParser]
\ No newline at end of file
+    parser_classes = [MultiPartParser, FormParser]
+
+
+#-----------------------------------------------------------------------
+# Resumable chunked uploads: POST uploads/ -> PUT uploads/<id>/ (repeat,
+# with Content-Range) -> POST uploads/<id>/complete/. Chunks are streamed to
+# a temp file, so worker memory does not depend on the file size.
+
+
+class ChunkedUploadCreateView(generics.CreateAPIView):
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+
+class ChunkedUploadChunkView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_object(self):
+        return get_object_or_404(ChunkedUpload, pk=self.kwargs['pk'], user_id=self.request.user.id)
+
+    def get(self, request, pk):
+        return Response(ChunkedUploadSerializer(self.get_object()).data)
+
+    def put(self, request, pk):
+        upload = self.get_object()
+        try:
+            start, end = parse_content_range(request.headers.get('Content-Range'), upload)
+            if start != upload.offset:
+                raise UploadError(f"Expected a chunk starting at byte {upload.offset}.", status.HTTP_409_CONFLICT)
+            check_chunk_length(request.META.get('CONTENT_LENGTH'), start, end)
+            # DRF has no stream for an empty body
+            if request.stream is None:
+                raise UploadError("Request body is empty.", status.HTTP_400_BAD_REQUEST)
+            write_chunk(upload, request.stream, start, end)
+        except UploadError as exc:
+            return Response({'detail': exc.message, 'offset': upload.offset}, status=exc.status_code)
+
+        # another request may have written the same range meanwhile, only one of them advances
+        if not ChunkedUpload.objects.filter(pk=upload.pk, offset=start).update(offset=end):
+            upload.refresh_from_db()
+            return Response({'detail': "Concurrent chunk upload.", 'offset': upload.offset},
+                            status=status.HTTP_409_CONFLICT)
+        upload.offset = end
+        return Response(ChunkedUploadSerializer(upload).data)
+
+    def delete(self, request, pk):
+        discard_upload(self.get_object())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ChunkedUploadCompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        upload = get_object_or_404(ChunkedUpload, pk=pk, user_id=request.user.id)
+        if not upload.is_complete:
+            return Response({'detail': "Upload is not complete.", 'offset': upload.offset},
+                            status=status.HTTP_409_CONFLICT)
+        options = ChunkedUploadCompleteSerializer(data=request.data)
+        options.is_valid(raise_exception=True)
+        target = options.validated_data['target']
+
+        file = AssembledUpload(get_upload_path(upload), upload.filename, upload.content_type, upload.size)
+        try:
+            if target == 'image':
+                serializer = ImageUploadSerializer(data={
+                    'category': options.validated_data['category'],
+                    'subcategory': options.validated_data['subcategory'],
+                    'image': file,
+                }, context={'request': request})
+                serializer.is_valid(raise_exception=True)
+                serializer.save(user=request.user)
+            else:
+                serializer = EditUserSerializer(request.user, data={target: file}, partial=True,
+                                                context={'request': request})
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+        finally:
+            file.close()
+        discard_upload(upload)
+        return Response(serializer.data, status=status.HTTP_201_CREATED if target == 'image' else status.HTTP_200_OK)
+
+
+#---------------------------------------------------
+class CreativeEventView(APIView):
+    """
+    POST ``{"events": [{"creative": "image", "id": 12, "type": "impression"}, ...]}``.
+    Events are only counted in memory here (see counters.py); ids are not
+    checked, the reports are keyed by them.
+    """
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        serializer = CreativeEventBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        events = serializer.validated_data['events']
+        for event in events:
+            counters.record(event['creative'], event['id'], event['type'], event['count'])
+        return Response({'accepted': len(events)}, status=status.HTTP_202_ACCEPTED)
+
+
+class CreativeStatsView(APIView):
+    """
+    Impressions, clicks and click-through rate per creative, from the
+    flushed CreativeStat buckets (the last COUNTER_FLUSH_INTERVAL seconds
+    may be missing). Filters: ``creative``, ``id``, ``since`` (default: 7
+    days ago), ``until``; ``interval`` is ``bucket``, ``day`` or ``total``.
+    Staff see every creative, other users the images they uploaded.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = CreativeStatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        stats = CreativeStat.objects.filter(bucket__gte=params.get('since') or timezone.now() - timedelta(days=7))
+        if params.get('until'):
+            stats = stats.filter(bucket__lt=params['until'])
+        if params.get('creative'):
+            stats = stats.filter(kind=params['creative'])
+        if params.get('id'):
+            stats = stats.filter(creative_id=params['id'])
+        if not request.user.is_staff:
+            stats = stats.filter(kind='image', creative_id__in=ImageUpload.objects.filter(user=request.user).values('id'))
+
+        group = ['kind', 'creative_id']
+        if params['interval'] == 'bucket':
+            stats = stats.annotate(period=F('bucket'))
+        elif params['interval'] == 'day':
+            stats = stats.annotate(period=TruncDay('bucket'))
+        if params['interval'] != 'total':
+            group.append('period')
+        rows = (stats.values(*group)
+                .annotate(impression_count=Sum('impressions'), click_count=Sum('clicks'))
+                .order_by(*reversed(group)))
+
+        return Response([{
+            'creative': row['kind'],
+            'id': row['creative_id'],
+            'period': row.get('period'),
+            'impressions': row['impression_count'],
+            'clicks': row['click_count'],
+            'ctr': round(row['click_count'] / row['impression_count'], 4) if row['impression_count'] else None,
+        } for row in rows])
+
+
+class AdSelectionView(APIView):
+    """
+    ``GET /ads/?subcategory=<id>&count=<n>`` (or ``category=``): up to ``count``
+    distinct creatives drawn by priority from the images of subscribed owners,
+    in the /images/ item format. See ads.py.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        query = AdSelectionQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        scope = 'subcategory' if 'subcategory' in params else 'category'
+        ids = ads.select(scope, params[scope], params['count'])
+
+        projection = ImageUploadProjection(context={'request': request})
+        rows = {row['id']: row for row in projection.values(ImageUpload.objects.filter(pk__in=ids))}
+        # a creative deleted since the pool was built is simply left out
+        response = Response(projection.represent(rows[pk] for pk in ids if pk in rows))
+        response['Cache-Control'] = 'no-store'
+        return response
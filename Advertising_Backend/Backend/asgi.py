@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+Serve it with any ASGI server, e.g. ``uvicorn Backend.asgi:application --workers 4``.
+The async/ endpoints (Admin/async_views.py) then run natively on the event loop.
 """
 
 import os
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from datetime import timedelta
 import os
+
+import django
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -29,8 +31,19 @@ DEBUG = True
 
 ALLOWED_HOSTS = ["*"]
 
+# Public base URL (e.g. https://api.example.com) for links in responses shared
+# between clients, such as the cached /home/ payload. Unset, they are paths.
+SITE_URL = os.environ.get("SITE_URL", "")
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Media is served by Admin.media.serve_media. Set MEDIA_ACCEL to "x-accel-redirect"
+# (nginx, internal location at MEDIA_ACCEL_PREFIX) or "x-sendfile" to let the
+# proxy send the bytes.
+MEDIA_ACCEL = os.environ.get("MEDIA_ACCEL") or None
+MEDIA_ACCEL_PREFIX = os.environ.get("MEDIA_ACCEL_PREFIX", "/protected-media/")
+# Cache lifetime for media outside cas/, which is cached forever
+MEDIA_CACHE_MAX_AGE = 3600
 
 # Application definition
 
@@ -47,7 +60,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "Admin.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "Admin.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -80,12 +95,124 @@ WSGI_APPLICATION = "Backend.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DATABASE_ENGINE=postgresql for production. Connections are kept open for
+# DB_CONN_MAX_AGE seconds and health-checked before reuse, or, with DB_POOL=1
+# (Django >= 5.1 and psycopg 3), taken from a connection pool instead.
+# Otherwise SQLite is used; Admin/db.py applies the SQLITE_PRAGMAS below to
+# every new connection. WAL mode is written into the database file itself, so
+# it is only switched on with SQLITE_WAL=1 and the checked-in db.sqlite3 stays
+# untouched by default.
+
+DATABASE_ENGINE = os.environ.get("DATABASE_ENGINE", "sqlite")
+
+if DATABASE_ENGINE == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DB_NAME", "advertising"),
+            "USER": os.environ.get("DB_USER", "advertising"),
+            "PASSWORD": os.environ.get("DB_PASSWORD", ""),
+            "HOST": os.environ.get("DB_HOST", "127.0.0.1"),
+            "PORT": os.environ.get("DB_PORT", "5432"),
+            "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {},
+        }
+    }
+    if os.environ.get("DB_POOL"):
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", 2)),
+            "max_size": int(os.environ.get("DB_POOL_MAX_SIZE", 10)),
+            "timeout": int(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        }
+        # a pool replaces persistent connections, Django refuses both
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+            "OPTIONS": {
+                # seconds a writer waits for the lock before "database is locked"
+                "timeout": 20,
+            },
+        }
+    }
+    if django.VERSION >= (5, 1):
+        # take the write lock when the transaction starts instead of failing
+        # halfway through when a read transaction tries to upgrade
+        DATABASES["default"]["OPTIONS"]["transaction_mode"] = "IMMEDIATE"
+
+SQLITE_WAL = bool(os.environ.get("SQLITE_WAL"))
+SQLITE_PRAGMAS = {
+    "busy_timeout": 20000,
+    "temp_store": "MEMORY",
+    "cache_size": -20000,  # KiB
+    "mmap_size": 128 * 1024 * 1024,
+}
+if SQLITE_WAL:
+    # synchronous=NORMAL can only lose the last commits on power loss in WAL mode,
+    # with a rollback journal it can corrupt the file
+    SQLITE_PRAGMAS = {"journal_mode": "WAL", "synchronous": "NORMAL", **SQLITE_PRAGMAS}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Local memory by default (tests, single process). Set CACHE_URL to share the
+# cache between workers, e.g. redis://127.0.0.1:6379/1 or memcached://127.0.0.1:11211
+
+CACHE_URL = os.environ.get("CACHE_URL", "")
+
+if CACHE_URL.startswith(("redis://", "rediss://")):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
+elif CACHE_URL.startswith("memcached://"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+            "LOCATION": CACHE_URL[len("memcached://"):],
+        }
     }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Category/subcategory taxonomy cache (Admin/cache.py)
+TAXONOMY_CACHE_ALIAS = "default"
+TAXONOMY_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/4.2/topics/auth/passwords/
+# PASSWORD_HASHER picks the algorithm new hashes use ("pbkdf2" or "argon2",
+# the latter needs argon2-cffi). Cost parameters left unset use Django's
+# defaults; measure candidates with `manage.py benchmark_password_hashers`.
+# Hashes made with other algorithms or parameters still verify and are
+# re-hashed on the next successful login.
+
+PASSWORD_HASHER = os.environ.get("PASSWORD_HASHER", "pbkdf2")
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get("PASSWORD_PBKDF2_ITERATIONS", 0)) or None
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get("PASSWORD_ARGON2_TIME_COST", 0)) or None
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get("PASSWORD_ARGON2_MEMORY_COST", 0)) or None  # KiB
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get("PASSWORD_ARGON2_PARALLELISM", 0)) or None
+
+_TUNED_PASSWORD_HASHERS = {
+    "pbkdf2": "Admin.hashers.TunedPBKDF2PasswordHasher",
+    "argon2": "Admin.hashers.TunedArgon2PasswordHasher",
 }
+PASSWORD_HASHERS = [_TUNED_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _TUNED_PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + [
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
 
 
 # Password validation
@@ -124,6 +251,69 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Admin.metrics: share of requests whose DB, serialization and render time is
+# measured. Their Server-Timing header goes to staff only, unless
+# METRICS_PUBLIC_SERVER_TIMING. /metrics/ answers staff and "Authorization:
+# Bearer <METRICS_TOKEN>", or anyone with METRICS_PUBLIC.
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", 0.1))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN") or None
+METRICS_PUBLIC = bool(os.environ.get("METRICS_PUBLIC"))
+METRICS_PUBLIC_SERVER_TIMING = bool(os.environ.get("METRICS_PUBLIC_SERVER_TIMING"))
+
+# Admin.slow_queries: queries taking at least SLOW_QUERY_THRESHOLD_MS are
+# appended to SLOW_QUERY_LOG (JSON lines) with their plan; 0 turns it off.
+# "manage.py slow_queries" summarises the log.
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 200))
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", os.path.join(BASE_DIR, "tmp", "slow_queries.jsonl"))
+
+# Admin.middleware.CompressionMiddleware: brotli or gzip for text responses
+# of at least COMPRESSION_MIN_SIZE bytes, at the best level expected to take
+# no more than COMPRESSION_CPU_BUDGET_MS of CPU.
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_CPU_BUDGET_MS = 20
+
+# Cached launch payload served at /home/ (Admin/home.py)
+HOME_CACHE_ALIAS = "default"
+HOME_CACHE_TIMEOUT = 60 * 60 * 24
+HOME_GZIP_LEVEL = 6
+
+# Resized derivatives of uploaded images (Admin/images.py)
+IMAGE_VARIANT_WIDTHS = (320, 640, 1080)
+IMAGE_VARIANT_QUALITY = 80
+
+# Uploads are stored once per content hash under MEDIA_ROOT/cas (Admin/storage.py).
+# Unreferenced blobs touched more recently than this (seconds) are left to
+# collect_orphan_media, an identical upload may be about to reuse them.
+MEDIA_BLOB_DELETE_GRACE = 300
+
+# Thread pool for work that must not block the request (Admin/tasks.py)
+BACKGROUND_TASK_WORKERS = int(os.environ.get("BACKGROUND_TASK_WORKERS", 2))
+BACKGROUND_TASKS_EAGER = False
+
+# Resumable chunked uploads (Admin/uploads.py)
+CHUNKED_UPLOAD_DIR = os.path.join(BASE_DIR, "tmp", "chunked_uploads")
+CHUNKED_UPLOAD_MAX_SIZE = 50 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 5 * 1024 * 1024
+
+# Most files / ids accepted by images/bulk/ and images/bulk-delete/
+BULK_IMAGE_MAX_ITEMS = 200
+# Parsed multipart fields per request, must leave room for BULK_IMAGE_MAX_ITEMS files
+DATA_UPLOAD_MAX_NUMBER_FILES = 250
+
+# Impression/click counters (Admin/counters.py): counts are kept in memory per
+# COUNTER_BUCKET_SECONDS bucket and written out every COUNTER_FLUSH_INTERVAL
+# seconds, or once COUNTER_FLUSH_SIZE creative/bucket pairs are waiting.
+COUNTER_BUCKET_SECONDS = 3600
+COUNTER_FLUSH_INTERVAL = 10
+COUNTER_FLUSH_SIZE = 5000
+# Most events accepted by one POST to events/
+COUNTER_MAX_EVENTS = 500
+
+# Most creatives one GET /ads/ may ask for, and seconds before an ad pool is
+# rebuilt even if nothing bumped it (Admin/ads.py)
+ADS_MAX_COUNT = 10
+ADS_POOL_MAX_AGE = 300
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -131,8 +321,12 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': (
+        'Admin.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'Admin.authentication.ClaimsJWTAuthentication',
 
     ),
      'DEFAULT_FILTER_BACKENDS': [
@@ -146,6 +340,14 @@ SIMPLE_JWT = {
 
 AUTH_USER_MODEL = 'Admin.CustomUser'
 
+# ClaimsJWTAuthentication (Admin/authentication.py): seconds a loaded user row
+# is reused by this process, and the cache (and lifetime) of the is_active /
+# is_staff state checked on every request. A missing entry is read from the DB.
+AUTH_USER_CACHE_TTL = 30
+AUTH_USER_CACHE_SIZE = 10000
+AUTH_STATE_CACHE_ALIAS = "default"
+AUTH_STATE_CACHE_TIMEOUT = 300
+
 AUTHENTICATION_BACKENDS = [
     'Admin.backends.EmailOrPhoneBackend',
 ]